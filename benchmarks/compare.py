@@ -0,0 +1,101 @@
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+# Comparison of benchmark results (see `benchmarks.run`) against a baseline.
+# A metric regresses when it is worse than the baseline by more than the
+# tolerance (relative change). Only the runs present in both are compared.
+
+HIGHER_IS_BETTER = ["docs_per_sec", "tokens_per_sec"]
+LOWER_IS_BETTER = ["latency_p50_ms", "latency_p95_ms", "latency_p99_ms"]
+BACKEND_LOWER_IS_BETTER = ["load_time_s", "peak_rss_mb"]
+
+
+def _change(value: float, reference: float) -> float:
+    return (value - reference) / reference if reference else 0.0
+
+
+def _check(regressions: List[Dict], where: Dict, metric: str, value, reference, tolerance: float,
+           higher_is_better: bool) -> None:
+    if value is None or reference is None:
+        return
+    change = _change(value, reference)
+    if (-change if higher_is_better else change) > tolerance:
+        regression = dict(where)
+        regression.update({"metric": metric, "baseline": reference, "value": value, "change": change})
+        regressions.append(regression)
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.1) -> List[Dict]:
+    """Finds the metrics of `results` that got worse than in `baseline`
+
+    Args:
+            results (Dict): benchmark results, as written by `benchmarks.run`
+            baseline (Dict): benchmark results to compare against
+            tolerance (float): relative change that is tolerated (0.1 is 10%)
+
+    Returns:
+            List[Dict]: one dict per regression, with the model (and document length and
+            batch size for per-run metrics), the metric, both values and the relative change
+    """
+    regressions = []  # type: List[Dict]
+    baseline_backends = {backend["model"]: backend for backend in baseline["backends"]}
+    for backend in results["backends"]:
+        reference = baseline_backends.get(backend["model"])
+        if reference is None or "error" in reference:
+            continue
+        if "error" in backend:
+            regressions.append({"model": backend["model"], "metric": "error", "baseline": None,
+                                "value": backend["error"], "change": None})
+            continue
+        where = {"model": backend["model"]}
+        for metric in BACKEND_LOWER_IS_BETTER:
+            _check(regressions, where, metric, backend.get(metric), reference.get(metric), tolerance, False)
+        reference_runs = {(run["doc_length"], run["batch_size"]): run for run in reference["runs"]}
+        for run in backend["runs"]:
+            reference_run = reference_runs.get((run["doc_length"], run["batch_size"]))
+            if reference_run is None:
+                continue
+            where = {"model": backend["model"], "doc_length": run["doc_length"], "batch_size": run["batch_size"]}
+            for metric in HIGHER_IS_BETTER:
+                _check(regressions, where, metric, run[metric], reference_run[metric], tolerance, True)
+            for metric in LOWER_IS_BETTER:
+                _check(regressions, where, metric, run[metric], reference_run[metric], tolerance, False)
+    return regressions
+
+
+def print_regressions(regressions: List[Dict]) -> None:
+    if not regressions:
+        print("No regressions against the baseline")
+        return
+    print("%d regression(s) against the baseline:" % len(regressions))
+    for regression in regressions:
+        if regression["metric"] == "error":
+            print("  %s failed: %s" % (regression["model"], regression["value"]))
+            continue
+        run = ""
+        if "doc_length" in regression:
+            run = " (length %d, batch %d)" % (regression["doc_length"], regression["batch_size"])
+        print("  %s%s %s: %.4g -> %.4g (%+.1f%%)" % (
+            regression["model"], run, regression["metric"], regression["baseline"], regression["value"],
+            100 * regression["change"]))
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare")
+    parser.add_argument("results")
+    parser.add_argument("baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+    with open(args.results, encoding="utf-8") as f:
+        results = json.load(f)
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    print_regressions(regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
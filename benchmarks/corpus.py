@@ -0,0 +1,176 @@
+import random
+from typing import Iterator, List, Tuple
+
+import attr
+
+# Deterministic synthetic Spanish corpus for benchmarks: sentences are built
+# from a fixed vocabulary with a seeded random generator, and borrowings
+# (English and other languages, one or several words long) are injected at a
+# given rate. Every document comes with its gold BIO labels, so the same
+# corpus can be used to check that the outputs did not change.
+
+DETERMINERS = ["el", "la", "los", "las", "un", "una", "unos", "unas", "este", "esta", "su", "sus"]
+NOUNS = [
+    "gobierno", "ciudad", "empresa", "mercado", "proyecto", "sector", "festival", "equipo", "semana",
+    "propuesta", "campaña", "consumo", "tecnología", "presidenta", "temporada", "reunión", "jornada",
+    "plataforma", "economía", "vivienda", "estudio", "familia", "escuela", "comunidad", "público",
+]
+ADJECTIVES = [
+    "nuevo", "nueva", "grande", "pequeño", "digital", "europeo", "sencillo", "público", "local",
+    "último", "primera", "importante", "social", "cultural", "económico", "reciente", "habitual",
+]
+VERBS = [
+    "presenta", "anuncia", "celebra", "busca", "ofrece", "defiende", "organiza", "lanza", "critica",
+    "prepara", "recupera", "apuesta por", "mantiene", "cierra", "abre", "impulsa", "reclama",
+]
+PREPOSITIONS = ["de", "en", "con", "para", "por", "sobre", "desde", "hasta", "entre", "sin"]
+CONNECTORS = ["y", "pero", "aunque", "mientras", "porque", "además", "sin embargo", "así que"]
+
+ENGLISH_BORROWINGS = [
+    "look", "app", "online", "marketing", "streaming", "podcast", "smartphone", "startup", "hashtag",
+    "selfie", "influencer", "coach", "runner", "brunch", "outfit", "spoiler", "blockchain", "e-mobility",
+    "machine learning", "fake news", "big data", "smart grids", "street food", "prime time",
+    "community manager", "low cost", "data scientist", "black friday", "home office",
+]
+OTHER_BORROWINGS = [
+    "anime", "manga", "sushi", "umami", "kitsch", "leitmotiv", "karaoke", "tsunami", "ramen",
+    "dolce vita", "déjà vu", "à la carte", "kimchi", "paparazzi",
+]
+
+SYLLABLES = [consonant + vowel for consonant in "bcdfglmnprstvz" for vowel in "aeiou"]
+
+
+@attr.s
+class SyntheticDocument(object):
+    """A document of the synthetic corpus
+
+    Attributes:
+            text (str): the text of the document
+            tokens (List[str]): the tokens of the text (words and punctuation)
+            labels (List[str]): the gold BIO label of each token
+    """
+
+    text = attr.ib(type=str)
+    tokens = attr.ib(type=List[str])
+    labels = attr.ib(type=List[str])
+
+    @property
+    def borrowings(self) -> List[Tuple[str, str]]:
+        """(borrowing, language) pairs of the document"""
+        borrowings = []
+        for token, label in zip(self.tokens, self.labels):
+            if label.startswith("B-"):
+                borrowings.append([token, label[2:]])
+            elif label.startswith("I-"):
+                borrowings[-1][0] = borrowings[-1][0] + " " + token
+        return [tuple(borrowing) for borrowing in borrowings]
+
+
+@attr.s
+class SyntheticCorpus(object):
+    """Generates documents of (roughly) `doc_length` tokens, in which about
+    `borrowing_rate` of the noun slots are filled with a borrowing. The same
+    settings and seed always give the same documents.
+
+    Attributes:
+            n_docs (int): number of documents
+            doc_length (int): approximate number of tokens per document
+            borrowing_rate (float): probability that a noun slot holds a borrowing
+            other_rate (float): share of the borrowings that are not English
+            multiword_rate (float): share of the borrowings that are several words long
+            unseen_rate (float): probability that a noun slot holds a made-up word that does not
+                        appear anywhere else in the corpus (to exercise vocabularies that grow with new words)
+            seed (int): seed of the random generator
+
+    Example:
+            .. code-block:: python
+
+                    >>> from benchmarks.corpus import SyntheticCorpus
+                    >>> corpus = SyntheticCorpus(n_docs=2, doc_length=20, seed=1)
+                    >>> [doc.text for doc in corpus]
+    """
+
+    n_docs = attr.ib(type=int, default=100)
+    doc_length = attr.ib(type=int, default=100)
+    borrowing_rate = attr.ib(type=float, default=0.1)
+    other_rate = attr.ib(type=float, default=0.2)
+    multiword_rate = attr.ib(type=float, default=0.3)
+    unseen_rate = attr.ib(type=float, default=0.0)
+    seed = attr.ib(type=int, default=0)
+    _n_unseen = attr.ib(type=int, default=0, init=False, repr=False)
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def __iter__(self) -> Iterator[SyntheticDocument]:
+        rng = random.Random(self.seed)
+        self._n_unseen = 0
+        for _ in range(self.n_docs):
+            yield self._document(rng)
+
+    @property
+    def texts(self) -> List[str]:
+        return [doc.text for doc in self]
+
+    def _borrowing(self, rng: random.Random) -> Tuple[List[str], str]:
+        if rng.random() < self.other_rate:
+            candidates, language = OTHER_BORROWINGS, "OTHER"
+        else:
+            candidates, language = ENGLISH_BORROWINGS, "ENG"
+        multiword = [borrowing for borrowing in candidates if " " in borrowing]
+        singleword = [borrowing for borrowing in candidates if " " not in borrowing]
+        pool = multiword if multiword and rng.random() < self.multiword_rate else singleword
+        return rng.choice(pool).split(), language
+
+    def _unseen_word(self, rng: random.Random) -> str:
+        # a random syllable, then the number of unseen words so far spelled with syllables,
+        # so that no word is ever repeated
+        syllables = [rng.choice(SYLLABLES)]
+        n = self._n_unseen
+        self._n_unseen = n + 1
+        while True:
+            syllables.append(SYLLABLES[n % len(SYLLABLES)])
+            n = n // len(SYLLABLES)
+            if n == 0:
+                return "".join(syllables)
+
+    def _noun_phrase(self, rng: random.Random, tokens: List[str], labels: List[str]) -> None:
+        tokens.append(rng.choice(DETERMINERS))
+        labels.append("O")
+        if rng.random() < self.borrowing_rate:
+            words, language = self._borrowing(rng)
+            tokens.extend(words)
+            labels.extend(["B-" + language] + ["I-" + language] * (len(words) - 1))
+        elif self.unseen_rate and rng.random() < self.unseen_rate:
+            tokens.append(self._unseen_word(rng))
+            labels.append("O")
+        else:
+            tokens.append(rng.choice(NOUNS))
+            labels.append("O")
+        if rng.random() < 0.4:
+            tokens.append(rng.choice(ADJECTIVES))
+            labels.append("O")
+
+    def _sentence(self, rng: random.Random, tokens: List[str], labels: List[str]) -> None:
+        self._noun_phrase(rng, tokens, labels)
+        for word in rng.choice(VERBS).split():
+            tokens.append(word)
+            labels.append("O")
+        self._noun_phrase(rng, tokens, labels)
+        while rng.random() < 0.5:
+            words = rng.choice(PREPOSITIONS if rng.random() < 0.7 else CONNECTORS).split()
+            tokens.extend(words)
+            labels.extend(["O"] * len(words))
+            self._noun_phrase(rng, tokens, labels)
+        tokens.append(".")
+        labels.append("O")
+
+    def _document(self, rng: random.Random) -> SyntheticDocument:
+        tokens = []  # type: List[str]
+        labels = []  # type: List[str]
+        while len(tokens) < self.doc_length:
+            start = len(tokens)
+            self._sentence(rng, tokens, labels)
+            tokens[start] = tokens[start].capitalize()
+        text = " ".join(tokens).replace(" .", ".")
+        return SyntheticDocument(text, tokens, labels)
@@ -0,0 +1,226 @@
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from benchmarks.corpus import SyntheticCorpus
+from benchmarks.run import BACKENDS, peak_rss_mb
+
+# Memory footprint and leak benchmark of the backends of pylazaro.
+#
+#   python -m benchmarks.memory --models crf --n-calls 200000 --budget-mb 50
+#
+# Every backend (in a fresh subprocess) tags a long stream of synthetic
+# documents, with made-up words that it has never seen, one `analyze` call at
+# a time (or `analyze_batch`, see --batch-size). RSS is sampled every
+# --interval calls, and with --trace, tracemalloc snapshots tell which
+# component (pylazaro, spacy, flair, torch...) the memory that is still
+# allocated belongs to. The first interval is a warmup: growth is measured
+# from the first sample on, and the benchmark fails if the RSS of any backend
+# grew by more than --budget-mb.
+
+COMPONENTS = ["pylazaro", "spacy", "thinc", "flair", "torch", "transformers", "tokenizers", "pycrfsuite",
+              "quickvec", "numpy"]
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident memory of this process, in MB (the peak RSS where it is not available)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def component(filename: str) -> str:
+    """The package (one of `COMPONENTS`) a source file belongs to, or "other" """
+    parts = filename.replace("\\", "/").split("/")
+    for part in reversed(parts[:-1]):
+        if part in COMPONENTS:
+            return part
+    return "other"
+
+
+def component_sizes(snapshot: tracemalloc.Snapshot) -> Dict[str, int]:
+    """Bytes allocated by each component, according to a tracemalloc snapshot"""
+    sizes = {}  # type: Dict[str, int]
+    for stat in snapshot.statistics("filename"):
+        name = component(stat.traceback[0].filename)
+        sizes[name] = sizes.get(name, 0) + stat.size
+    return sizes
+
+
+def _vocab_sizes(tagger) -> Dict[str, int]:
+    spacy_model = getattr(tagger.classifier, "spacy_model", None)
+    if spacy_model is None:
+        return {}
+    return {"spacy_strings": len(spacy_model.vocab.strings)}
+
+
+def sample(tagger, calls: int, trace: bool, start: float) -> Dict:
+    gc.collect()
+    result = {"calls": calls, "elapsed_s": time.perf_counter() - start, "rss_mb": rss_mb()}
+    result.update(_vocab_sizes(tagger))
+    if trace:
+        snapshot = tracemalloc.take_snapshot()
+        result["components"] = component_sizes(snapshot)
+        result["_snapshot"] = snapshot
+    return result
+
+
+def stream(tagger, corpus: SyntheticCorpus, n_calls: int, interval: int, batch_size: int,
+           trace: bool = False) -> List[Dict]:
+    """Tags `n_calls` batches of the corpus (single texts for a batch size of 1),
+    sampling memory after the first `interval` calls and then every `interval` calls"""
+    if trace:
+        tracemalloc.start()
+    samples = []
+    texts = (doc.text for doc in corpus)
+    start = time.perf_counter()
+    try:
+        for calls in range(1, n_calls + 1):
+            if batch_size == 1:
+                tagger.analyze(next(texts))
+            else:
+                tagger.analyze_batch([next(texts) for _ in range(batch_size)])
+            if calls % interval == 0:
+                samples.append(sample(tagger, calls, trace, start))
+    finally:
+        if trace:
+            tracemalloc.stop()
+    return samples
+
+
+def summarize(samples: List[Dict], top: int = 10) -> Dict:
+    """Growth between the first and the last sample: RSS, vocab sizes, bytes per
+    component and (with tracemalloc) the source lines that allocated the most"""
+    first, last = samples[0], samples[-1]
+    calls = last["calls"] - first["calls"]
+    growth = {
+        "calls": calls,
+        "rss_mb": last["rss_mb"] - first["rss_mb"],
+        "rss_kb_per_1k_calls": 1024.0 * (last["rss_mb"] - first["rss_mb"]) * 1000 / calls if calls else 0.0,
+    }
+    for key in ("spacy_strings",):
+        if key in first:
+            growth[key] = last[key] - first[key]
+    if "_snapshot" in first:
+        names = set(first["components"]) | set(last["components"])
+        growth["components_kb"] = {
+            name: (last["components"].get(name, 0) - first["components"].get(name, 0)) / 1024.0
+            for name in sorted(names)
+        }
+        growth["top_lines"] = [
+            {"line": "%s:%d" % (stat.traceback[0].filename, stat.traceback[0].lineno),
+             "size_kb": stat.size_diff / 1024.0, "count": stat.count_diff}
+            for stat in last["_snapshot"].compare_to(first["_snapshot"], "lineno")[:top]
+        ]
+    return growth
+
+
+def run_backend(model_type: str, n_calls: int, interval: int, batch_size: int, doc_length: int,
+                unseen_rate: float, seed: int, trace: bool) -> Dict:
+    """Loads one backend and streams documents through it, sampling its memory"""
+    from pylazaro import Lazaro
+
+    before = rss_mb()
+    tagger = Lazaro(model_type=model_type)
+    loaded = rss_mb()
+    corpus = SyntheticCorpus(n_docs=n_calls * batch_size, doc_length=doc_length, unseen_rate=unseen_rate,
+                             seed=seed)
+    samples = stream(tagger, corpus, n_calls, interval, batch_size, trace)
+    growth = summarize(samples)
+    for entry in samples:
+        entry.pop("_snapshot", None)
+    return {"model": model_type, "model_rss_mb": loaded - before, "samples": samples, "growth": growth}
+
+
+def _settings_arguments(args) -> List[str]:
+    arguments = [
+        "--n-calls", str(args.n_calls),
+        "--interval", str(args.interval),
+        "--batch-size", str(args.batch_size),
+        "--doc-length", str(args.doc_length),
+        "--unseen-rate", str(args.unseen_rate),
+        "--seed", str(args.seed),
+    ]
+    return arguments + (["--trace"] if args.trace else [])
+
+
+def run_in_subprocess(model_type: str, args) -> Dict:
+    command = [sys.executable, "-m", "benchmarks.memory", "--worker", model_type] + _settings_arguments(args)
+    completed = subprocess.run(command, stdout=subprocess.PIPE)
+    if completed.returncode != 0:
+        return {"model": model_type, "error": "exit status %d" % completed.returncode, "samples": []}
+    return json.loads(completed.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.memory")
+    parser.add_argument("--models", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--n-calls", type=int, default=100000, help="calls to analyze (or analyze_batch)")
+    parser.add_argument("--interval", type=int, default=10000, help="calls between memory samples")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--doc-length", type=int, default=50, help="approximate number of tokens per document")
+    parser.add_argument("--unseen-rate", type=float, default=0.1,
+                        help="probability that a noun is a word never seen before")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace", action="store_true",
+                        help="take tracemalloc snapshots to report growth per component (much slower)")
+    parser.add_argument("--budget-mb", type=float, default=50.0,
+                        help="RSS growth (after the warmup interval) above which a backend fails")
+    parser.add_argument("--output", default="memory_results.json")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.n_calls < 2 * args.interval:
+        parser.error("--n-calls must be at least twice --interval")
+
+    if args.worker is not None:
+        result = run_backend(args.worker, args.n_calls, args.interval, args.batch_size, args.doc_length,
+                             args.unseen_rate, args.seed, args.trace)
+        print(json.dumps(result))
+        return 0
+
+    results = {
+        "settings": {
+            "n_calls": args.n_calls,
+            "interval": args.interval,
+            "batch_size": args.batch_size,
+            "doc_length": args.doc_length,
+            "unseen_rate": args.unseen_rate,
+            "seed": args.seed,
+            "budget_mb": args.budget_mb,
+        },
+        "backends": [run_in_subprocess(model_type, args) for model_type in args.models],
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    failed = False
+    for backend in results["backends"]:
+        if "error" in backend:
+            print("%s: failed (%s)" % (backend["model"], backend["error"]))
+            failed = True
+            continue
+        growth = backend["growth"]
+        over_budget = growth["rss_mb"] > args.budget_mb
+        failed = failed or over_budget
+        print("%s: model %.1f MB, RSS %+.1f MB over %d calls (%.1f KB per 1000 calls)%s" % (
+            backend["model"], backend["model_rss_mb"], growth["rss_mb"], growth["calls"],
+            growth["rss_kb_per_1k_calls"], "  OVER BUDGET" if over_budget else ""))
+        if "spacy_strings" in growth:
+            print("  spaCy strings %+d" % growth["spacy_strings"])
+        for name, size in sorted(growth.get("components_kb", {}).items(), key=lambda item: -abs(item[1])):
+            print("  %-14s %+10.1f KB" % (name, size))
+        for line in growth.get("top_lines", []):
+            print("  %+10.1f KB %+8d  %s" % (line["size_kb"], line["count"], line["line"]))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
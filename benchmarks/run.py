@@ -0,0 +1,172 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+from benchmarks.compare import compare, print_regressions
+from benchmarks.corpus import SyntheticCorpus
+
+# Throughput and latency benchmark of the backends of pylazaro.
+#
+#   python -m benchmarks.run --models crf bilstm --output results.json
+#   python -m benchmarks.run --models crf --output results.json --baseline benchmarks/baseline.json
+#
+# Every backend is measured in a fresh subprocess, so that model load time and
+# peak RSS are not affected by the backends measured before it.
+
+BACKENDS = ["crf", "bilstm", "transformers"]
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """q-th percentile (0-100) of the values, interpolating between the closest ranks"""
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    rank = (len(ordered) - 1) * q / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process so far, in MB (None where it is not available)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def measure(tagger, texts: List[str], batch_size: int, warmup: int = 1) -> Dict:
+    """Tags the texts `batch_size` at a time and measures throughput and per-call latency"""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    for batch in batches[:warmup]:
+        tagger.analyze_batch(batch)
+    latencies = []
+    n_tokens = 0
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for batch in batches:
+        start = time.perf_counter()
+        outputs = tagger.analyze_batch(batch) if batch_size > 1 else [tagger.analyze(batch[0])]
+        latencies.append(time.perf_counter() - start)
+        n_tokens = n_tokens + sum(len(output.words) for output in outputs)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    return {
+        "batch_size": batch_size,
+        "n_docs": len(texts),
+        "n_tokens": n_tokens,
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "docs_per_sec": len(texts) / wall,
+        "tokens_per_sec": n_tokens / wall,
+        "latency_p50_ms": 1000 * percentile(latencies, 50),
+        "latency_p95_ms": 1000 * percentile(latencies, 95),
+        "latency_p99_ms": 1000 * percentile(latencies, 99),
+    }
+
+
+def run_backend(model_type: str, batch_sizes: Sequence[int], doc_lengths: Sequence[int], n_docs: int,
+                borrowing_rate: float, seed: int) -> Dict:
+    """Loads one backend and measures it over every document length and batch size"""
+    from pylazaro import Lazaro
+
+    start = time.perf_counter()
+    tagger = Lazaro(model_type=model_type)
+    tagger.classifier
+    load_time = time.perf_counter() - start
+    runs = []
+    for doc_length in doc_lengths:
+        texts = SyntheticCorpus(n_docs=n_docs, doc_length=doc_length, borrowing_rate=borrowing_rate,
+                                seed=seed).texts
+        for batch_size in batch_sizes:
+            run = measure(tagger, texts, batch_size)
+            run["doc_length"] = doc_length
+            runs.append(run)
+    return {"model": model_type, "load_time_s": load_time, "peak_rss_mb": peak_rss_mb(), "runs": runs}
+
+
+def _settings_arguments(args) -> List[str]:
+    return [
+        "--batch-sizes", *map(str, args.batch_sizes),
+        "--doc-lengths", *map(str, args.doc_lengths),
+        "--n-docs", str(args.n_docs),
+        "--borrowing-rate", str(args.borrowing_rate),
+        "--seed", str(args.seed),
+    ]
+
+
+def run_in_subprocess(model_type: str, args) -> Dict:
+    command = [sys.executable, "-m", "benchmarks.run", "--worker", model_type] + _settings_arguments(args)
+    completed = subprocess.run(command, stdout=subprocess.PIPE)
+    if completed.returncode != 0:
+        # the error itself went to stderr; the other backends are still measured
+        return {"model": model_type, "error": "exit status %d" % completed.returncode, "runs": []}
+    return json.loads(completed.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--models", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--doc-lengths", nargs="+", type=int, default=[20, 100, 500],
+                        help="approximate number of tokens per document")
+    parser.add_argument("--n-docs", type=int, default=64, help="documents per document length")
+    parser.add_argument("--borrowing-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative change against the baseline that counts as a regression")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        result = run_backend(args.worker, args.batch_sizes, args.doc_lengths, args.n_docs,
+                             args.borrowing_rate, args.seed)
+        print(json.dumps(result))
+        return 0
+
+    results = {
+        "settings": {
+            "batch_sizes": args.batch_sizes,
+            "doc_lengths": args.doc_lengths,
+            "n_docs": args.n_docs,
+            "borrowing_rate": args.borrowing_rate,
+            "seed": args.seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "backends": [run_in_subprocess(model_type, args) for model_type in args.models],
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    for backend in results["backends"]:
+        if "error" in backend:
+            print("%s: failed (%s)" % (backend["model"], backend["error"]))
+            continue
+        print("%s: loaded in %.2fs, peak RSS %s MB" % (backend["model"], backend["load_time_s"], backend["peak_rss_mb"]))
+        for run in backend["runs"]:
+            print("  length %4d  batch %3d  %8.1f docs/s  %9.1f tokens/s  p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms" % (
+                run["doc_length"], run["batch_size"], run["docs_per_sec"], run["tokens_per_sec"],
+                run["latency_p50_ms"], run["latency_p95_ms"], run["latency_p99_ms"]))
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print_regressions(regressions)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import argparse
 import logging
 import pathlib
 import sys
@@ -11,11 +12,226 @@ if os.name == "nt":
 
 
 def main():
-    if len(sys.argv) > 1 and sys.argv[1] == "extended":
+    parser = argparse.ArgumentParser(prog="python -m pylazaro")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("extended", help="download the files needed by the CRF model")
+    add_serve_parser(subparsers)
+    add_tag_parser(subparsers)
+    add_profile_features_parser(subparsers)
+    add_evaluate_parser(subparsers)
+    add_tune_parser(subparsers)
+    args = parser.parse_args()
+
+    if args.command == "extended":
         download_crf()
         download_embeddings()
         logging.info("Done downloading!")
         # download_flair()
+    elif args.command == "serve":
+        run_server(args)
+    elif args.command == "tag":
+        run_tagger(args)
+    elif args.command == "profile-features":
+        run_feature_profiler(args)
+    elif args.command == "evaluate":
+        run_evaluation(args)
+    elif args.command == "tune":
+        run_tuner(args)
+    else:
+        parser.print_help()
+
+
+def add_model_arguments(parser):
+    parser.add_argument(
+        "--model", dest="model_type", default="bilstm", choices=["crf", "bilstm", "transformers"]
+    )
+    parser.add_argument("--model-file", default=None)
+
+
+def add_serve_parser(subparsers):
+    serve_parser = subparsers.add_parser("serve", help="start an HTTP JSON inference server")
+    add_model_arguments(serve_parser)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument(
+        "--workers", type=int, default=None, help="number of worker processes (tuned setting, or 1)"
+    )
+    serve_parser.add_argument("--max-batch-size", type=int, default=None, help="tuned setting, or 16")
+    serve_parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    serve_parser.add_argument(
+        "--max-queue-size", type=int, default=256,
+        help="queued texts per worker before answering HTTP 429",
+    )
+    serve_parser.add_argument("--request-timeout", type=float, default=30.0)
+
+
+def run_server(args):
+    from .server import ServerConfig, serve
+    from .tuning import tuned_setting, tuned_threads
+
+    workers = args.workers or tuned_setting(args.model_type, args.model_file, "workers", 1)
+    serve(
+        ServerConfig(
+            model_type=args.model_type,
+            model_file=args.model_file,
+            host=args.host,
+            port=args.port,
+            workers=workers,
+            num_threads=tuned_threads(args.model_type, args.model_file, workers),
+            max_batch_size=args.max_batch_size
+            or tuned_setting(args.model_type, args.model_file, "batch_size", 16),
+            max_wait_ms=args.max_wait_ms,
+            max_queue_size=args.max_queue_size,
+            request_timeout=args.request_timeout,
+        )
+    )
+
+
+def add_tag_parser(subparsers):
+    from .bulk import FORMATS, OUTPUT_FORMATS
+
+    tag_parser = subparsers.add_parser("tag", help="tag a corpus (file or stdin) as JSON lines")
+    add_model_arguments(tag_parser)
+    tag_parser.add_argument("--input", default="-", help="input file ('-' for stdin)")
+    tag_parser.add_argument("--output", default="-", help="output file ('-' for stdout)")
+    tag_parser.add_argument(
+        "--format", dest="input_format", default=None, choices=FORMATS,
+        help="input format (guessed from the file extension by default)",
+    )
+    tag_parser.add_argument("--text-field", default="text", help="field holding the text in JSONL input")
+    tag_parser.add_argument("--output-format", default="borrowings", choices=OUTPUT_FORMATS)
+    tag_parser.add_argument(
+        "--workers", type=int, default=None, help="number of worker processes (tuned setting, or 1)"
+    )
+    tag_parser.add_argument("--batch-size", type=int, default=None, help="tuned setting, or 32")
+
+
+def run_tagger(args):
+    from .bulk import guess_format, tag_file
+    from .tuning import tuned_setting, tuned_threads
+
+    input_format = args.input_format or guess_format(args.input)
+    workers = args.workers or tuned_setting(args.model_type, args.model_file, "workers", 1)
+    infile = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        n_docs = tag_file(
+            infile,
+            outfile,
+            input_format=input_format,
+            text_field=args.text_field,
+            model_type=args.model_type,
+            model_file=args.model_file,
+            workers=workers,
+            batch_size=args.batch_size or tuned_setting(args.model_type, args.model_file, "batch_size", 32),
+            num_threads=tuned_threads(args.model_type, args.model_file, workers),
+            output_format=args.output_format,
+        )
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+    logging.info("Tagged %d documents", n_docs)
+
+
+def add_profile_features_parser(subparsers):
+    profile_parser = subparsers.add_parser(
+        "profile-features", help="report the cost of each feature extractor of the CRF model"
+    )
+    profile_parser.add_argument("--model-file", default=None)
+    profile_parser.add_argument("--input", default="-", help="sample texts, one per line ('-' for stdin)")
+    profile_parser.add_argument("--limit", type=int, default=1000, help="maximum number of texts to profile")
+    profile_parser.add_argument("--by-offset", action="store_true", help="report each window offset apart")
+
+
+def run_feature_profiler(args):
+    from itertools import islice
+
+    from .lazaro import Lazaro
+    from .profiling import profile_classifier
+
+    classifier = Lazaro(model_type="crf", model_file=args.model_file).classifier
+    infile = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    try:
+        texts = [line.strip() for line in islice(infile, args.limit) if line.strip()]
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    print(profile_classifier(classifier, texts).report(by_offset=args.by_offset))
+
+
+def add_evaluate_parser(subparsers):
+    evaluate_parser = subparsers.add_parser(
+        "evaluate", help="score models against gold CoNLL data, next to their throughput and latency"
+    )
+    evaluate_parser.add_argument("--gold", required=True, help="gold CoNLL file (word and BIO label per line)")
+    evaluate_parser.add_argument(
+        "--models", nargs="+", default=["bilstm"], choices=["crf", "bilstm", "transformers"]
+    )
+    evaluate_parser.add_argument("--model-file", default=None)
+    evaluate_parser.add_argument("--batch-sizes", nargs="+", type=int, default=[32])
+    evaluate_parser.add_argument("--label-column", type=int, default=-1)
+    evaluate_parser.add_argument(
+        "--pretokenized", action="store_true",
+        help="tag the gold words instead of the sentences as strings (not the batched path of production)",
+    )
+    evaluate_parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+
+
+def run_evaluation(args):
+    import json
+
+    from .evaluation import evaluate, format_table, read_conll_gold
+    from .lazaro import Lazaro
+
+    results = []
+    for model_type in args.models:
+        tagger = Lazaro(model_type=model_type, model_file=args.model_file)
+        for batch_size in args.batch_sizes:
+            # the gold file is streamed again for every configuration
+            with open(args.gold, encoding="utf-8") as f:
+                results.append(evaluate(tagger, read_conll_gold(f, args.label_column), batch_size,
+                                        pretokenized=args.pretokenized))
+    print(format_table(results))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([result.to_dict() for result in results], f, indent=2)
+
+
+def add_tune_parser(subparsers):
+    tune_parser = subparsers.add_parser(
+        "tune", help="find the fastest settings of a model on this host and save them for Lazaro to use"
+    )
+    add_model_arguments(tune_parser)
+    tune_parser.add_argument("--input", default="-", help="sample texts, one per line ('-' for stdin)")
+    tune_parser.add_argument("--limit", type=int, default=256, help="maximum number of texts to use")
+    tune_parser.add_argument("--max-latency-ms", type=float, default=None, help="bound on the p95 latency of a batch")
+    tune_parser.add_argument("--max-workers", type=int, default=None, help="maximum number of worker processes")
+    tune_parser.add_argument("--config", default=None, help="file to write (PYLAZARO_CONFIG or ~/.pylazaro/tuned.json)")
+
+
+def run_tuner(args):
+    from itertools import islice
+
+    from .tuning import save_tuned_settings, tune
+
+    infile = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    try:
+        texts = [line.strip() for line in islice(infile, args.limit) if line.strip()]
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    if not texts:
+        sys.exit("No sample texts to tune with")
+    settings = tune(args.model_type, texts, model_file=args.model_file, max_latency_ms=args.max_latency_ms,
+                    max_workers=args.max_workers)
+    path = save_tuned_settings(args.model_type, settings, args.model_file,
+                               pathlib.Path(args.config) if args.config else None)
+    logging.info("num_threads=%s batch_size=%d workers=%d worker_threads=%s (%.1f docs/s, p95 %.2f ms) "
+                 "written to %s",
+                 settings["num_threads"], settings["batch_size"], settings["workers"], settings["worker_threads"],
+                 settings["docs_per_sec"], settings["latency_p95_ms"], path)
 
 
 def download_crf():
@@ -0,0 +1,226 @@
+import hashlib
+import heapq
+from array import array
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pylazaro.output import LazaroOutput
+
+
+def _hash_pair(key: str) -> Tuple[int, int]:
+    # stable across processes (unlike hash()), so that sketches built by different workers can be merged
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class CountMinSketch(object):
+    """Approximate counter in fixed memory (`depth` x `width` counters). Estimates
+    are never below the true count, and exceed it by at most 2 * total / width
+    with probability 1 - 0.5 ** depth.
+
+    Attributes:
+            width (int): counters per row
+            depth (int): number of rows (hash functions)
+    """
+
+    def __init__(self, width: int = 2 ** 16, depth: int = 4) -> None:
+        self.width = width
+        self.depth = depth
+        # rows one after the other in a flat array
+        self.table = array("q", bytes(8 * width * depth))
+
+    def _cells(self, key: str) -> List[int]:
+        a, b = _hash_pair(key)
+        width = self.width
+        # double hashing: row i uses column (a + i * b) mod width
+        return [i * width + (a + i * b) % width for i in range(self.depth)]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """Adds `count` to the key and returns its new estimate"""
+        table = self.table
+        estimate = None
+        for cell in self._cells(key):
+            table[cell] += count
+            if estimate is None or table[cell] < estimate:
+                estimate = table[cell]
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        table = self.table
+        return min(table[cell] for cell in self._cells(key))
+
+    def merge(self, other: "CountMinSketch") -> None:
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Only sketches with the same width and depth can be merged")
+        counters = np.frombuffer(self.table, dtype=np.int64)
+        counters += np.frombuffer(other.table, dtype=np.int64)
+
+
+class BorrowingAggregator(object):
+    """Counts borrowings over a stream of outputs, keyed by borrowing, language
+    and any number of user-supplied facets (date, source...). Aggregators
+    built by different workers can be merged into one.
+
+    In exact mode, every distinct key is counted. In approximate mode, memory is
+    bounded: counts are kept in a count-min sketch, and only the `top_k` most
+    frequent keys (the heavy hitters) are remembered. The smallest of them is
+    found with a min-heap, so every borrowing counted costs O(log top_k).
+
+    Attributes:
+            facets (Sequence[str]): names of the facets that every output comes with
+            approximate (bool): count with a count-min sketch instead of exactly
+            top_k (int): number of heavy hitters kept in approximate mode
+            width (int): width of the count-min sketch
+            depth (int): depth of the count-min sketch
+            normalize (Callable, optional): applied to the borrowing text before counting
+                        (lowercasing by default; a lemmatizer also fits here)
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro.aggregate import BorrowingAggregator
+                    >>> aggregator = BorrowingAggregator(facets=["date", "source"])
+                    >>> for article in articles:
+                    ...     aggregator.add(tagger.analyze(article.text), date=article.date, source=article.source)
+                    >>> aggregator.most_common(3)
+                    [(('online', 'ENG', '2021-05-01', 'elpais'), 42), ...]
+    """
+
+    def __init__(
+        self,
+        facets: Sequence[str] = (),
+        approximate: bool = False,
+        top_k: int = 1000,
+        width: int = 2 ** 16,
+        depth: int = 4,
+        normalize: Optional[Callable[[str], str]] = str.lower,
+    ) -> None:
+        self.facets = tuple(facets)
+        self.approximate = approximate
+        self.top_k = top_k
+        self.normalize = normalize
+        self.total = 0
+        self.documents = 0
+        self._counts = Counter()  # type: Counter
+        self._sketch = CountMinSketch(width, depth) if approximate else None
+        # (count, sequence number, key) of the heavy hitters; entries whose count is no longer
+        # the count of their key are stale and skipped when they reach the top
+        self._heap = []  # type: List[Tuple[int, int, Tuple]]
+        self._sequence = 0
+
+    @staticmethod
+    def _sketch_key(key: Tuple) -> str:
+        return "\x1f".join(str(value) for value in key)
+
+    def _facet_values(self, facets: Dict) -> Tuple:
+        unknown = set(facets) - set(self.facets)
+        if unknown:
+            raise ValueError("Unknown facets: %s" % ", ".join(sorted(unknown)))
+        return tuple(facets.get(facet) for facet in self.facets)
+
+    def _settings(self) -> Tuple:
+        """Settings that two aggregators must share to be merged"""
+        if self._sketch is None:
+            return self.facets, self.approximate, self.normalize
+        return self.facets, self.approximate, self.normalize, self.top_k, self._sketch.width, self._sketch.depth
+
+    def _push(self, key: Tuple, count: int) -> None:
+        heap = self._heap
+        # the sequence number breaks ties, so that keys themselves are never compared
+        self._sequence = self._sequence + 1
+        heapq.heappush(heap, (count, self._sequence, key))
+        if len(heap) > 2 * self.top_k + 64:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self) -> None:
+        start = self._sequence
+        self._heap = [(count, start + i, key) for i, (key, count) in enumerate(self._counts.items(), 1)]
+        self._sequence = start + len(self._heap)
+        heapq.heapify(self._heap)
+
+    def _remember(self, key: Tuple, estimate: int) -> None:
+        counts = self._counts
+        if key in counts or len(counts) < self.top_k:
+            counts[key] = estimate
+            self._push(key, estimate)
+            return
+        heap = self._heap
+        # estimates only grow, so stale entries are below the current one of their key
+        while heap[0][0] != counts.get(heap[0][2]):
+            heapq.heappop(heap)
+        smallest_count, _, smallest = heap[0]
+        if estimate > smallest_count:
+            heapq.heappop(heap)
+            del counts[smallest]
+            counts[key] = estimate
+            self._push(key, estimate)
+
+    def add_borrowings(self, borrowings: Iterable[Tuple[str, str]], **facets) -> None:
+        """Counts (borrowing, language) pairs that come with the given facet values"""
+        facet_values = self._facet_values(facets)
+        for text, language in borrowings:
+            if self.normalize is not None:
+                text = self.normalize(text)
+            key = (text, language) + facet_values
+            self.total = self.total + 1
+            if self._sketch is None:
+                self._counts[key] += 1
+            else:
+                self._remember(key, self._sketch.add(self._sketch_key(key)))
+
+    def add(self, output: LazaroOutput, **facets) -> None:
+        """Counts the borrowings of an output, which come with the given facet values"""
+        self.documents = self.documents + 1
+        self.add_borrowings(output.borrowings_to_tuple(), **facets)
+
+    def count(self, borrowing: str, language: str, **facets) -> int:
+        """Returns the count of a key (an upper bound of it in approximate mode)"""
+        if self.normalize is not None:
+            borrowing = self.normalize(borrowing)
+        key = (borrowing, language) + self._facet_values(facets)
+        if self._sketch is None:
+            return self._counts[key]
+        return self._sketch.estimate(self._sketch_key(key))
+
+    def most_common(self, n: int = None) -> List[Tuple[Tuple, int]]:
+        """Returns the n most frequent keys, as ((borrowing, language, *facets), count) pairs"""
+        return self._counts.most_common(n)
+
+    def to_records(self) -> List[Dict]:
+        """Returns the counts as a list of dicts with the borrowing, language, facets and count
+        (ready for `pandas.DataFrame`)"""
+        fields = ("borrowing", "language") + self.facets
+        records = []
+        for key, count in self._counts.most_common():
+            record = dict(zip(fields, key))
+            record["count"] = count
+            records.append(record)
+        return records
+
+    def merge(self, other: "BorrowingAggregator") -> "BorrowingAggregator":
+        """Adds the counts of another aggregator (with the same settings) to this one"""
+        if other._settings() != self._settings():
+            raise ValueError("Only aggregators with the same settings can be merged")
+        self.total = self.total + other.total
+        self.documents = self.documents + other.documents
+        if self._sketch is None:
+            self._counts.update(other._counts)
+            return self
+        self._sketch.merge(other._sketch)
+        candidates = set(self._counts) | set(other._counts)
+        estimates = [(key, self._sketch.estimate(self._sketch_key(key))) for key in candidates]
+        estimates.sort(key=lambda item: item[1], reverse=True)
+        self._counts = Counter(dict(estimates[:self.top_k]))
+        self._rebuild_heap()
+        return self
+
+
+def merge_aggregators(aggregators: Iterable[BorrowingAggregator]) -> BorrowingAggregator:
+    """Merges partial aggregates (for instance, one per worker) into the first one"""
+    aggregators = iter(aggregators)
+    result = next(aggregators)
+    for aggregator in aggregators:
+        result.merge(aggregator)
+    return result
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import attr
+
+from pylazaro.output import LazaroOutput
+
+
+@attr.s
+class _PendingRequest(object):
+    text = attr.ib()
+    future = attr.ib(type=asyncio.Future)
+    deadline = attr.ib(type=float, default=None)
+
+    def is_expired(self, now: float) -> bool:
+        return self.deadline is not None and now >= self.deadline
+
+
+class MicroBatcher(object):
+    """Collects concurrent asyncio requests into batches and runs each batch
+    through a single batched forward pass off the event loop.
+
+    A batch is closed as soon as it holds `max_batch_size` texts or
+    `max_wait_ms` milliseconds have passed since its first text arrived,
+    whichever happens first. Requests that are cancelled or whose deadline
+    has passed while waiting are dropped before the batch is run.
+
+    Attributes:
+            predict_batch (Callable): function that takes a list of texts and returns a list of LazaroOutput
+            max_batch_size (int): maximum number of texts per forward pass
+            max_wait_ms (float): maximum time (in ms) the first text of a batch waits for company
+            executor (:obj:`concurrent.futures.Executor`, optional): where forward passes are run.
+                    Defaults to a single worker thread, so that forward passes never overlap.
+    """
+
+    def __init__(
+        self,
+        predict_batch: Callable[[List], List[LazaroOutput]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pylazaro-batcher"
+        )
+        self.loop = None
+        self._queue = None
+        self._worker = None
+
+    async def submit(self, text, timeout: Optional[float] = None) -> LazaroOutput:
+        """Queues a text for analysis and waits for its output.
+
+        Args:
+                text: The text to analyze (a string or a list of words).
+                timeout (float, optional): seconds after which the request is abandoned.
+
+        Returns:
+                `pylazaro.output.LazaroOutput`: the output for this text
+
+        Raises:
+                asyncio.TimeoutError: if the output was not ready before the deadline.
+        """
+        self._ensure_started()
+        future = self.loop.create_future()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self._queue.put_nowait(_PendingRequest(text, future, deadline))
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # asyncio primitives are bound to the loop they were created on
+            self.loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+    async def _collect(self) -> List[_PendingRequest]:
+        batch = [await self._queue.get()]
+        batch_deadline = self.loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = batch_deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            now = time.monotonic()
+            live = []
+            for request in batch:
+                if request.future.done():
+                    continue
+                if request.is_expired(now):
+                    request.future.set_exception(asyncio.TimeoutError())
+                    continue
+                live.append(request)
+            if not live:
+                continue
+            try:
+                outputs = await self.loop.run_in_executor(
+                    self.executor, self.predict_batch, [req.text for req in live]
+                )
+            except Exception as e:
+                for request in live:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            for request, output in zip(live, outputs):
+                if not request.future.done():
+                    request.future.set_result(output)
+
+    async def aclose(self) -> None:
+        """Stops the batching task and releases the executor (if it was created by the batcher)"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+
+@attr.s
+class _QueuedRequest(object):
+    """A request of a BatchQueue, run in chunks of at most `max_batch_size` texts"""
+
+    future = attr.ib(type=Future)
+    outputs = attr.ib(type=list)
+    remaining = attr.ib(type=int)  # chunks that have not been run yet
+    started = attr.ib(type=bool, default=False)
+
+    def start(self) -> bool:
+        """Marks the request as running before one of its chunks is run.
+        Returns False if it was cancelled or has already failed."""
+        if not self.started:
+            self.started = True
+            return self.future.set_running_or_notify_cancel()
+        return not self.future.done()
+
+
+class BatchQueue(object):
+    """Thread-based counterpart of `MicroBatcher`: requests submitted from any
+    thread are grouped into batches of up to `max_batch_size` texts (waiting at
+    most `max_wait_ms` for a batch to fill) and run by a single worker thread.
+    Requests with more than `max_batch_size` texts are run in several batches.
+
+    The queue is bounded by the number of texts: once `max_queue_size` texts are
+    waiting, `submit` raises `queue.Full` so that callers can shed load instead
+    of piling it up. A request is always accepted when nothing is waiting, so
+    that one larger than the whole queue is not rejected forever.
+
+    Attributes:
+            predict_batch (Callable): function that takes a list of texts and returns a list of LazaroOutput
+            max_batch_size (int): maximum number of texts per batch
+            max_wait_ms (float): maximum time (in ms) the first request of a batch waits for company
+            max_queue_size (int): maximum number of texts waiting to be batched
+    """
+
+    def __init__(
+        self,
+        predict_batch: Callable[[List], List[LazaroOutput]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        max_queue_size: int = 256,
+    ) -> None:
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        # chunks of requests: (texts, request, index of the first text in the request)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._waiting = 0  # texts in the queue
+        self._carry = None  # chunk taken from the queue that did not fit in the last batch
+        self._closed = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="pylazaro-batch-queue", daemon=True
+        )
+        self._worker.start()
+
+    def qsize(self) -> int:
+        """Number of texts waiting to be batched"""
+        return self._waiting
+
+    def submit(self, texts: List) -> Future:
+        """Queues a group of texts that will be analyzed together (and possibly
+        along with texts from other requests).
+
+        Args:
+                texts: list of texts (strings or lists of words)
+
+        Returns:
+                `concurrent.futures.Future`: future that resolves to a list with one LazaroOutput per text.
+                Cancelling the future drops the request if it has not been run yet.
+
+        Raises:
+                queue.Full: if the queue is at capacity.
+        """
+        if self._closed.is_set():
+            raise RuntimeError("BatchQueue is closed")
+        texts = list(texts)
+        future = Future()
+        if not texts:
+            future.set_running_or_notify_cancel()
+            future.set_result([])
+            return future
+        starts = range(0, len(texts), self.max_batch_size)
+        request = _QueuedRequest(future, [None] * len(texts), len(starts))
+        with self._lock:
+            if self._waiting and self._waiting + len(texts) > self.max_queue_size:
+                raise queue.Full
+            self._waiting += len(texts)
+            for start in starts:
+                self._queue.put_nowait((texts[start:start + self.max_batch_size], request, start))
+        return future
+
+    def _get(self, timeout: float):
+        item = self._queue.get(timeout=timeout)
+        with self._lock:
+            self._waiting -= len(item[0])
+        return item
+
+    def _collect(self) -> List[Tuple[List, _QueuedRequest, int]]:
+        if self._carry is not None:
+            batch = [self._carry]
+            self._carry = None
+        else:
+            while not self._closed.is_set():
+                try:
+                    batch = [self._get(timeout=0.1)]
+                    break
+                except queue.Empty:
+                    continue
+            else:
+                return []
+        n_texts = len(batch[0][0])
+        batch_deadline = time.monotonic() + self.max_wait_ms / 1000
+        while n_texts < self.max_batch_size:
+            remaining = batch_deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._get(timeout=remaining)
+            except queue.Empty:
+                break
+            if n_texts + len(item[0]) > self.max_batch_size:
+                self._carry = item
+                break
+            batch.append(item)
+            n_texts += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while not self._closed.is_set():
+            batch = [(texts, request, start) for texts, request, start in self._collect() if request.start()]
+            if not batch:
+                continue
+            try:
+                outputs = self.predict_batch([text for texts, _, _ in batch for text in texts])
+            except Exception as e:
+                logging.exception("Batch of %d requests failed", len(batch))
+                for _, request, _ in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+            i = 0
+            for texts, request, start in batch:
+                request.outputs[start:start + len(texts)] = outputs[i:i + len(texts)]
+                i += len(texts)
+                request.remaining -= 1
+                if request.remaining == 0:
+                    request.future.set_result(request.outputs)
+
+    def close(self) -> None:
+        """Stops the worker thread once the current batch is done"""
+        self._closed.set()
+        self._worker.join()
@@ -1,6 +1,6 @@
 import os
 import pathlib
-from typing import List, Tuple, Dict
+from typing import List, Optional, Tuple, Dict
 from collections import defaultdict
 from .token import Token
 
@@ -15,24 +15,41 @@ if os.name == "nt":
     pathlib.PosixPath = pathlib.WindowsPath
 
 
-@attr.s
+@attr.s(slots=True)
 class Borrowing(object):
     """The Borrowing object: a span of text that represents a borrowing.
     A borrowing will be made of several tokens and have a context assigned
 
+    When the context is known, the borrowing is just the index range
+    [start_pos, end_pos) into context_tokens, and its tokens are sliced
+    from the context when they are asked for. The context shown for the
+    borrowing (`context_text`) can be narrowed to a range of the context
+    tokens, such as the sentence it belongs to.
+
     Attributes:
             tokens (List[`pylazaro.token.Token`]): list of Tokens that form the Borrowing
+                        (can be None when context_tokens is given)
             language (str): language (the @property language follows iso codes)
             start_pos (int): start position of the borrowing spans (refers to context_tokens)
             end_pos (int): end position of the borrowing spans (refers context tokens)
             context_tokens (List[`pylazaro.token.Token`]): list of Tokens that form the sentence
+            context_start (int, optional): start of the context of the borrowing within context_tokens
+            context_end (int, optional): end of the context of the borrowing within context_tokens
     """
-    tokens = attr.ib(type=List[Token])
+    _tokens = attr.ib(type=List[Token], eq=False, repr=False)
     start_pos = attr.ib(type=int)
     end_pos = attr.ib(type=int)
     language = attr.ib(type=str)
     context_tokens = attr.ib(type=List[Token], default=None, repr=False)
+    context_start = attr.ib(type=int, default=None, eq=False, repr=False)
+    context_end = attr.ib(type=int, default=None, eq=False, repr=False)
+    _context_text = attr.ib(type=str, default=None, init=False, eq=False, repr=False)
 
+    @property
+    def tokens(self) -> List[Token]:
+        if self._tokens is None:
+            return self.context_tokens[self.start_pos:self.end_pos]
+        return self._tokens
 
     @property
     def length(self) -> int:
@@ -41,7 +58,7 @@ class Borrowing(object):
         Returns: token length of the borrowings (1 token borrowing, 2 token borrowings, etc)
 
         """
-        return len(self.tokens)
+        return self.end_pos - self.start_pos
 
     @property
     def text(self) -> str:
@@ -53,20 +70,64 @@ class Borrowing(object):
 
         return " ".join([token.text for token in self.tokens])
 
+    @property
+    def start_char(self) -> Optional[int]:
+        """
+
+        Returns: Offset of the first character of the borrowing in the source text (None if unknown)
+
+        """
+        return self.tokens[0].start_char
+
+    @property
+    def end_char(self) -> Optional[int]:
+        """
+
+        Returns: Offset after the last character of the borrowing in the source text (None if unknown)
+
+        """
+        return self.tokens[-1].end_char
+
+    @property
+    def context_range(self) -> Tuple[int, int]:
+        """
+
+        Returns: (start, end) of the context of the borrowing within context_tokens
+
+        """
+        start = 0 if self.context_start is None else self.context_start
+        end = len(self.context_tokens) if self.context_end is None else self.context_end
+        return start, end
+
     @property
     def context_text(self) -> str:
         """
         Returns:
                 The context of the borrowing as a string of text
         """
+        if self._context_text is None:
+            start, end = self.context_range
+            self._context_text = " ".join([token.text for token in self.context_tokens[start:end]])
+        return self._context_text
+
+    def kwic(self) -> Tuple[str, str, str]:
+        """
+
+        Returns: The borrowing in its context as a (left context, borrowing, right context) tuple,
+                 as in a keyword-in-context concordance
 
-        return " ".join([token.text for token in self.context_tokens])
+        """
+        start, end = self.context_range
+        left = " ".join([token.text for token in self.context_tokens[start:self.start_pos]])
+        right = " ".join([token.text for token in self.context_tokens[self.end_pos:end]])
+        return left, self.text, right
 
     @classmethod
     def from_span(cls, tokens: List[Token], label: str, start_pos: int,
-                  end_pos: int, output_tokens: List[Token]):
+                  end_pos: int, output_tokens: List[Token], context_start: int = None,
+                  context_end: int = None):
         return cls(tokens, start_pos, end_pos, label,
-                  output_tokens)
+                  output_tokens, context_start, context_end)
 
     def is_anglicism(self) -> bool:
         """
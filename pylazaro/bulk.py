@@ -0,0 +1,176 @@
+import collections
+import json
+import multiprocessing
+from typing import Dict, IO, Iterable, Iterator, List, Tuple
+
+from pylazaro.lazaro import Lazaro
+from pylazaro.output import LazaroOutput
+from pylazaro.utils import chunked
+
+FORMATS = ["text", "jsonl", "conll"]
+OUTPUT_FORMATS = ["borrowings", "tokens", "both"]
+
+_tagger = None
+
+
+def guess_format(filename: str) -> str:
+    """Guesses the input format from the file extension (plain text by default)"""
+    if filename.endswith(".jsonl") or filename.endswith(".json"):
+        return "jsonl"
+    if filename.endswith(".conll") or filename.endswith(".conllu"):
+        return "conll"
+    return "text"
+
+
+def read_text(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """Reads one document per non-empty line"""
+    i = 0
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield i, line
+            i = i + 1
+
+
+def read_jsonl(lines: Iterable[str], text_field: str = "text") -> Iterator[Tuple[object, object]]:
+    """Reads one JSON object per line. The document is taken from `text_field`
+    (either a string or a list of words) and its id from the "id" field, if any."""
+    i = 0
+    for line in lines:
+        line = line.strip()
+        if line:
+            record = json.loads(line)
+            yield record.get("id", i), record[text_field]
+            i = i + 1
+
+
+def read_conll(lines: Iterable[str]) -> Iterator[Tuple[int, List[str]]]:
+    """Reads CoNLL-formatted sentences (one token per line, word in the first
+    column, blank lines between sentences) as pre-tokenized documents"""
+    i = 0
+    words = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if words:
+                yield i, words
+                i = i + 1
+                words = []
+            continue
+        word = line.split()[0]
+        if word == "-DOCSTART-":
+            continue
+        words.append(word)
+    if words:
+        yield i, words
+
+
+READERS = {"text": read_text, "jsonl": read_jsonl, "conll": read_conll}
+
+
+def output_to_record(doc_id, output: LazaroOutput, output_format: str = "borrowings") -> Dict:
+    record = {"id": doc_id}
+    if output_format in ("borrowings", "both"):
+        record["borrowings"] = output.borrowings_to_dict()
+    if output_format in ("tokens", "both"):
+        record["tokens"] = output.tag_per_token()
+    return record
+
+
+def _init_worker(model_type: str, model_file: str, num_threads: int = None, tagger: Lazaro = None) -> None:
+    global _tagger
+    if tagger is not None:
+        _tagger = tagger
+    else:
+        _tagger = Lazaro(model_type=model_type, model_file=model_file, num_threads=num_threads)
+
+
+def _tag_chunk(chunk: List[Tuple[object, object]], output_format: str) -> List[Dict]:
+    outputs = _tagger.analyze_batch([text for _, text in chunk])
+    return [
+        output_to_record(doc_id, output, output_format)
+        for (doc_id, _), output in zip(chunk, outputs)
+    ]
+
+
+def tag_documents(
+    docs: Iterable[Tuple[object, object]],
+    model_type: str = "bilstm",
+    model_file: str = None,
+    workers: int = 1,
+    batch_size: int = 32,
+    output_format: str = "borrowings",
+    num_threads: int = None,
+    tagger: Lazaro = None,
+) -> Iterator[Dict]:
+    """Tags a stream of (id, text) documents and yields one record per document, in input order.
+
+    With several workers, documents are sent in chunks of `batch_size` to a
+    pool of processes that load the model once each. At most two chunks per
+    worker are in flight at any time, so memory stays bounded no matter how
+    long the input is.
+
+    Args:
+            docs: iterable of (id, text) pairs; text can be a string or a list of words
+            model_type (str): type of model (crf/bilstm/transformers)
+            model_file (str, optional): model to be used
+            workers (int): number of worker processes
+            batch_size (int): documents per call to `Lazaro.analyze_batch`
+            output_format (str): "borrowings" (`borrowings_to_dict()`), "tokens" (`tag_per_token()`) or "both"
+            num_threads (int, optional): torch threads of each worker (see `pylazaro.tuning.tuned_threads`)
+            tagger (`pylazaro.lazaro.Lazaro`, optional): a tagger to use (and, with several workers, for the
+                    forked workers to inherit) instead of loading one from `model_type` and `model_file`
+
+    Returns:
+            Iterator[Dict]: records of the form {"id": ..., "borrowings": [...], "tokens": [...]}
+    """
+    chunks = chunked(docs, batch_size)
+    if workers <= 1:
+        _init_worker(model_type, model_file, num_threads, tagger)
+        for chunk in chunks:
+            yield from _tag_chunk(chunk, output_format)
+        return
+
+    if tagger is not None:
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError(
+                "Sharing a tagger needs the 'fork' start method, which is not available on this platform"
+            )
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    with context.Pool(
+        workers, initializer=_init_worker, initargs=(model_type, model_file, num_threads, tagger)
+    ) as pool:
+        in_flight = collections.deque()
+        for chunk in chunks:
+            in_flight.append(pool.apply_async(_tag_chunk, (chunk, output_format)))
+            if len(in_flight) >= 2 * workers:
+                yield from in_flight.popleft().get()
+        while in_flight:
+            yield from in_flight.popleft().get()
+
+
+def tag_file(
+    infile: IO,
+    outfile: IO,
+    input_format: str = "text",
+    text_field: str = "text",
+    **kwargs
+) -> int:
+    """Reads documents from `infile`, tags them and writes them to `outfile` as JSON lines.
+    Keyword arguments are passed on to `tag_documents`.
+
+    Returns:
+            int: number of documents written
+    """
+    if input_format == "jsonl":
+        docs = read_jsonl(infile, text_field)
+    else:
+        docs = READERS[input_format](infile)
+    n_docs = 0
+    for record in tag_documents(docs, **kwargs):
+        outfile.write(json.dumps(record, ensure_ascii=False) + "\n")
+        n_docs = n_docs + 1
+    outfile.flush()
+    return n_docs
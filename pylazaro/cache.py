@@ -0,0 +1,220 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import attr
+
+from pylazaro.output import LazaroOutput
+from pylazaro.wire import VERSION as WIRE_VERSION
+from pylazaro.wire import pack_output, unpack_output
+
+
+def cache_key(text, namespace: str) -> str:
+    """Hashes a text together with a namespace identifying the model that tags it.
+    The text is hashed as it is: the words and character offsets of an output
+    only hold for the exact text that was tagged. Pre-tokenized texts (lists of
+    words) are kept apart from raw strings."""
+    if isinstance(text, list):
+        text = "\x1f" + "\x1f".join(text)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(namespace.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+@attr.s
+class CacheStats(object):
+    """Counters of a ResultCache
+
+    Attributes:
+            hits (int): lookups answered by the in-memory tier
+            disk_hits (int): lookups answered by the on-disk tier
+            misses (int): lookups answered by neither tier
+            evictions (int): entries dropped from the in-memory tier
+            disk_evictions (int): entries dropped from the on-disk tier
+    """
+
+    hits = attr.ib(type=int, default=0)
+    disk_hits = attr.ib(type=int, default=0)
+    misses = attr.ib(type=int, default=0)
+    evictions = attr.ib(type=int, default=0)
+    disk_evictions = attr.ib(type=int, default=0)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def to_dict(self) -> Dict:
+        stats = attr.asdict(self)
+        stats["hit_rate"] = self.hit_rate
+        return stats
+
+
+class SqliteTier(object):
+    """On-disk cache tier backed by a sqlite database, which several processes
+    on the same host can share.
+
+    Attributes:
+            path (str): path to the sqlite database (created if needed)
+            max_entries (int, optional): maximum number of entries (the oldest are evicted first)
+    """
+
+    def __init__(self, path: str, max_entries: int = None) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._puts = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            # connections must not be carried over a fork
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outputs "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM outputs WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, value: bytes) -> int:
+        """Stores a value and returns the number of entries evicted to make room for it"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO outputs (key, value, created) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            evicted = 0
+            self._puts += 1
+            # counting rows is not free: only trim the table every now and then
+            if self.max_entries is not None and self._puts % 100 == 0:
+                (n_entries,) = self.conn.execute("SELECT COUNT(*) FROM outputs").fetchone()
+                if n_entries > self.max_entries:
+                    evicted = self.conn.execute(
+                        "DELETE FROM outputs WHERE key IN "
+                        "(SELECT key FROM outputs ORDER BY created LIMIT ?)",
+                        (n_entries - self.max_entries,),
+                    ).rowcount
+            self.conn.commit()
+        return evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM outputs")
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+class ResultCache(object):
+    """Two-tier cache of LazaroOutput objects: a bounded in-memory LRU and an
+    optional sqlite database on disk. Outputs are stored in the compact binary
+    form of `pylazaro.wire`, and every hit returns a fresh LazaroOutput.
+
+    Attributes:
+            maxsize (int): maximum number of outputs in memory
+            path (str, optional): path of the sqlite database for the on-disk tier
+            max_disk_entries (int, optional): maximum number of outputs on disk
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro import Lazaro
+                    >>> from pylazaro.cache import ResultCache
+                    >>> tagger = Lazaro(cache=ResultCache(maxsize=50000, path="/tmp/pylazaro.db"))
+                    >>> output = tagger.analyze(text)  # runs the model
+                    >>> output = tagger.analyze(text)  # served from the cache
+                    >>> tagger.cache.stats.to_dict()
+                    {'hits': 1, 'disk_hits': 0, 'misses': 1, 'evictions': 0, 'disk_evictions': 0, 'hit_rate': 0.5}
+    """
+
+    def __init__(self, maxsize: int = 10000, path: str = None, max_disk_entries: int = None) -> None:
+        self.maxsize = maxsize
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.stats = CacheStats()
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = SqliteTier(path, max_disk_entries) if path else None
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def _remember(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+                self.stats.evictions += 1
+
+    def get(self, key: str) -> Optional[LazaroOutput]:
+        """Looks up an output by key (see `cache_key`); returns None if it is not cached"""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.stats.hits += 1
+        if value is None and self._disk is not None:
+            value = self._disk.get(key)
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self.stats.disk_hits += 1
+        if value is None:
+            with self._lock:
+                self.stats.misses += 1
+            return None
+        return unpack_output(value)
+
+    def put(self, key: str, output: LazaroOutput) -> None:
+        value = pack_output(output)
+        self._remember(key, value)
+        if self._disk is not None:
+            evicted = self._disk.put(key, value)
+            if evicted:
+                with self._lock:
+                    self.stats.disk_evictions += evicted
+
+    def clear(self) -> None:
+        """Empties both tiers (and resets the stats)"""
+        with self._lock:
+            self._memory.clear()
+            self.stats = CacheStats()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+
+    def __getstate__(self) -> Dict:
+        # only the settings travel: the copy starts with an empty memory tier
+        return {"maxsize": self.maxsize, "path": self.path, "max_disk_entries": self.max_disk_entries}
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__init__(**state)
+
+
+def model_namespace(model_type: str, model_file: str, model_version: str) -> str:
+    """Identifies a model (and the cache format) in cache keys"""
+    return "|".join([model_type, model_file or "", model_version or "", str(WIRE_VERSION)])
@@ -2,6 +2,7 @@ import logging
 import os
 import pathlib
 import re
+import threading
 from abc import ABC, abstractmethod
 from typing import List
 from collections import Counter
@@ -15,10 +16,11 @@ from flair.models import SequenceTagger
 from spacy.lang.tokenizer_exceptions import URL_PATTERN
 from spacy.language import Language
 from spacy.tokenizer import Tokenizer
-from spacy.training import biluo_tags_to_spans
 from spacy.tokens import Doc
 from transformers import AutoModelForTokenClassification, AutoTokenizer, pipeline
 
+from pylazaro import timing
+from pylazaro.decoding import TagDecoder, merge_wordpieces
 from pylazaro.output import (
     LazaroOutput
 )
@@ -33,6 +35,7 @@ from pylazaro.utils import (
     TrigramFeature,
     TwitterFeature,
     UppercaseFeature,
+    SharedMemoryZone,
     URLFeature,
     WindowedTokenFeatureExtractor,
     WordEnding,
@@ -47,7 +50,20 @@ if os.name == "nt":
     pathlib.PosixPath = pathlib.WindowsPath
 
 
+def set_torch_threads(num_threads: int = None) -> None:
+    """Sets the number of threads torch uses within a single operation. Note that
+    this is a process-wide setting shared by every torch model in the process."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+
 class LazaroClassifier(ABC):
+    """Base class of the classifiers.
+
+    Classifiers can be shared by several threads: `predict` and `predict_batch`
+    can be called concurrently and give the same results as sequential calls.
+    """
+
     @abstractmethod
     def predict(self, text) -> LazaroOutput:
         raise NotImplementedError
@@ -56,33 +72,91 @@ class LazaroClassifier(ABC):
     def load_model(self):
         raise NotImplementedError
 
+    def predict_batch(self, texts: List) -> List[LazaroOutput]:
+        """Runs the classifier on several texts at once. Classifiers that can
+        run a single batched forward pass override this method.
+
+        Args:
+                texts: list of texts (strings or lists of words)
+
+        Returns:
+                `List[LazaroOutput]`: one output per text, in the same order
+        """
+        return [self.predict(text) for text in texts]
+
+    @property
+    def model_version(self) -> str:
+        """Identifies the exact model that was loaded (outputs cached for one
+        version of a model are not served for another one)"""
+        return ""
+
 
 @attr.s
 class FlairClassifier(LazaroClassifier):
+    """Flair BiLSTM-CRF classifier.
+
+    Flair embeddings keep per-call state on shared objects (such as the
+    tokenizer of transformer embeddings), so concurrent calls are serialized.
+    To tag faster from several threads, send batches with `predict_batch`.
+    Embeddings are not kept on the sentences once they are tagged.
+    """
+
     model_file = attr.ib(type=str, default=FLAIR_DEFAULT_MODEL, validator=attr.validators.in_(BILSTM_MODELS))
+    num_threads = attr.ib(type=int, default=None)
     model = attr.ib()
+    decoder = attr.ib(factory=TagDecoder, init=False, repr=False, eq=False)
+    _lock = attr.ib(factory=threading.Lock, init=False, repr=False, eq=False)
 
     @model.default
     def load_model(self):
+        set_torch_threads(self.num_threads)
         tagger = SequenceTagger.load(self.model_file)
+        tagger.eval()
         return tagger
 
     def predict(self, text: str) -> LazaroOutput:
-        sentence = Sentence(text)
-        self.model.predict(sentence, force_token_predictions=True)
-        sentence = LazaroOutput.from_Flair(sentence)
-        return sentence
+        with timing.stage("flair.tokenize", batch_size=1) as timed:
+            sentence = Sentence(text)
+            timed.count(tokens=len(sentence))
+        with self._lock, timing.stage("flair.predict", batch_size=1, tokens=len(sentence)):
+            self.model.predict(sentence, force_token_predictions=True, embedding_storage_mode="none")
+        with timing.stage("output", tokens=len(sentence)):
+            return LazaroOutput.from_Flair(sentence, self.decoder)
+
+    def predict_batch(self, texts: List) -> List[LazaroOutput]:
+        if not texts:
+            return []
+        with timing.stage("flair.tokenize", batch_size=len(texts)) as timed:
+            sentences = [Sentence(text) for text in texts]
+            timed.count(tokens=sum(len(sentence) for sentence in sentences) if timing.enabled() else 0)
+        with self._lock, timing.stage("flair.predict", batch_size=len(texts)):
+            self.model.predict(sentences, mini_batch_size=len(sentences), force_token_predictions=True,
+                               embedding_storage_mode="none")
+        with timing.stage("output", batch_size=len(texts)):
+            return LazaroOutput.batch_from_Flair(sentences, self.decoder)
 
 
 @attr.s
 class TransformersClassifier(LazaroClassifier):
+    """Transformers token classification model.
+
+    Forward passes run concurrently without gradient tracking. Fast tokenizers
+    mutate their padding/truncation settings on every call, so tokenization is
+    done under a lock.
+    """
+
     model_file = attr.ib(type=str, default=TRANSFORMERS_DEFAULT_MODEL, validator=attr.validators.in_(TRANSFORMERS_MODELS))
+    num_threads = attr.ib(type=int, default=None)
     model = attr.ib()
     tokenizer = attr.ib()
+    decoder = attr.ib(init=False, repr=False, eq=False)
+    _tokenizer_lock = attr.ib(factory=threading.Lock, init=False, repr=False, eq=False)
 
     @model.default
     def load_model(self) -> AutoModelForTokenClassification:
+        set_torch_threads(self.num_threads)
         model = AutoModelForTokenClassification.from_pretrained(self.model_file)
+        model.eval()
         return model
 
     @tokenizer.default
@@ -90,33 +164,80 @@ class TransformersClassifier(LazaroClassifier):
         tokenizer = AutoTokenizer.from_pretrained(self.model_file, do_lower_case=False)
         return tokenizer
 
+    @decoder.default
+    def load_decoder(self) -> TagDecoder:
+        # label ids are the ids predicted by the model
+        id2label = self.model.config.id2label
+        return TagDecoder([id2label[i] for i in range(len(id2label))])
+
     def predict(self, text) -> LazaroOutput:
         if isinstance(text, list): # text is already tokenized
-            output = self.predict_on_tokenized(text)
-            return LazaroOutput.from_Transformers(output)
+            with timing.stage("transformers.predict_tokenized", batch_size=1, tokens=len(text)):
+                output = self.predict_on_tokenized(text)
+            with timing.stage("output", tokens=len(text)):
+                return LazaroOutput.from_Transformers(output)
         else:
-            inputs = self.tokenizer(text, return_tensors="pt")
-            tokens = inputs.tokens()
+            with self._tokenizer_lock, timing.stage("transformers.tokenize", batch_size=1) as timed:
+                inputs = self.tokenizer(text, return_tensors="pt", return_offsets_mapping=self.tokenizer.is_fast)
+                tokens = inputs.tokens()
+                timed.count(subwords=len(tokens))
+            offset_mapping = inputs.pop("offset_mapping", None)
+            with torch.no_grad(), timing.stage("transformers.forward", batch_size=1, subwords=len(tokens)):
+                outputs = self.model(**inputs).logits
+                predictions = torch.argmax(outputs, dim=2)
+            with timing.stage("output") as timed:
+                words, label_ids, offsets = merge_wordpieces(
+                    tokens, predictions[0].tolist(), offset_mapping[0].tolist() if offset_mapping is not None else None
+                )
+                timed.count(tokens=len(words))
+                return LazaroOutput.from_label_ids(words, label_ids, decoder=self.decoder, offsets=offsets)
+
+    def predict_batch(self, texts: List) -> List[LazaroOutput]:
+        if not texts or any(isinstance(text, list) for text in texts):
+            return super().predict_batch(texts)
+        with self._tokenizer_lock, timing.stage("transformers.tokenize", batch_size=len(texts)) as timed:
+            inputs = self.tokenizer(texts, padding=True, return_tensors="pt",
+                                    return_offsets_mapping=self.tokenizer.is_fast)
+            if timing.enabled():
+                # padded batch: subwords counts the ones the model attends to, padded_subwords the whole tensor
+                timed.count(subwords=int(inputs["attention_mask"].sum()),
+                            padded_subwords=inputs["attention_mask"].numel())
+        offset_mapping = inputs.pop("offset_mapping", None)
+        with torch.no_grad(), timing.stage("transformers.forward", batch_size=len(texts)):
             outputs = self.model(**inputs).logits
-            predictions = torch.argmax(outputs, dim=2)
-            output = [
-                (token, self.model.config.id2label[prediction])
-                for token, prediction in zip(tokens, predictions[0].numpy())
-            ]
-        return LazaroOutput.from_Transformers(output)
-        
+            predictions = torch.argmax(outputs, dim=2).tolist()
+        with timing.stage("output", batch_size=len(texts)):
+            attention_mask = inputs["attention_mask"].tolist()
+            offset_mapping = offset_mapping.tolist() if offset_mapping is not None else None
+            rows = []
+            for i in range(len(texts)):
+                attended = [j for j, mask in enumerate(attention_mask[i]) if mask]
+                pieces = inputs.tokens(i)
+                words, label_ids, offsets = merge_wordpieces(
+                    [pieces[j] for j in attended],
+                    [predictions[i][j] for j in attended],
+                    [offset_mapping[i][j] for j in attended] if offset_mapping is not None else None,
+                )
+                rows.append((words, label_ids, None, None, offsets))
+            return LazaroOutput.batch_from_label_ids(rows, self.decoder)
+
+    @property
+    def model_version(self) -> str:
+        return getattr(self.model.config, "_commit_hash", None) or ""
+
     def predict_on_tokenized(self, tokenized_text: list) -> list:
         grouped_inputs = [torch.LongTensor([self.tokenizer.cls_token_id])]
         subtokens_per_token = []
 
-        for token in tokenized_text:
-            tokens = self.tokenizer.encode(
-                token,
-                return_tensors="pt",
-                add_special_tokens=False,
-            ).squeeze(axis=0)
-            grouped_inputs.append(tokens)
-            subtokens_per_token.append(len(tokens))
+        with self._tokenizer_lock:
+            for token in tokenized_text:
+                tokens = self.tokenizer.encode(
+                    token,
+                    return_tensors="pt",
+                    add_special_tokens=False,
+                ).squeeze(axis=0)
+                grouped_inputs.append(tokens)
+                subtokens_per_token.append(len(tokens))
 
         grouped_inputs.append(torch.LongTensor([self.tokenizer.sep_token_id]))
 
@@ -124,7 +245,8 @@ class TransformersClassifier(LazaroClassifier):
         flattened_inputs = torch.unsqueeze(flattened_inputs, 0)
 
         # Predict
-        predictions_tensor = self.model(flattened_inputs)[0]
+        with torch.no_grad():
+            predictions_tensor = self.model(flattened_inputs)[0]
         predictions_tensor = torch.argmax(predictions_tensor, dim=2)
 
 
@@ -156,11 +278,23 @@ class TransformersClassifier(LazaroClassifier):
 
 @attr.s
 class CRFClassifier(LazaroClassifier):
+    """CRF classifier with handcrafted features.
+
+    Each thread gets its own pycrfsuite tagger and embeddings database
+    connection, so feature extraction and tagging run concurrently. The spaCy
+    pipeline (with the custom tokenizer, set up once when the model is loaded)
+    is shared and called under a lock. With spaCy 3.8+, texts are parsed in
+    memory zones (see `pylazaro.utils.SharedMemoryZone`), so the vocab does not
+    grow with every unseen word.
+    """
+
     model_file = attr.ib(
         default=CRF_FILENAME, validator=attr.validators.instance_of(str)
     )
     model = attr.ib()
     spacy_model = attr.ib()
+    _spacy_lock = attr.ib(factory=threading.Lock, init=False, repr=False, eq=False)
+    _memory_zone = attr.ib(init=False, repr=False, eq=False)
 
     @model.default
     def load_model(self):
@@ -188,9 +322,8 @@ class CRFClassifier(LazaroClassifier):
                 window_size,
             )
         )
-        crf.tagger = pycrfsuite.Tagger()
         try:
-            crf.tagger.open(path_to_model.as_posix())
+            crf.open(path_to_model.as_posix())
         except:
             print(
                 "CRF model file does not exist. Extended installation needed! Please install the extended version of pylazaro (See https://pylazaro.readthedocs.io/en/latest/install.html)"
@@ -205,44 +338,44 @@ class CRFClassifier(LazaroClassifier):
             print(
                 "Spacy model not installed. Did you forget to run the \"python -m spacy download es_core_news_md\" command from the extended installation? Please see the extended version of pylazaro (See https://pylazaro.readthedocs.io/en/latest/install.html)"
             )
-        #spacy_model.tokenizer = CRFClassifier.custom_tokenizer(spacy_model)
+        spacy_model.tokenizer = CRFClassifier.custom_tokenizer(spacy_model)
         return spacy_model
 
-    def predict(self, text: str) -> LazaroOutput:
-        if isinstance(text, list): # text is already tokenized
-            text = Doc(self.spacy_model.vocab, words=text)
-        else:
-            self.spacy_model.tokenizer = CRFClassifier.custom_tokenizer(self.spacy_model)
-        doc = self.spacy_model(text)
-        predicted_tags = [tag for sent in doc.sents for tag in self.model(sent)]
-        doc.user_data["tags"] = predicted_tags
-        predicted_tags_biluo = CRFClassifier.to_biluo(predicted_tags)
-        predicted_spans = biluo_tags_to_spans(doc, predicted_tags_biluo)
-        doc.ents = predicted_spans
-        return LazaroOutput.from_CRF(doc)
+    @_memory_zone.default
+    def _shared_memory_zone(self) -> SharedMemoryZone:
+        return SharedMemoryZone(self.spacy_model)
 
-    @staticmethod
-    def to_biluo(tags: List[str]) -> List[str]:
-        new_tags = []
-        for i, tag in enumerate(tags):
-            if tag.startswith("B"):
-                if i < len(tags) - 1 and tags[i + 1].startswith("I"):
-                    new_tags.append(tag)
-                else:
-                    new_tag = "U" + tag[1:]
-                    new_tags.append(new_tag)
-            elif tag.startswith("I"):
-                if i==0 or tags[i - 1].startswith("O") or tags[i - 1].startswith("L"): # invalid sequence
-                    new_tag = "B" + tag[1:]
-                    new_tags.append(new_tag)
-                elif i < len(tags) - 1 and tags[i + 1].startswith("I"):
-                    new_tags.append(tag)
-                else:
-                    new_tag = "L" + tag[1:]
-                    new_tags.append(new_tag)
-            else:
-                new_tags.append(tag)
-        return new_tags
+    @property
+    def model_version(self) -> str:
+        path_to_model = Path(PATH_TO_MODELS_DIR, self.model_file)
+        if not path_to_model.exists():
+            return ""
+        stat = path_to_model.stat()
+        return "%d-%d" % (stat.st_size, stat.st_mtime)
+
+    def predict(self, text: str) -> LazaroOutput:
+        # the docs only live until the output is built: the strings of their words are then freed
+        with self._memory_zone(1):
+            with self._spacy_lock, timing.stage("crf.spacy", batch_size=1) as timed:
+                if isinstance(text, list): # text is already tokenized
+                    text = Doc(self.spacy_model.vocab, words=text)
+                doc = self.spacy_model(text)
+                timed.count(tokens=len(doc))
+            doc.user_data["tags"] = [tag for sent in doc.sents for tag in self.model(sent)]
+            with timing.stage("output", tokens=len(doc)):
+                return LazaroOutput.from_CRF(doc)
+
+    def predict_batch(self, texts: List) -> List[LazaroOutput]:
+        if any(isinstance(text, list) for text in texts):
+            return super().predict_batch(texts)
+        with self._memory_zone(len(texts)):
+            with self._spacy_lock, timing.stage("crf.spacy", batch_size=len(texts)) as timed:
+                docs = list(self.spacy_model.pipe(texts))
+                timed.count(tokens=sum(len(doc) for doc in docs))
+            for doc in docs:
+                doc.user_data["tags"] = [tag for sent in doc.sents for tag in self.model(sent)]
+            with timing.stage("output", batch_size=len(texts)):
+                return LazaroOutput.batch_from_CRF(docs)
 
     @staticmethod
     def custom_tokenizer(nlp: Language) -> Tokenizer:
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Hashable
+
+import attr
+
+
+@attr.s
+class CoalescingStats(object):
+    """Counters of a SingleFlight
+
+    Attributes:
+            calls (int): number of calls received
+            coalesced (int): calls that were answered by a computation started by another call
+    """
+
+    calls = attr.ib(type=int, default=0)
+    coalesced = attr.ib(type=int, default=0)
+
+    def to_dict(self) -> Dict:
+        return attr.asdict(self)
+
+
+class SingleFlight(object):
+    """Makes concurrent calls with the same key share a single computation:
+    the first call runs it and every call that arrives while it is in flight
+    receives the same result (or exception).
+
+    Thread callers (`do`) and asyncio callers (`do_async`) share the same table
+    of in-flight computations, so they are coalesced with each other too.
+
+    Note that every caller gets the very same result object.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._in_flight = {}  # type: Dict[Hashable, Future]
+        self.stats = CoalescingStats()
+
+    def _join(self, key: Hashable):
+        """Returns the future for the key and whether the caller has to compute it"""
+        with self._lock:
+            self.stats.calls += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.stats.coalesced += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            return future, True
+
+    def _forget(self, key: Hashable) -> None:
+        with self._lock:
+            del self._in_flight[key]
+
+    def do(self, key: Hashable, fn: Callable, *args):
+        """Calls `fn(*args)`, unless a call with the same key is already in flight,
+        in which case it waits for that call and returns its result"""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._forget(key)
+        future.set_result(result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable[..., Awaitable], *args):
+        """Asyncio version of `do`: awaits `fn(*args)` unless a call with the same
+        key is already in flight. The computation runs in its own task, so
+        cancelling one of the callers does not cancel it for the others."""
+        future, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(fn(*args))
+
+            def _resolve(task: asyncio.Task) -> None:
+                self._forget(key)
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+
+            task.add_done_callback(_resolve)
+        return await asyncio.shield(asyncio.wrap_future(future))
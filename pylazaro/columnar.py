@@ -0,0 +1,265 @@
+import math
+from array import array
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from pylazaro.output import LazaroOutput
+from pylazaro.token import LANGUAGES
+
+# Column layout of a BatchResult (n documents, t tokens, b borrowings):
+#
+#   doc_offsets     n + 1 x q   tokens of document i are [doc_offsets[i], doc_offsets[i + 1])
+#   word_offsets    t + 1 x q   utf-8 bytes of token j are words[word_offsets[j]:word_offsets[j + 1]]
+#   words           utf-8 bytes of all the words, concatenated
+#   labels          t x B       index into label_names
+#   positions       t x I
+#   probabilities   t x d       NaN for tokens without probability
+#   start_chars     t x q       character offset of the token in its document (-1 if unknown)
+#   end_chars       t x q       character offset of the end of the token (-1 if unknown)
+#   span_offsets    n + 1 x q   borrowings of document i are [span_offsets[i], span_offsets[i + 1])
+#   span_starts     b x I       start token of the borrowing (relative to its document)
+#   span_ends       b x I       end token of the borrowing (relative to its document)
+#   span_languages  b x B       index into LANGUAGES (see `pylazaro.token`)
+#
+# This is the layout of Arrow string and list columns, so the columns can be
+# handed to numpy and pyarrow without copying them.
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is needed to export to Arrow/Parquet: pip install pylazaro[arrow]")
+    return pyarrow
+
+
+class BatchResult(object):
+    """The outputs of many documents stored as contiguous columns (see the layout
+    above) instead of as one LazaroOutput object per document. Outputs can be
+    appended in chunks, and the columns can be read as numpy arrays or exported
+    to Arrow tables and Parquet files (if pyarrow is installed) without going
+    through per-document Python objects.
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro import Lazaro
+                    >>> from pylazaro.columnar import BatchResult
+                    >>> tagger = Lazaro()
+                    >>> result = BatchResult()
+                    >>> for chunk in chunks:
+                    ...     result.extend(tagger.analyze_batch(chunk))
+                    >>> result.borrowings_table().to_pandas()
+    """
+
+    def __init__(self, outputs: Iterable[LazaroOutput] = ()) -> None:
+        self.doc_offsets = array("q", [0])
+        self.word_offsets = array("q", [0])
+        self.words = bytearray()
+        self.labels = array("B")
+        self.label_names = []  # type: List[str]
+        self._label_codes = {}  # type: Dict[str, int]
+        self.positions = array("I")
+        self.probabilities = array("d")
+        self.start_chars = array("q")
+        self.end_chars = array("q")
+        self.span_offsets = array("q", [0])
+        self.span_starts = array("I")
+        self.span_ends = array("I")
+        self.span_languages = array("B")
+        self.extend(outputs)
+
+    def __len__(self) -> int:
+        return len(self.doc_offsets) - 1
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.labels)
+
+    @property
+    def n_borrowings(self) -> int:
+        return len(self.span_starts)
+
+    def _label_code(self, label: str) -> int:
+        code = self._label_codes.get(label)
+        if code is None:
+            code = len(self.label_names)
+            if code > 255:
+                raise ValueError("Too many distinct labels to store: %d" % (code + 1))
+            self._label_codes[label] = code
+            self.label_names.append(label)
+        return code
+
+    def append(self, output: LazaroOutput) -> None:
+        """Adds the output of one document"""
+        word_offset = self.word_offsets[-1]
+        for word in output.words:
+            encoded = word.encode("utf-8")
+            self.words.extend(encoded)
+            word_offset = word_offset + len(encoded)
+            self.word_offsets.append(word_offset)
+        self.labels.extend(self._label_code(label) for label in output.labels)
+        self.positions.extend(output.positions)
+        self.probabilities.extend(math.nan if prob is None else prob for prob in output.probabilities)
+        for start_char, end_char in output.offsets:
+            self.start_chars.append(-1 if start_char is None else start_char)
+            self.end_chars.append(-1 if end_char is None else end_char)
+        self.doc_offsets.append(len(self.labels))
+        for start_pos, end_pos, lang_code in output.span_ranges:
+            self.span_starts.append(start_pos)
+            self.span_ends.append(end_pos)
+            self.span_languages.append(lang_code)
+        self.span_offsets.append(len(self.span_starts))
+
+    def extend(self, outputs: Iterable[LazaroOutput]) -> None:
+        """Adds the outputs of several documents"""
+        for output in outputs:
+            self.append(output)
+
+    def _word(self, j: int) -> str:
+        return self.words[self.word_offsets[j]:self.word_offsets[j + 1]].decode("utf-8")
+
+    def output(self, i: int) -> LazaroOutput:
+        """Rebuilds the LazaroOutput of the i-th document"""
+        start, end = self.doc_offsets[i], self.doc_offsets[i + 1]
+        words = [self._word(j) for j in range(start, end)]
+        labels = [self.label_names[code] for code in self.labels[start:end]]
+        probabilities = [None if math.isnan(prob) else prob for prob in self.probabilities[start:end]]
+        offsets = None
+        if any(char >= 0 for char in self.start_chars[start:end]):
+            offsets = [(None if start_char < 0 else start_char, None if end_char < 0 else end_char)
+                       for start_char, end_char in zip(self.start_chars[start:end], self.end_chars[start:end])]
+        return LazaroOutput.from_arrays(words, labels, self.positions[start:end].tolist(), probabilities,
+                                        offsets=offsets)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.output(i)
+
+    def to_numpy(self) -> Dict[str, np.ndarray]:
+        """Returns the columns as numpy arrays that share memory with the batch.
+        The batch cannot grow while these arrays (or tables built from them) are alive."""
+        return {
+            name: np.frombuffer(getattr(self, name), dtype=dtype)
+            for name, dtype in [
+                ("doc_offsets", np.int64),
+                ("word_offsets", np.int64),
+                ("words", np.uint8),
+                ("labels", np.uint8),
+                ("positions", np.uint32),
+                ("probabilities", np.float64),
+                ("start_chars", np.int64),
+                ("end_chars", np.int64),
+                ("span_offsets", np.int64),
+                ("span_starts", np.uint32),
+                ("span_ends", np.uint32),
+                ("span_languages", np.uint8),
+            ]
+        }
+
+    def _doc_ids(self, offsets: np.ndarray) -> np.ndarray:
+        # one document index per token (or per borrowing)
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(offsets))
+
+    def tokens_table(self, doc_ids: List = None):
+        """Returns an Arrow table with one row per token: doc, word, label, position, probability,
+        start_char and end_char (null where unknown)
+
+        Args:
+                doc_ids (List, optional): id of each document (its index in the batch by default)
+        """
+        pa = _require_pyarrow()
+        columns = self.to_numpy()
+        words = pa.Array.from_buffers(
+            pa.large_string(), self.n_tokens,
+            [None, pa.py_buffer(columns["word_offsets"]), pa.py_buffer(columns["words"])],
+        )
+        labels = pa.DictionaryArray.from_arrays(pa.array(columns["labels"]), pa.array(self.label_names))
+        probabilities = pa.array(columns["probabilities"], mask=np.isnan(columns["probabilities"]))
+        doc = self._doc_ids(columns["doc_offsets"])
+        return pa.table({
+            "doc": pa.array(doc) if doc_ids is None else pa.array(doc_ids).take(pa.array(doc)),
+            "word": words,
+            "label": labels,
+            "position": pa.array(columns["positions"]),
+            "probability": probabilities,
+            "start_char": pa.array(columns["start_chars"], mask=columns["start_chars"] < 0),
+            "end_char": pa.array(columns["end_chars"], mask=columns["end_chars"] < 0),
+        })
+
+    def borrowings_table(self, doc_ids: List = None):
+        """Returns an Arrow table with one row per borrowing: doc, borrowing, language, start_pos, end_pos
+        (the same fields as `LazaroOutput.borrowings_to_dict`)
+
+        Args:
+                doc_ids (List, optional): id of each document (its index in the batch by default)
+        """
+        pa = _require_pyarrow()
+        columns = self.to_numpy()
+        doc = self._doc_ids(columns["span_offsets"])
+        first_tokens = columns["doc_offsets"][doc].tolist()
+        borrowings = [
+            " ".join(self._word(j) for j in range(first + start, first + end))
+            for first, start, end in zip(first_tokens, self.span_starts, self.span_ends)
+        ]
+        languages = pa.DictionaryArray.from_arrays(
+            pa.array(columns["span_languages"]), pa.array([language or "" for language in LANGUAGES])
+        )
+        return pa.table({
+            "doc": pa.array(doc) if doc_ids is None else pa.array(doc_ids).take(pa.array(doc)),
+            "borrowing": pa.array(borrowings, type=pa.string()),
+            "language": languages,
+            "start_pos": pa.array(columns["span_starts"]),
+            "end_pos": pa.array(columns["span_ends"]),
+        })
+
+
+class ParquetBatchWriter(object):
+    """Streams BatchResults into a Parquet file, one row group per batch
+
+    Attributes:
+            path (str): the Parquet file to write
+            table (str): "borrowings" (one row per borrowing) or "tokens" (one row per token)
+
+    Example:
+            .. code-block:: python
+
+                    >>> with ParquetBatchWriter("borrowings.parquet") as writer:
+                    ...     for chunk in chunks:
+                    ...         writer.write(BatchResult(tagger.analyze_batch(chunk)))
+    """
+
+    def __init__(self, path: str, table: str = "borrowings") -> None:
+        if table not in ("borrowings", "tokens"):
+            raise ValueError("Unknown table: %s" % table)
+        self.path = path
+        self.table = table
+        self._writer = None
+        self._n_docs = 0
+
+    def write(self, batch: BatchResult, doc_ids: List = None) -> None:
+        """Writes a batch. Without doc_ids, documents are numbered across all the batches written."""
+        pq = _require_pyarrow().parquet
+        if doc_ids is None:
+            doc_ids = list(range(self._n_docs, self._n_docs + len(batch)))
+        self._n_docs = self._n_docs + len(batch)
+        if self.table == "tokens":
+            table = batch.tokens_table(doc_ids)
+        else:
+            table = batch.borrowings_table(doc_ids)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
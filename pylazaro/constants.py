@@ -12,6 +12,8 @@ PATH_TO_EMBEDDINGS_DECOMPRESS = Path(PATH_TO_EMBEDDINGS_DIR, EMBEDDINGS_DECOMPRE
 
 PATH_TO_MODELS_DIR = Path(os.path.dirname(os.path.realpath(__file__)), "models")
 
+PATH_TO_TUNED_CONFIG = Path(Path.home(), ".pylazaro", "tuned.json")
+
 CS_MODEL = "lirondos/anglicisms-spanish-flair-cs"
 BETO_BERT_MODEL = "lirondos/anglicisms-spanish-flair-bert-beto"
 FLAIR_DEFAULT_MODEL = CS_MODEL
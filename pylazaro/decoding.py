@@ -0,0 +1,196 @@
+import itertools
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pylazaro.token import BIO_BEGIN, BIO_INSIDE, NO_LANGUAGE, decode_label
+
+# Decoding of the labels predicted by any of the models into borrowing spans.
+#
+# Labels are turned into integer ids once (models that predict ids, like the
+# transformers ones, give them directly), and every id has a BIO code and a
+# language code. Spans are then found in a single pass over the ids:
+#
+#   B-X           starts a borrowing of language X
+#   I-X           continues the current borrowing if it is of language X, and
+#                 starts a new one otherwise (I after O, or after a borrowing
+#                 of another language, is read as B)
+#   anything else ends the current borrowing
+#
+# The same rules are applied by `pylazaro.utils.fuse_span_ranges`.
+
+SpanRanges = List[Tuple[int, int, int]]
+
+
+class TagDecoder(object):
+    """Turns label ids into labels and borrowing spans
+
+    Attributes:
+            labels (List[str]): the label of each id (for instance, the `id2label`
+                        of a transformers model); new labels get the next id
+    """
+
+    def __init__(self, labels: Sequence[str] = ()) -> None:
+        self.labels = []  # type: List[str]
+        self._ids = {}  # type: Dict[str, int]
+        self._bio_codes = []  # type: List[int]
+        self._lang_codes = []  # type: List[int]
+        self._tables = None
+        self._lock = threading.Lock()
+        for label in labels:
+            self.label_id(label)
+
+    def label_id(self, label: str) -> int:
+        label_id = self._ids.get(label)
+        if label_id is None:
+            with self._lock:
+                label_id = self._ids.get(label)
+                if label_id is None:
+                    label, bio_code, lang_code = decode_label(label)
+                    label_id = len(self.labels)
+                    self.labels.append(label)
+                    self._bio_codes.append(bio_code)
+                    # a B or I label without a language cannot open a borrowing
+                    self._lang_codes.append(lang_code if bio_code in (BIO_BEGIN, BIO_INSIDE) else NO_LANGUAGE)
+                    self._ids[label] = label_id
+                    self._tables = None
+        return label_id
+
+    def encode(self, labels: Sequence[str]) -> List[int]:
+        ids = self._ids
+        return [ids.get(label) if label in ids else self.label_id(label) for label in labels]
+
+    def decode(self, label_ids: Sequence[int]) -> Tuple[List[str], SpanRanges]:
+        """Decodes the label ids of a text in one pass
+
+        Returns:
+                Tuple[List[str], List[Tuple[int, int, int]]]: the labels and the
+                (start, end, language code) of each borrowing
+        """
+        labels = self.labels
+        bio_codes = self._bio_codes
+        lang_codes = self._lang_codes
+        decoded = []
+        ranges = []
+        current = NO_LANGUAGE
+        start_pos = 0
+        for i, label_id in enumerate(label_ids):
+            decoded.append(labels[label_id])
+            lang_code = lang_codes[label_id]
+            if lang_code and bio_codes[label_id] == BIO_INSIDE and lang_code == current:
+                continue
+            if current:
+                ranges.append((start_pos, i, current))
+            current = lang_code
+            start_pos = i
+        if current:
+            ranges.append((start_pos, len(decoded), current))
+        return decoded, ranges
+
+    def _code_tables(self) -> Tuple[np.ndarray, np.ndarray]:
+        tables = self._tables
+        if tables is None:
+            tables = self._tables = (np.array(self._bio_codes, dtype=np.int8),
+                                     np.array(self._lang_codes, dtype=np.int32))
+        return tables
+
+    def decode_batch(self, label_ids: Sequence[Sequence[int]]) -> List[Tuple[List[str], SpanRanges]]:
+        """Decodes the label ids of several texts at once: the borrowings of the
+        whole batch are found with array operations instead of a loop per token
+
+        Returns:
+                List[Tuple[List[str], List[Tuple[int, int, int]]]]: the labels and borrowings of each text
+        """
+        if not label_ids:
+            return []
+        lengths = np.array([len(ids) for ids in label_ids], dtype=np.int64)
+        if not lengths.any():
+            # empty texts only: the code tables of a fresh decoder may be empty as well
+            return [([], []) for _ in label_ids]
+        bio_table, lang_table = self._code_tables()
+        width = int(lengths.max()) + 1  # at least one padding column, so every span ends within its row
+        padded = np.zeros((len(label_ids), width), dtype=np.int64)
+        valid = np.arange(width)[None, :] < lengths[:, None]
+        flat = np.fromiter(itertools.chain.from_iterable(label_ids), dtype=np.int64, count=int(lengths.sum()))
+        padded[valid] = flat
+        lang = np.where(valid, lang_table[padded], NO_LANGUAGE)
+        bio = bio_table[padded]
+
+        inside = lang != NO_LANGUAGE
+        previous_lang = np.zeros_like(lang)
+        previous_lang[:, 1:] = lang[:, :-1]
+        starts = inside & ((bio != BIO_INSIDE) | (previous_lang != lang))
+        following = np.zeros_like(starts)
+        following[:, :-1] = inside[:, 1:] & ~starts[:, 1:]
+        ends = inside & ~following
+
+        start_rows, start_cols = np.nonzero(starts)
+        _, end_cols = np.nonzero(ends)
+        spans = list(zip(start_cols.tolist(), (end_cols + 1).tolist(), lang[start_rows, start_cols].tolist()))
+        span_bounds = np.searchsorted(start_rows, np.arange(len(label_ids) + 1)).tolist()
+        labels = np.array(self.labels, dtype=object)[flat].tolist()
+        label_bounds = [0] + np.cumsum(lengths).tolist()
+
+        return [
+            (labels[label_bounds[row]:label_bounds[row + 1]], spans[span_bounds[row]:span_bounds[row + 1]])
+            for row in range(len(label_ids))
+        ]
+
+
+def merge_wordpieces(pieces: Sequence[str], labels: Sequence,
+                     offsets: Sequence[Tuple[int, int]] = None) -> Tuple[List[str], List, Optional[List]]:
+    """Glues "##" wordpieces back into words (dropping [CLS] and [SEP]); each word
+    takes the label of its first piece
+
+    Args:
+            pieces (Sequence[str]): the wordpieces
+            labels (Sequence): the label (or label id) of each piece
+            offsets (Sequence[Tuple[int, int]], optional): the character offsets of each piece
+                        (the `offset_mapping` of a fast tokenizer)
+
+    Returns:
+            Tuple[List[str], List, Optional[List]]: the words, their labels and their
+            character offsets (None if the offsets of the pieces were not given)
+    """
+    words = []
+    word_labels = []
+    word_offsets = []
+    word = ""
+    word_label = None
+    word_offset = None
+    if offsets is None:
+        piece_offsets = itertools.repeat((None, None))
+    else:
+        piece_offsets = offsets
+    for piece, label, (start_char, end_char) in zip(pieces, labels, piece_offsets):
+        if piece == "[CLS]" or piece == "[SEP]":
+            if word.strip():
+                words.append(word)
+                word_labels.append(word_label)
+                word_offsets.append(word_offset)
+                word = ""
+                word_label = None
+            continue
+        if piece.startswith("##"):
+            if not word:
+                word_label = label
+                word_offset = (start_char, end_char)
+            word = word + piece[2:]
+            word_offset = (word_offset[0], end_char)
+        else:
+            if word.strip():
+                words.append(word)
+                word_labels.append(word_label)
+                word_offsets.append(word_offset)
+            word = piece
+            word_label = label
+            word_offset = (start_char, end_char)
+    if word.strip():
+        words.append(word)
+        word_labels.append(word_label)
+        word_offsets.append(word_offset)
+    return words, word_labels, word_offsets if offsets is not None else None
+
+
+DEFAULT_DECODER = TagDecoder()
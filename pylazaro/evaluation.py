@@ -0,0 +1,274 @@
+import time
+from array import array
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import attr
+import numpy as np
+
+from pylazaro.token import LANGUAGES
+from pylazaro.utils import chunked, label_span_ranges
+
+# Span-level evaluation of a tagger against gold CoNLL data, next to its
+# throughput and latency. Gold sentences are tagged as strings (their words
+# joined by spaces), which goes through the same batched path as production
+# texts, and predicted spans are moved to the gold tokens through their
+# character offsets. The spans of the whole corpus are then matched at once,
+# language by language, as int64 keys (token position in the corpus and span
+# length) with numpy set operations.
+
+
+def read_conll_gold(lines: Iterable[str], label_column: int = -1) -> Iterator[Tuple[List[str], List[str]]]:
+    """Reads gold CoNLL-formatted sentences (one token per line, word in the first column and BIO
+    label, such as "B-ENG", in `label_column`; blank lines between sentences)
+
+    Returns:
+            Iterator[Tuple[List[str], List[str]]]: (words, labels) of each sentence
+    """
+    words = []
+    labels = []
+    for line in lines:
+        columns = line.split()
+        if not columns:
+            if words:
+                yield words, labels
+                words = []
+                labels = []
+            continue
+        if columns[0] == "-DOCSTART-":
+            continue
+        words.append(columns[0])
+        labels.append(columns[label_column] if len(columns) > 1 else "O")
+    if words:
+        yield words, labels
+
+
+def project_spans(spans: Sequence[Tuple[int, int, int]], words: Sequence[str], gold_words: Sequence[str],
+                  offsets: Sequence[Tuple[int, int]] = None) -> List[Tuple[int, int, int]]:
+    """Moves (start, end, language) spans over `words` to the tokens of `gold_words`
+
+    With the character `offsets` of the words in the gold words joined by spaces, spans are
+    moved to the gold tokens they overlap, however the tagger tokenized the text. Without
+    them, the tagger can only split the gold tokens further (both have to spell the same
+    characters). Spans that land on the same gold tokens (two pieces of one gold token, for
+    instance) are only kept once."""
+    if not spans:
+        return []
+    if offsets is not None and all(offsets[start][0] is not None and offsets[end - 1][1] is not None
+                                   for start, end, _ in spans):
+        gold_starts = np.cumsum([0] + [len(word) + 1 for word in gold_words[:-1]])
+        projected = [
+            (int(np.searchsorted(gold_starts, offsets[start][0], side="right")) - 1,
+             int(np.searchsorted(gold_starts, offsets[end - 1][1], side="left")), lang_code)
+            for start, end, lang_code in spans
+        ]
+    elif len(words) == len(gold_words):
+        return list(spans)
+    else:
+        gold_ends = np.cumsum([len(word) for word in gold_words])
+        starts = np.cumsum([0] + [len(word) for word in words[:-1]])
+        # gold token that holds the first character of each token
+        gold_index = np.searchsorted(gold_ends, starts, side="right").tolist()
+        projected = [(gold_index[start], gold_index[end - 1] + 1, lang_code) for start, end, lang_code in spans]
+    return list(dict.fromkeys(projected))
+
+
+@attr.s(slots=True)
+class Scores(object):
+    """Span-level scores of one language (exact match of boundaries and language)
+
+    Attributes:
+            gold (int): number of gold spans
+            predicted (int): number of predicted spans
+            correct (int): predicted spans that match a gold span
+    """
+
+    gold = attr.ib(type=int, default=0)
+    predicted = attr.ib(type=int, default=0)
+    correct = attr.ib(type=int, default=0)
+
+    @property
+    def precision(self) -> float:
+        return self.correct / self.predicted if self.predicted else 0.0
+
+    @property
+    def recall(self) -> float:
+        return self.correct / self.gold if self.gold else 0.0
+
+    @property
+    def f1(self) -> float:
+        precision, recall = self.precision, self.recall
+        return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    def to_dict(self) -> Dict:
+        scores = attr.asdict(self)
+        scores.update({"precision": self.precision, "recall": self.recall, "f1": self.f1})
+        return scores
+
+
+class SpanColumns(object):
+    """Spans of a whole corpus as columns: start token (counted from the start of the
+    corpus), length and language code (an index into `pylazaro.token.LANGUAGES`)"""
+
+    def __init__(self) -> None:
+        self.starts = array("q")
+        self.lengths = array("q")
+        self.languages = array("q")
+
+    def extend(self, spans: Iterable[Tuple[int, int, int]], offset: int) -> None:
+        for start, end, lang_code in spans:
+            self.starts.append(offset + start)
+            self.lengths.append(end - start)
+            self.languages.append(lang_code)
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return (np.frombuffer(self.starts, dtype=np.int64), np.frombuffer(self.lengths, dtype=np.int64),
+                np.frombuffer(self.languages, dtype=np.int64))
+
+
+def match_spans(gold: SpanColumns, predicted: SpanColumns) -> Dict[str, Scores]:
+    """Scores of the predicted spans against the gold spans, per language and over all of them ("ALL")"""
+    gold_starts, gold_lengths, gold_languages = gold.columns()
+    predicted_starts, predicted_lengths, predicted_languages = predicted.columns()
+    max_length = int(max(gold_lengths.max(initial=0), predicted_lengths.max(initial=0)))
+    gold_keys = gold_starts * (max_length + 1) + gold_lengths
+    predicted_keys = predicted_starts * (max_length + 1) + predicted_lengths
+    scores = {}  # type: Dict[str, Scores]
+    total = Scores()
+    for lang_code in np.union1d(gold_languages, predicted_languages).tolist():
+        # a span found twice (such as two predicted spans projected onto the same gold tokens) counts once
+        gold_spans = np.unique(gold_keys[gold_languages == lang_code])
+        predicted_spans = np.unique(predicted_keys[predicted_languages == lang_code])
+        correct = int(np.intersect1d(gold_spans, predicted_spans).size)
+        scores[LANGUAGES[lang_code]] = Scores(len(gold_spans), len(predicted_spans), correct)
+        total.gold = total.gold + len(gold_spans)
+        total.predicted = total.predicted + len(predicted_spans)
+        total.correct = total.correct + correct
+    scores["ALL"] = total
+    return scores
+
+
+@attr.s
+class EvaluationResult(object):
+    """Accuracy and speed of a tagger configuration over a gold corpus
+
+    Attributes:
+            name (str): name of the configuration
+            scores (Dict[str, Scores]): span-level scores per language, and over all languages ("ALL")
+            n_docs (int): number of sentences tagged
+            n_tokens (int): number of gold tokens
+            batch_size (int): sentences per call to `analyze_batch`
+            pretokenized (bool): whether sentences were tagged as lists of gold words instead of as strings
+            wall (float): seconds spent tagging
+            latencies (List[float]): seconds of each call to `analyze_batch`
+    """
+
+    name = attr.ib(type=str)
+    scores = attr.ib(type=Dict[str, Scores])
+    n_docs = attr.ib(type=int)
+    n_tokens = attr.ib(type=int)
+    batch_size = attr.ib(type=int)
+    wall = attr.ib(type=float)
+    latencies = attr.ib(type=List[float], repr=False)
+    pretokenized = attr.ib(type=bool, default=False)
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.n_docs / self.wall if self.wall else 0.0
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.n_tokens / self.wall if self.wall else 0.0
+
+    def latency_ms(self, q: float) -> float:
+        """q-th percentile (0-100) of the latency of a batch, in ms"""
+        return 1000 * float(np.percentile(self.latencies, q)) if self.latencies else float("nan")
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "scores": {language: scores.to_dict() for language, scores in self.scores.items()},
+            "n_docs": self.n_docs,
+            "n_tokens": self.n_tokens,
+            "batch_size": self.batch_size,
+            "pretokenized": self.pretokenized,
+            "wall_s": self.wall,
+            "docs_per_sec": self.docs_per_sec,
+            "tokens_per_sec": self.tokens_per_sec,
+            "latency_p50_ms": self.latency_ms(50),
+            "latency_p95_ms": self.latency_ms(95),
+            "latency_p99_ms": self.latency_ms(99),
+        }
+
+
+def evaluate(tagger, sentences: Iterable[Tuple[List[str], List[str]]], batch_size: int = 32,
+             name: str = None, pretokenized: bool = False) -> EvaluationResult:
+    """Streams gold sentences through a tagger, `batch_size` at a time, and scores its borrowings
+
+    Sentences are tagged as strings, as production texts are. With `pretokenized`, they are
+    tagged as lists of gold words instead, which keeps the gold tokenization but is not what
+    is timed in production (the CRF model, for one, tags pre-tokenized texts one at a time).
+
+    Args:
+            tagger (`pylazaro.lazaro.Lazaro`): the tagger (any configuration)
+            sentences (Iterable[Tuple[List[str], List[str]]]): gold (words, labels), see `read_conll_gold`
+            batch_size (int): sentences per call to `analyze_batch`
+            name (str, optional): name of the configuration (the model type by default)
+            pretokenized (bool): tag the lists of gold words instead of the sentences as strings
+
+    Returns:
+            `EvaluationResult`: scores, throughput and latency
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro import Lazaro
+                    >>> from pylazaro.evaluation import evaluate, read_conll_gold
+                    >>> with open("test.conll", encoding="utf-8") as f:
+                    ...     result = evaluate(Lazaro(model_type="crf"), read_conll_gold(f))
+                    >>> result.scores["ENG"].f1
+                    0.84
+    """
+    gold = SpanColumns()
+    predicted = SpanColumns()
+    latencies = []
+    n_docs = 0
+    n_tokens = 0
+    for batch in chunked(sentences, batch_size):
+        texts = [words if pretokenized else " ".join(words) for words, _ in batch]
+        start = time.perf_counter()
+        outputs = tagger.analyze_batch(texts)
+        latencies.append(time.perf_counter() - start)
+        for (words, labels), output in zip(batch, outputs):
+            gold.extend(label_span_ranges(labels), n_tokens)
+            offsets = None if pretokenized else output.offsets
+            predicted.extend(project_spans(output.span_ranges, output.words, words, offsets), n_tokens)
+            n_tokens = n_tokens + len(words)
+        n_docs = n_docs + len(batch)
+    return EvaluationResult(
+        name=name or tagger.model_type + (" (pretokenized)" if pretokenized else ""),
+        scores=match_spans(gold, predicted),
+        n_docs=n_docs,
+        n_tokens=n_tokens,
+        batch_size=batch_size,
+        wall=sum(latencies),
+        latencies=latencies,
+        pretokenized=pretokenized,
+    )
+
+
+def format_table(results: Sequence[EvaluationResult], languages: Sequence[str] = ("ENG", "OTHER", "ALL")) -> str:
+    """One row per configuration: precision, recall and F1 per language next to throughput and latency"""
+    header = "%-24s %5s" % ("configuration", "batch")
+    for language in languages:
+        header = header + " %8s %8s %8s" % (language + " P", language + " R", language + " F1")
+    header = header + " %9s %10s %9s %9s" % ("docs/s", "tokens/s", "p50 ms", "p95 ms")
+    lines = [header]
+    for result in results:
+        line = "%-24s %5d" % (result.name, result.batch_size)
+        for language in languages:
+            scores = result.scores.get(language, Scores())
+            line = line + " %8.1f %8.1f %8.1f" % (100 * scores.precision, 100 * scores.recall, 100 * scores.f1)
+        line = line + " %9.1f %10.1f %9.2f %9.2f" % (
+            result.docs_per_sec, result.tokens_per_sec, result.latency_ms(50), result.latency_ms(95))
+        lines.append(line)
+    return "\n".join(lines)
@@ -1,16 +1,29 @@
+import asyncio
+import copy
+import difflib
+import functools
 import logging
 import os
 import pathlib
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import attr
 
+from pylazaro import metrics, timing
+from pylazaro.batching import MicroBatcher
+from pylazaro.cache import ResultCache, cache_key, model_namespace
 from pylazaro.classifiers import (
     CRFClassifier,
     FlairClassifier,
     LazaroClassifier,
     TransformersClassifier,
 )
+from pylazaro.coalesce import SingleFlight
 from pylazaro.output import LazaroOutput
+from pylazaro.tuning import tuned_setting, tuned_threads
+from pylazaro.utils import chunked, split_sentences
 
 logging.getLogger("transformers").setLevel(logging.ERROR)
 logging.getLogger("flair").setLevel(logging.ERROR)
@@ -23,15 +36,96 @@ if os.name == "nt":
     temp = pathlib.PosixPath
     pathlib.PosixPath = pathlib.WindowsPath
 
+# Classifiers loaded by unpickled (or lazy) Lazaro handles, shared by every
+# handle with the same configuration within a process
+_classifier_cache = {}  # type: Dict[Tuple, LazaroClassifier]
+_classifier_cache_pid = os.getpid()
+_classifier_cache_lock = threading.Lock()
+
+
+def _timed(method):
+    """Records the timings of an analyze method into the `timings` of its outputs,
+    when the tagger has `record_timings` set"""
+    @functools.wraps(method)
+    def timed(self, *args):
+        if not self.record_timings:
+            return method(self, *args)
+        with timing.record() as timings:
+            result = method(self, *args)
+        # outputs shared by coalesced calls or taken from an in-memory cache may be held by
+        # other callers too: each caller gets a copy of its own with its own timings
+        outputs = [copy.copy(output) for output in (result if isinstance(result, list) else [result])]
+        for output in outputs:
+            output.timings = timings
+        return outputs if isinstance(result, list) else outputs[0]
+    return timed
+
+
+def _metered(method):
+    """Updates the metrics of pylazaro (see `pylazaro.metrics`) after every call to an
+    analyze method, when the tagger has `collect_metrics` set"""
+    @functools.wraps(method)
+    def metered(self, *args):
+        if not self.collect_metrics:
+            return method(self, *args)
+        start = time.perf_counter()
+        result = method(self, *args)
+        metrics.observe_analysis(self.model_type, method.__name__, result if isinstance(result, list) else [result],
+                                 time.perf_counter() - start)
+        return result
+    return metered
+
+
+def _sentence_key(sentence):
+    """Sentences compared by `reanalyze` (pre-tokenized ones are lists of words)"""
+    return tuple(sentence) if isinstance(sentence, list) else sentence
+
+
+def _sentence_starts(text, sentences: List) -> Optional[List[int]]:
+    """Character offset of each sentence (a piece of the string) in the text"""
+    if not isinstance(text, str):
+        return None
+    starts = []
+    cursor = 0
+    for sentence in sentences:
+        start = text.find(sentence, cursor)
+        starts.append(start)
+        cursor = start + len(sentence)
+    return starts
+
 
 @attr.s
 class Lazaro(object):
     """The tagger object that will label words as being borrowings or not
 
+    A Lazaro object can be pickled (for instance, to ship it to Spark or Dask
+    executors): only its settings are pickled, and the unpickled copy loads
+    its model on first use, once per process.
+
     Attributes:
             model_type (str, optional): type of model.
             model_file (str, optional): model to be used.
+            num_threads (int, optional): number of threads torch uses within each operation
+                    (a process-wide setting; only used by the bilstm and transformers models).
+                    Defaults to the tuned thread count of a single process of the model on this host, if any
+                    (see `pylazaro.tuning`).
+            lazy (bool, optional): if True, the model is not loaded until the first text is analyzed
+                    (and is then shared by every lazy Lazaro with the same settings in the process).
             _classifier (:obj:`pylazaro.classifiers.LazaroClassifier` optional)
+            max_batch_size (int, optional): maximum number of texts that `analyze_async` groups into one forward pass.
+                    Defaults to the tuned batch size of the model on this host, or 16.
+            max_wait_ms (float, optional): maximum time (in ms) that `analyze_async` waits to fill a batch.
+            cache (:obj:`pylazaro.cache.ResultCache`, optional): cache of outputs, looked up by text and model.
+            sentence_cache (:obj:`pylazaro.cache.ResultCache`, optional): cache of sentence outputs used by
+                    `analyze_sentences` (a 10000-sentence in-memory cache is created on first use if none is given).
+            coalesce (bool, optional): if True, concurrent `analyze` and `analyze_async` calls on the same text share
+                    a single computation (see `coalescing_stats`). All of them receive the same LazaroOutput object.
+            record_timings (bool, optional): if True, outputs come with the time spent in each stage of the
+                    analysis (`output.timings`, see `pylazaro.timing`). Outputs of a batch share the timings of the batch.
+                    Each caller gets its own copy of the outputs, with the timings of its own call (even when
+                    `coalesce` makes concurrent calls share a computation, or outputs come from `cache`).
+            collect_metrics (bool, optional): if True (the default), every analysis updates the runtime metrics of
+                    pylazaro (requests, tokens, borrowings, cache lookups, batch sizes and latencies, see `pylazaro.metrics`).
 
     """
 
@@ -41,31 +135,108 @@ class Lazaro(object):
         validator=attr.validators.in_(["crf", "bilstm", "transformers"]),
     )
     model_file = attr.ib(type=str, default=None)
-    _classifier = attr.ib(validator=attr.validators.instance_of(LazaroClassifier))
+    num_threads = attr.ib(type=int)
+    lazy = attr.ib(type=bool, default=False)
+    _classifier = attr.ib(
+        validator=attr.validators.optional(attr.validators.instance_of(LazaroClassifier))
+    )
+    max_batch_size = attr.ib(type=int)
+    max_wait_ms = attr.ib(type=float, default=5.0)
+    cache = attr.ib(type=ResultCache, default=None, repr=False)
+    sentence_cache = attr.ib(type=ResultCache, default=None, repr=False)
+    coalesce = attr.ib(type=bool, default=False)
+    record_timings = attr.ib(type=bool, default=False)
+    collect_metrics = attr.ib(type=bool, default=True)
+    _single_flight = attr.ib(type=SingleFlight, factory=SingleFlight, init=False, repr=False, eq=False)
+    _batcher = attr.ib(type=MicroBatcher, default=None, init=False, repr=False)
+    _namespace = attr.ib(type=str, default=None, init=False, repr=False)
+
+    @num_threads.default
+    def _default_num_threads(self) -> Optional[int]:
+        return tuned_threads(self.model_type, self.model_file)
+
+    @max_batch_size.default
+    def _default_max_batch_size(self) -> int:
+        return tuned_setting(self.model_type, self.model_file, "batch_size", 16)
 
     @_classifier.default
+    def _default_classifier(self) -> Optional[LazaroClassifier]:
+        if self.lazy:
+            return None
+        return self._get_classifier()
+
     def _get_classifier(self) -> LazaroClassifier:
         """Sets the classifier model according to the model_type attribute (bilstm/transformers/crf).
         This is a private method that is automatically called upon the Lazaro object creation
+        (or on first use, for lazy and unpickled Lazaro objects)
 
         Returns:
                 `pylazaro.classifiers.LazaroClassifier`: The LazaroClassifier (FlairClassifier or CRFClassifier).
 
         """
 
+        kwargs = {}
+        if self.model_file:
+            kwargs["model_file"] = self.model_file
         if self.model_type == "bilstm":
-            if self.model_file:
-                return FlairClassifier(model_file=self.model_file)
-            return FlairClassifier()
+            return FlairClassifier(num_threads=self.num_threads, **kwargs)
         elif self.model_type == "crf":
-            if self.model_file:
-                return CRFClassifier(model_file=self.model_file)
-            return CRFClassifier()
+            return CRFClassifier(**kwargs)
         elif self.model_type == "transformers":
-            if self.model_file:
-                return TransformersClassifier(model_file=self.model_file)
-            return TransformersClassifier()
+            return TransformersClassifier(num_threads=self.num_threads, **kwargs)
+
+    def _cache_key(self) -> Tuple:
+        return (self.model_type, self.model_file, self.num_threads)
+
+    @property
+    def classifier(self) -> LazaroClassifier:
+        """The classifier, loaded (or taken from the per-process cache) on first access"""
+        global _classifier_cache, _classifier_cache_pid
+        if self._classifier is None:
+            with _classifier_cache_lock:
+                if _classifier_cache_pid != os.getpid():
+                    # models loaded before a fork are not reused by the child process
+                    _classifier_cache = {}
+                    _classifier_cache_pid = os.getpid()
+                key = self._cache_key()
+                if key not in _classifier_cache:
+                    _classifier_cache[key] = self._get_classifier()
+                self._classifier = _classifier_cache[key]
+        return self._classifier
+
+    def __getstate__(self) -> Dict:
+        return {
+            "model_type": self.model_type,
+            "model_file": self.model_file,
+            "num_threads": self.num_threads,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "cache": self.cache,
+            "sentence_cache": self.sentence_cache,
+            "coalesce": self.coalesce,
+            "record_timings": self.record_timings,
+            "collect_metrics": self.collect_metrics,
+        }
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self.record_timings = state.get("record_timings", False)
+        self.collect_metrics = state.get("collect_metrics", True)
+        self.lazy = True
+        self._classifier = None
+        self._batcher = None
+        self._namespace = None
+        self._single_flight = SingleFlight()
+
+    def _cache_namespace(self) -> str:
+        if self._namespace is None:
+            self._namespace = model_namespace(
+                self.model_type, self.classifier.model_file, self.classifier.model_version
+            )
+        return self._namespace
 
+    @_metered
+    @_timed
     def analyze(self, text) -> LazaroOutput:
         """The method that calls the tagger on a given text to detect borrowings.
 
@@ -88,4 +259,209 @@ class Lazaro(object):
 
         """
 
-        return self._classifier.predict(text)
+        if self.coalesce:
+            return self._single_flight.do(cache_key(text, self._cache_namespace()), self._analyze, text)
+        return self._analyze(text)
+
+    @property
+    def coalescing_stats(self):
+        """`pylazaro.coalesce.CoalescingStats` with the number of calls and of coalesced calls"""
+        return self._single_flight.stats
+
+    def _analyze(self, text) -> LazaroOutput:
+        if self.cache is None:
+            return self.classifier.predict(text)
+        key = cache_key(text, self._cache_namespace())
+        with timing.stage("cache", lookups=1):
+            output = self.cache.get(key)
+        if self.collect_metrics:
+            self._count_cache_lookups("result", 1, int(output is None))
+        if output is None:
+            output = self.classifier.predict(text)
+            self.cache.put(key, output)
+        return output
+
+    @_metered
+    @_timed
+    def analyze_batch(self, texts: List) -> List[LazaroOutput]:
+        """Analyzes several texts with a single batched forward pass.
+
+        Args:
+                texts: list of texts (strings or lists of words)
+
+        Returns:
+                `List[LazaroOutput]`: one output per text, in the same order
+
+        """
+        texts = list(texts)
+        if self.cache is None:
+            return self.classifier.predict_batch(texts)
+        return self._analyze_batch_cached(texts, self.cache)
+
+    def _analyze_batch_cached(self, texts: List, cache: ResultCache) -> List[LazaroOutput]:
+        namespace = self._cache_namespace()
+        keys = [cache_key(text, namespace) for text in texts]
+        with timing.stage("cache", lookups=len(keys)):
+            outputs = [cache.get(key) for key in keys]
+        missing = {}  # duplicated texts within the batch are only tagged once
+        for i, output in enumerate(outputs):
+            if output is None:
+                missing.setdefault(keys[i], []).append(i)
+        if self.collect_metrics:
+            self._count_cache_lookups("sentence" if cache is self.sentence_cache else "result", len(keys),
+                                      sum(len(ids) for ids in missing.values()))
+        if missing:
+            predicted = self.classifier.predict_batch([texts[ids[0]] for ids in missing.values()])
+            for (key, ids), output in zip(missing.items(), predicted):
+                cache.put(key, output)
+                for i in ids:
+                    outputs[i] = output
+        return outputs
+
+    def _count_cache_lookups(self, cache: str, lookups: int, misses: int) -> None:
+        if lookups > misses:
+            metrics.CACHE_HITS.inc(self.model_type, cache, amount=lookups - misses)
+        if misses:
+            metrics.CACHE_MISSES.inc(self.model_type, cache, amount=misses)
+
+    @_metered
+    @_timed
+    def analyze_sentences(self, text) -> LazaroOutput:
+        """Analyzes a text sentence by sentence, reusing the outputs of sentences
+        that were already analyzed (see `sentence_cache`). Only the sentences
+        that are not cached go through the model, all in a single batch, and
+        their outputs are stitched back into one output for the whole text.
+
+        Note that each sentence is tagged on its own, without the context of
+        the surrounding sentences.
+
+        Args:
+                text: The text that we want to analyze for borrowings (string or list of words)
+
+        Returns:
+                `pylazaro.classifiers.LazaroOutput`: The LazaroOutput object for the whole text
+
+        """
+        return self._analyze_sentences(text)
+
+    def _analyze_sentences(self, text) -> LazaroOutput:
+        if self.sentence_cache is None:
+            self.sentence_cache = ResultCache()
+        sentences = split_sentences(text)
+        return LazaroOutput.concatenate(
+            self._analyze_batch_cached(sentences, self.sentence_cache), sentences,
+            _sentence_starts(text, sentences),
+        )
+
+    @_metered
+    @_timed
+    def reanalyze(self, previous: LazaroOutput, text) -> LazaroOutput:
+        """Analyzes an edited version of a text that was analyzed before. The
+        sentences of both versions are compared, and only the sentences that
+        were added or modified go through the model; the outputs of the
+        unchanged sentences are taken from the previous output.
+
+        Since sentences are tagged one by one (see `analyze_sentences`), no
+        context from the neighbouring sentences needs to be re-tagged, and the
+        cost grows with the size of the edit instead of the size of the text.
+
+        Args:
+                previous (`LazaroOutput`): output of `analyze_sentences` or `reanalyze` for the previous version
+                text: the new version of the text (string or list of words)
+
+        Returns:
+                `pylazaro.classifiers.LazaroOutput`: The LazaroOutput object for the new version
+
+        Example:
+                .. code-block:: python
+
+                        >>> output = tagger.analyze_sentences(article)
+                        >>> output = tagger.reanalyze(output, edited_article)
+
+        """
+        if previous.sentence_texts is None:
+            # nothing to compare against: the previous output was not built sentence by sentence
+            return self._analyze_sentences(text)
+        sentences = split_sentences(text)
+        matcher = difflib.SequenceMatcher(
+            a=[_sentence_key(sentence) for sentence in previous.sentence_texts],
+            b=[_sentence_key(sentence) for sentence in sentences],
+            autojunk=False,
+        )
+        previous_outputs = previous.sentence_outputs()
+        outputs = [None] * len(sentences)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                outputs[j1:j2] = previous_outputs[i1:i2]
+        changed = [j for j, output in enumerate(outputs) if output is None]
+        if changed:
+            if self.sentence_cache is None:
+                self.sentence_cache = ResultCache()
+            tagged = self._analyze_batch_cached([sentences[j] for j in changed], self.sentence_cache)
+            for j, output in zip(changed, tagged):
+                outputs[j] = output
+        return LazaroOutput.concatenate(outputs, sentences, _sentence_starts(text, sentences))
+
+    async def analyze_async(self, text, timeout: Optional[float] = None) -> LazaroOutput:
+        """Asyncio version of `analyze`. Concurrent calls are grouped into micro-batches
+        (up to `max_batch_size` texts or `max_wait_ms` ms) that run in a background
+        thread, so the event loop is never blocked by the forward pass.
+
+        Args:
+                text: The text that we want to analyze for borrowings (string or list of words)
+                timeout (float, optional): seconds after which the request is abandoned
+
+        Returns:
+                `pylazaro.classifiers.LazaroOutput`: The LazaroOutput object for the given text
+
+        Raises:
+                asyncio.TimeoutError: if the output was not ready before the timeout
+
+        Example:
+                .. code-block:: python
+
+                        >>> import asyncio
+                        >>> from pylazaro import Lazaro
+                        >>> tagger = Lazaro()
+                        >>> async def main():
+                        ...     texts = ["Fue un look sencillo.", "Se celebra un festival de 'anime'."]
+                        ...     return await asyncio.gather(*[tagger.analyze_async(text) for text in texts])
+                        >>> [output.borrowings_to_tuple() for output in asyncio.run(main())]
+                        [[('look', 'ENG')], [('anime', 'OTHER')]]
+
+        """
+        if self._batcher is None:
+            self._batcher = MicroBatcher(
+                self.analyze_batch,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_ms,
+            )
+        if self.coalesce:
+            # the shared computation runs without a deadline: each caller applies its own
+            shared = self._single_flight.do_async(
+                cache_key(text, self._cache_namespace()), self._batcher.submit, text
+            )
+            return await (shared if timeout is None else asyncio.wait_for(shared, timeout))
+        return await self._batcher.submit(text, timeout=timeout)
+
+    def analyze_partition(self, texts: Iterable, batch_size: int = 32) -> Iterator[LazaroOutput]:
+        """Streams an iterable of texts through `analyze_batch`, `batch_size` texts at a time.
+        This is meant to be used as a partition function in distributed executors.
+
+        Args:
+                texts: iterable of texts (strings or lists of words)
+                batch_size (int, optional): number of texts per batch
+
+        Returns:
+                `Iterator[LazaroOutput]`: one output per text, in the same order
+
+        Example:
+                .. code-block:: python
+
+                        >>> tagger = Lazaro(model_type="transformers", lazy=True)
+                        >>> borrowings = rdd.mapPartitions(tagger.analyze_partition).map(
+                        ...     lambda output: output.borrowings_to_dict())
+
+        """
+        for batch in chunked(texts, batch_size):
+            yield from self.analyze_batch(batch)
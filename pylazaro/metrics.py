@@ -0,0 +1,329 @@
+import bisect
+import math
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pylazaro.token import LANGUAGES
+
+# Runtime metrics of pylazaro (requests, tokens, borrowings, cache lookups,
+# batch sizes and latencies), updated by `Lazaro` on every analysis and
+# exported in the Prometheus text format (see `to_prometheus`).
+#
+# Updates do not take any lock: every thread writes to a shard of its own,
+# and the shards are only added up when a snapshot is taken. A thread takes
+# the registry lock once, the first time it updates a metric. The shards of
+# threads that have ended are folded into a single one, so short-lived
+# threads (such as the ones of a threading HTTP server) do not pile up.
+#
+# The metrics of other processes (such as the workers of the server) can be
+# added to those of this one: `export` gives the totals of a process as plain
+# JSON-serializable values, and `snapshot` and `to_prometheus` take the
+# exports of other processes.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class _Shard(object):
+    __slots__ = ("thread", "values")
+
+    def __init__(self, thread: Optional[threading.Thread]) -> None:
+        self.thread = thread
+        # (metric name, label values) -> value (counters) or [bucket counts..., sum] (histograms)
+        self.values = {}  # type: Dict[Tuple[str, Tuple], object]
+
+
+class _Metric(object):
+    type = None  # type: str
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str,
+                 labelnames: Sequence[str] = ()) -> None:
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _check(self, labels: Tuple) -> None:
+        if len(labels) != len(self.labelnames):
+            raise ValueError("%s takes the labels %s, got %r" % (self.name, self.labelnames, labels))
+
+
+class Counter(_Metric):
+    """A value that only goes up (requests, tokens...), per combination of label values"""
+
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        """Adds `amount` to the counter of the given label values
+
+        Example:
+                .. code-block:: python
+
+                        >>> REQUESTS.inc("crf", "analyze")
+                        >>> TOKENS.inc("crf", amount=len(output.words))
+        """
+        values = self._registry._shard().values
+        key = (self.name, labels)
+        value = values.get(key)
+        if value is None:
+            self._check(labels)
+            value = 0
+        values[key] = value + amount
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies, batch sizes...) over fixed buckets,
+    per combination of label values
+
+    Attributes:
+            buckets (Tuple[float]): upper bounds of the buckets, in increasing order
+                        (an implicit last bucket holds everything above them)
+    """
+
+    type = "histogram"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str,
+                 labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels) -> None:
+        """Adds an observation to the histogram of the given label values"""
+        values = self._registry._shard().values
+        key = (self.name, labels)
+        counts = values.get(key)
+        if counts is None:
+            self._check(labels)
+            # one count per bucket, then the +Inf bucket and the sum of the observations
+            counts = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+
+class MetricsRegistry(object):
+    """A set of metrics, updated without locks (see the module comment)
+
+    Example:
+            .. code-block:: python
+
+                    >>> registry = MetricsRegistry()
+                    >>> hits = registry.counter("cache_hits_total", "Cache hits", ["backend"])
+                    >>> hits.inc("crf")
+                    >>> registry.snapshot()["cache_hits_total"]
+                    [{'labels': {'backend': 'crf'}, 'value': 1}]
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []  # type: List[_Shard]
+        self._retired = _Shard(None)
+        self.metrics = {}  # type: Dict[str, _Metric]
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError("metric %s is already registered" % metric.name)
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _shard(self) -> _Shard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._fold_dead_shards()
+                self._shards.append(shard)
+            return shard
+
+    def _fold_dead_shards(self) -> None:
+        # called with the lock held: nobody writes to the shard of a thread that has ended
+        alive = []
+        for shard in self._shards:
+            if shard.thread.is_alive():
+                alive.append(shard)
+            else:
+                _merge(self._retired.values, shard.values)
+        self._shards = alive
+
+    def _collect(self, others: Iterable[List] = ()) -> Dict[Tuple[str, Tuple], object]:
+        with self._lock:
+            self._fold_dead_shards()
+            totals = {}  # type: Dict[Tuple[str, Tuple], object]
+            _merge(totals, self._retired.values)
+            for shard in self._shards:
+                # copied first, since its thread may be adding new keys
+                _merge(totals, dict(shard.values))
+        for exported in others:
+            _merge(totals, {(name, tuple(labels)): value for name, labels, value in exported
+                            if name in self.metrics})
+        return totals
+
+    def export(self) -> List[List]:
+        """Current totals of this process as JSON-serializable [name, label values, value] entries,
+        to be added to the metrics of another process (see `snapshot`)"""
+        return [[name, list(labels), value] for (name, labels), value in self._collect().items()]
+
+    def snapshot(self, others: Iterable[List] = ()) -> Dict[str, List[Dict]]:
+        """Current value of every metric, by metric name: one dict per combination of label
+        values, with the `labels` and the `value` (counters) or the `count`, `sum` and
+        cumulative `buckets` (histograms)
+
+        Args:
+                others (Iterable[List]): exports (see `export`) of other processes, added to the values of this one
+        """
+        samples = {name: [] for name in self.metrics}  # type: Dict[str, List[Dict]]
+        for (name, labels), value in sorted(self._collect(others).items(), key=lambda item: item[0]):
+            metric = self.metrics[name]
+            sample = {"labels": dict(zip(metric.labelnames, labels))}
+            if metric.type == "histogram":
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(metric.buckets + (math.inf,), value[:-1]):
+                    cumulative = cumulative + count
+                    buckets[bound] = cumulative
+                sample.update({"count": cumulative, "sum": value[-1], "buckets": buckets})
+            else:
+                sample["value"] = value
+            samples[name].append(sample)
+        return samples
+
+    def reset(self) -> None:
+        """Sets every metric back to zero. Updates made by other threads while it resets may or may not be kept."""
+        with self._lock:
+            self._retired = _Shard(None)
+            for shard in self._shards:
+                shard.values.clear()
+
+    def to_prometheus(self, others: Iterable[List] = ()) -> str:
+        """The metrics in the Prometheus text exposition format (version 0.0.4), added up
+        with the exports of `others` processes"""
+        lines = []
+        for name, samples in self.snapshot(others).items():
+            metric = self.metrics[name]
+            lines.append("# HELP %s %s" % (name, _escape_help(metric.documentation)))
+            lines.append("# TYPE %s %s" % (name, metric.type))
+            for sample in samples:
+                labels = sample["labels"]
+                if metric.type == "histogram":
+                    for bound, count in sample["buckets"].items():
+                        bucket_labels = dict(labels, le="+Inf" if bound == math.inf else _format_value(bound))
+                        lines.append("%s_bucket%s %s" % (name, _format_labels(bucket_labels), count))
+                    lines.append("%s_sum%s %s" % (name, _format_labels(labels), _format_value(sample["sum"])))
+                    lines.append("%s_count%s %s" % (name, _format_labels(labels), sample["count"]))
+                else:
+                    lines.append("%s%s %s" % (name, _format_labels(labels), _format_value(sample["value"])))
+        return "\n".join(lines) + "\n"
+
+
+def _merge(totals: Dict, values: Dict) -> None:
+    for key, value in values.items():
+        total = totals.get(key)
+        if total is None:
+            totals[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            for i, count in enumerate(value):
+                total[i] += count
+        else:
+            totals[key] = total + value
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+
+
+# Metrics of pylazaro, updated by every `Lazaro` tagger with `collect_metrics` set
+REGISTRY = MetricsRegistry()
+REQUESTS = REGISTRY.counter(
+    "pylazaro_requests_total", "Calls to the analyze methods of Lazaro", ["backend", "method"]
+)
+DOCUMENTS = REGISTRY.counter("pylazaro_documents_total", "Documents analyzed", ["backend"])
+TOKENS = REGISTRY.counter("pylazaro_tokens_total", "Tokens analyzed", ["backend"])
+BORROWINGS = REGISTRY.counter("pylazaro_borrowings_total", "Borrowings found", ["backend", "language"])
+CACHE_HITS = REGISTRY.counter("pylazaro_cache_hits_total", "Outputs found in a cache", ["backend", "cache"])
+CACHE_MISSES = REGISTRY.counter(
+    "pylazaro_cache_misses_total", "Outputs not found in a cache", ["backend", "cache"]
+)
+BATCH_SIZE = REGISTRY.histogram(
+    "pylazaro_batch_size", "Texts per call to the analyze methods", ["backend"], BATCH_SIZE_BUCKETS
+)
+LATENCY = REGISTRY.histogram(
+    "pylazaro_analyze_seconds", "Wall-clock time of the analyze methods", ["backend", "method"]
+)
+
+
+def observe_analysis(backend: str, method: str, outputs: List, seconds: float) -> None:
+    """Updates the metrics of pylazaro after a call to an analyze method
+
+    Args:
+            backend (str): model type of the tagger
+            method (str): name of the analyze method
+            outputs (List[LazaroOutput]): outputs returned by the call
+            seconds (float): wall-clock time of the call
+    """
+    REQUESTS.inc(backend, method)
+    LATENCY.observe(seconds, backend, method)
+    BATCH_SIZE.observe(len(outputs), backend)
+    DOCUMENTS.inc(backend, amount=len(outputs))
+    n_tokens = 0
+    n_borrowings = {}  # type: Dict[int, int]
+    for output in outputs:
+        n_tokens = n_tokens + len(output.words)
+        for _, _, lang_code in output.span_ranges:
+            n_borrowings[lang_code] = n_borrowings.get(lang_code, 0) + 1
+    TOKENS.inc(backend, amount=n_tokens)
+    for lang_code, count in n_borrowings.items():
+        BORROWINGS.inc(backend, LANGUAGES[lang_code], amount=count)
+
+
+def snapshot() -> Dict[str, List[Dict]]:
+    """Current value of the metrics of pylazaro (see `MetricsRegistry.snapshot`)
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro import metrics
+                    >>> tagger.analyze("Fue un look sencillo.")
+                    >>> metrics.snapshot()["pylazaro_borrowings_total"]
+                    [{'labels': {'backend': 'bilstm', 'language': 'ENG'}, 'value': 1}]
+    """
+    return REGISTRY.snapshot()
+
+
+def reset() -> None:
+    """Sets the metrics of pylazaro back to zero"""
+    REGISTRY.reset()
+
+
+def export() -> List[List]:
+    """The metrics of pylazaro in this process, to be added to those of another one (see `MetricsRegistry.export`)"""
+    return REGISTRY.export()
+
+
+def to_prometheus(others: Iterable[List] = ()) -> str:
+    """The metrics of pylazaro in the Prometheus text exposition format, added up with
+    the exports of `others` processes"""
+    return REGISTRY.to_prometheus(others)
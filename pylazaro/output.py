@@ -1,89 +1,374 @@
 import attr
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 
 
 
-from pylazaro.utils import fuse_spans
+from pylazaro.decoding import DEFAULT_DECODER, TagDecoder, merge_wordpieces
+from pylazaro.utils import context_ranges, label_span_ranges, sentence_ranges
 from .borrowing import Borrowing
-from .token import Token
+from .token import LANGUAGES, Token, language_code
 
-@attr.s
+
+def _shift(offset: Optional[int], chars: int) -> Optional[int]:
+    return None if offset is None else offset + chars
+
+
+@attr.s(eq=False, repr=False)
 class LazaroOutput():
     """The object that stores the output produced by Lazaro tagger
 
+    An output can be built from Tokens and Borrowings, or (see `from_arrays`)
+    from the raw words and labels produced by a model, in which case the
+    Token and Borrowing objects are only created when they are accessed.
+    Outputs without borrowings (most of them) are then cheap to build, and
+    `borrowings_to_dict` never needs to create them.
+
     Attributes:
             tokens (obj): a list of Tokens with the tokenized sentence
             spans (obj): a list of Borrowings (spans) contained in the output.
                          Each Borrowing is made of Tokens
+            sentences (obj, optional): (start, end) token ranges of the sentences, when known
+            sentence_texts (obj, optional): source text of each sentence, when the output was
+                         built sentence by sentence (see `Lazaro.analyze_sentences`)
+            context_window (int, optional): number of tokens at each side of a borrowing kept
+                         as its context (`Borrowing.context_text`). Contexts never cross the
+                         sentence of the borrowing; None keeps the whole sentence. It has to be
+                         set before the borrowings are first accessed.
+            timings (`pylazaro.timing.Timings`, optional): time spent in each stage of the analysis,
+                         when the tagger records timings (see `Lazaro.record_timings`)
 
     """
-    tokens = attr.ib(type=List[Token])
-    spans = attr.ib(type=List[Borrowing])
+    _tokens = attr.ib(type=List[Token], default=None)
+    _spans = attr.ib(type=List[Borrowing], default=None)
+    sentences = attr.ib(type=List[Tuple[int, int]], default=None)
+    sentence_texts = attr.ib(type=List, default=None)
+    _words = attr.ib(type=List[str], default=None)
+    _labels = attr.ib(type=List[str], default=None)
+    _positions = attr.ib(type=List[int], default=None)
+    _probabilities = attr.ib(type=List[float], default=None)
+    _offsets = attr.ib(type=List[Tuple[int, int]], default=None)
+    context_window = attr.ib(type=Optional[int], default=None)
+    timings = attr.ib(default=None)
+    _views = attr.ib(type=Dict, init=False, factory=dict)
+
+    @classmethod
+    def from_arrays(cls, words: List[str], labels: List[str], positions: List[int] = None,
+                    probabilities: List[float] = None, span_ranges: List[Tuple[int, int, int]] = None,
+                    offsets: List[Tuple[int, int]] = None):
+        """Builds an output from parallel lists of words and labels
+
+        Args:
+                words (List[str]): the words of the text
+                labels (List[str]): the label of each word (such as "B-ENG")
+                positions (List[int], optional): the position of each word (0..n-1 by default)
+                probabilities (List[float], optional): the score of each label
+                span_ranges (List[Tuple[int, int, int]], optional): the borrowings, if they are
+                        already known (found from the labels otherwise)
+                offsets (List[Tuple[int, int]], optional): the (start, end) character offsets
+                        of each word in the source text
+
+        Returns:
+                `LazaroOutput`: an output whose Tokens and Borrowings are created on demand
+        """
+        output = cls(words=words, labels=labels, positions=positions, probabilities=probabilities,
+                     offsets=offsets)
+        if span_ranges is not None:
+            output._views["span_ranges"] = span_ranges
+        return output
+
+    @classmethod
+    def from_label_ids(cls, words: List[str], label_ids: List[int], positions: List[int] = None,
+                       probabilities: List[float] = None, decoder: TagDecoder = None,
+                       offsets: List[Tuple[int, int]] = None):
+        """Builds an output from the words of a text and the ids of their labels
+        (see `pylazaro.decoding.TagDecoder`)"""
+        labels, span_ranges = (decoder or DEFAULT_DECODER).decode(label_ids)
+        return cls.from_arrays(words, labels, positions, probabilities, span_ranges, offsets)
+
+    @classmethod
+    def batch_from_label_ids(cls, rows: List[Tuple], decoder: TagDecoder = None) -> List["LazaroOutput"]:
+        """Same as `from_label_ids` for several texts, decoded all at once
+
+        Args:
+                rows (List[Tuple]): (words, label_ids, positions, probabilities, offsets) of each text
+                decoder (`pylazaro.decoding.TagDecoder`, optional): the decoder the ids belong to
+        """
+        decoded = (decoder or DEFAULT_DECODER).decode_batch([row[1] for row in rows])
+        return [
+            cls.from_arrays(words, labels, positions, probabilities, span_ranges, offsets)
+            for (words, _, positions, probabilities, offsets), (labels, span_ranges) in zip(rows, decoded)
+        ]
+
+    def _view(self, name: str, build):
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = build()
+        return view
+
+    @property
+    def tokens(self) -> List[Token]:
+        if self._tokens is None:
+            probabilities = self._probabilities or [None] * len(self._words)
+            offsets = self._offsets or [(None, None)] * len(self._words)
+            self._tokens = [Token(word, label, position, prob, start_char, end_char)
+                            for word, label, position, prob, (start_char, end_char)
+                            in zip(self._words, self._labels, self.positions, probabilities, offsets)]
+        return self._tokens
+
+    @property
+    def spans(self) -> List[Borrowing]:
+        if self._spans is None:
+            tokens = self.tokens
+            span_ranges = self.span_ranges
+            contexts = context_ranges(span_ranges, self.sentence_ranges, len(tokens), self.context_window)
+            self._spans = [Borrowing.from_span(None, LANGUAGES[lang_code], start_pos, end_pos, tokens,
+                                               context_start, context_end)
+                           for (start_pos, end_pos, lang_code), (context_start, context_end)
+                           in zip(span_ranges, contexts)]
+        return self._spans
+
+    @property
+    def sentence_ranges(self) -> List[Tuple[int, int]]:
+        """(start, end) token ranges of the sentences: `sentences` when known, and otherwise
+        found by splitting the words after sentence-final punctuation"""
+        if self.sentences is not None:
+            return self.sentences
+        return self._view("sentence_ranges", lambda: sentence_ranges(self.words))
+
+    @property
+    def words(self) -> List[str]:
+        if self._words is None:
+            return [token.text for token in self._tokens]
+        return self._words
+
+    @property
+    def labels(self) -> List[str]:
+        if self._labels is None:
+            return [token.label for token in self._tokens]
+        return self._labels
+
+    @property
+    def positions(self) -> List[int]:
+        if self._positions is None:
+            if self._tokens is not None:
+                return [token.position for token in self._tokens]
+            return range(len(self._words))
+        return self._positions
+
+    @property
+    def probabilities(self) -> List[float]:
+        if self._probabilities is None:
+            if self._tokens is not None:
+                return [token.probability for token in self._tokens]
+            return [None] * len(self._words)
+        return self._probabilities
+
+    @property
+    def offsets(self) -> List[Tuple[int, int]]:
+        """(start, end) character offsets of each token in the source text ((None, None) if unknown)"""
+        if self._offsets is None:
+            if self._tokens is not None:
+                return [(token.start_char, token.end_char) for token in self._tokens]
+            return [(None, None)] * len(self._words)
+        return self._offsets
+
+    def anchor(self, text: str) -> "LazaroOutput":
+        """Makes the character offsets point into `text`, a text that is the same as the one
+        that was tagged up to whitespace (for instance, the same text with its line breaks
+        reflowed). The offsets are only checked against the text, and words are only
+        searched for in it if they do not match.
+
+        Returns:
+                `LazaroOutput`: this output, or a copy with the offsets moved into `text`
+        """
+        offsets = self.offsets
+        words = self.words
+        if all(start is not None and text[start:end] == word for word, (start, end) in zip(words, offsets)):
+            return self
+        anchored = []
+        cursor = 0
+        for word in words:
+            start = text.find(word, cursor)
+            if start < 0:
+                anchored.append((None, None))
+                continue
+            cursor = start + len(word)
+            anchored.append((start, cursor))
+        output = LazaroOutput.from_arrays(words, self.labels, self.positions, self.probabilities,
+                                          self.span_ranges, anchored)
+        output.sentences = self.sentences
+        output.sentence_texts = self.sentence_texts
+        output.context_window = self.context_window
+        return output
+
+    @property
+    def span_ranges(self) -> List[Tuple[int, int, int]]:
+        """(start, end, language code) of each borrowing, see `pylazaro.utils.fuse_span_ranges`"""
+        def build():
+            if self._spans is not None:
+                return [(bor.start_pos, bor.end_pos, language_code(bor.language)) for bor in self._spans]
+            return label_span_ranges(self.labels)
+        return self._view("span_ranges", build)
 
     @property
     def text(self) -> str:
-        return " ".join([token.text for token in self.tokens])
+        return self._view("text", lambda: " ".join(self.words))
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.words == other.words and self.labels == other.labels
+                and list(self.positions) == list(other.positions) and self.span_ranges == other.span_ranges)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "LazaroOutput(tokens=%r, spans=%r)" % (self.tokens, self.spans)
+
+    @staticmethod
+    def _CRF_row(crf_output, decoder: TagDecoder) -> Tuple:
+        words = []
+        labels = []
+        offsets = []
+        for token, tag in zip(crf_output, crf_output.user_data["tags"]):
+            words.append(token.text)
+            labels.append(tag)
+            offsets.append((token.idx, token.idx + len(token.text)))
+        return words, decoder.encode(labels), None, None, offsets
+
+    @staticmethod
+    def _Flair_row(flair_output, decoder: TagDecoder) -> Tuple:
+        words = []
+        label_ids = []
+        positions = []
+        probabilities = []
+        offsets = []
+        outside = decoder.label_id("O")
+
+        def add(word, label_id, position, prob, start_char, end_char):
+            if word:
+                words.append(word)
+                label_ids.append(label_id)
+                positions.append(position)
+                probabilities.append(prob)
+                offsets.append((start_char, end_char))
+
+        i = 0
+        for token in flair_output.tokens:
+            start_char, end_char = token.start_position, token.end_position
+            if not token.labels:
+                add(token.text, outside, i, None, start_char, end_char)
+                i = i + 1
+            elif token.text.endswith("’") or token.text.endswith("'") :
+                add(token.text[:-1], decoder.label_id(token.labels[0].value), i, token.score, start_char, end_char - 1)
+                add(token.text[-1], outside, i + 1, None, end_char - 1, end_char)
+                i = i + 2
+            else:
+                add(token.text, decoder.label_id(token.labels[0].value), i, token.score, start_char, end_char)
+                i = i + 1
+        return words, label_ids, positions, probabilities, offsets
+
+    @staticmethod
+    def _Transformers_row(transformers_output, decoder: TagDecoder) -> Tuple:
+        pieces = [tok for tok, _ in transformers_output]
+        labels = [label for _, label in transformers_output]
+        words, labels, _ = merge_wordpieces(pieces, labels)
+        return words, decoder.encode(labels), None, None, None
+
+    @classmethod
+    def from_CRF(cls, crf_output, decoder: TagDecoder = None):
+        decoder = decoder or DEFAULT_DECODER
+        words, label_ids, positions, probabilities, offsets = cls._CRF_row(crf_output, decoder)
+        return cls.from_label_ids(words, label_ids, positions, probabilities, decoder, offsets)
+
+    @classmethod
+    def from_Flair(cls, flair_output, decoder: TagDecoder = None):
+        decoder = decoder or DEFAULT_DECODER
+        words, label_ids, positions, probabilities, offsets = cls._Flair_row(flair_output, decoder)
+        return cls.from_label_ids(words, label_ids, positions, probabilities, decoder, offsets)
+
+    @classmethod
+    def from_Transformers(cls, transformers_output, decoder: TagDecoder = None):
+        decoder = decoder or DEFAULT_DECODER
+        words, label_ids, positions, probabilities, offsets = cls._Transformers_row(transformers_output, decoder)
+        return cls.from_label_ids(words, label_ids, positions, probabilities, decoder, offsets)
 
     @classmethod
-    def from_CRF(cls, crf_output):
-        tokens = [Token(token.text, tag, i, None) for i, (token, tag) in enumerate(zip(list(
-            crf_output), crf_output.user_data["tags"]))]
-        spans = fuse_spans(tokens)
-        return cls(tokens, spans)
+    def batch_from_CRF(cls, crf_outputs: List, decoder: TagDecoder = None) -> List["LazaroOutput"]:
+        decoder = decoder or DEFAULT_DECODER
+        return cls.batch_from_label_ids([cls._CRF_row(doc, decoder) for doc in crf_outputs], decoder)
 
     @classmethod
-    def from_Flair(cls, flair_output):
-        def align_labels() -> List[Token]:
-            aligned_labels = []
-            i = 0
-            for token in flair_output.tokens:
-                if not token.labels:
-                    aligned_labels.append(Token(token.text, "O", i, None))
-                    i = i + 1
-                elif token.text.endswith("’") or token.text.endswith("'") :
-                    aligned_labels.append(Token(token.text[:-1], token.labels[0].value, i, token.score))
-                    aligned_labels.append(Token(token.text[-1], "O", i + 1, None))
-                    i = i + 2
-                else:
-                    aligned_labels.append(Token(token.text, token.labels[0].value, i, token.score))
-                    i = i + 1
-            return aligned_labels
-
-        tokens = [tok for tok in align_labels() if tok.text]
-        spans = fuse_spans(tokens)
-        return cls(tokens, spans)
+    def batch_from_Flair(cls, flair_outputs: List, decoder: TagDecoder = None) -> List["LazaroOutput"]:
+        decoder = decoder or DEFAULT_DECODER
+        return cls.batch_from_label_ids([cls._Flair_row(sentence, decoder) for sentence in flair_outputs], decoder)
 
     @classmethod
-    def from_Transformers(cls, transformers_output):
-        def align_labels() -> List[Token]:
-            i = 0
-            new_output = []
-            half_boiled_token = ""
-            half_boiled_label = ""
-            for tok, label in transformers_output:
-                if tok == "[CLS]" or tok == "[SEP]":
-                    if half_boiled_token.strip():
-                        new_output.append(Token(half_boiled_token, half_boiled_label, i))
-                        half_boiled_token = ""
-                        half_boiled_label = ""
-                        i = i + 1
-                    continue
-                if tok.startswith("##"):
-                    half_boiled_token = half_boiled_token + tok[2:]
-                else:
-                    if half_boiled_token.strip():
-                        new_output.append(Token(half_boiled_token, half_boiled_label, i))
-                        i = i + 1
-                    half_boiled_token = tok
-                    half_boiled_label = label
-                        # Append the last token or tokens if any
-            if half_boiled_token.strip():
-                new_output.append(Token(half_boiled_token, half_boiled_label, i))
-            return new_output
-
-        tokens = align_labels()
-        spans = fuse_spans(tokens)
-        return cls(tokens, spans)
+    def concatenate(cls, outputs: List["LazaroOutput"], sentence_texts: List = None,
+                    sentence_starts: List[int] = None):
+        """Joins the outputs of consecutive sentences of a text into a single
+        output, shifting token positions and borrowing spans accordingly
+
+        Args:
+                outputs (List[LazaroOutput]): outputs of consecutive sentences of a text
+                sentence_texts (List, optional): source text of each sentence
+                sentence_starts (List[int], optional): character offset of each sentence in the
+                        text, added to the character offsets of its tokens
+
+        Returns:
+                `LazaroOutput`: the output for the whole text
+        """
+        tokens = []
+        span_ranges = []
+        sentences = []
+        position_offset = 0
+        for i, output in enumerate(outputs):
+            index_offset = len(tokens)
+            char_offset = sentence_starts[i] if sentence_starts is not None else 0
+            sentences.append((index_offset, index_offset + len(output.tokens)))
+            shifted = [Token(token.text, token.label, token.position + position_offset, token.probability,
+                             _shift(token.start_char, char_offset), _shift(token.end_char, char_offset))
+                       for token in output.tokens]
+            tokens.extend(shifted)
+            span_ranges.extend((start_pos + index_offset, end_pos + index_offset, lang_code)
+                               for start_pos, end_pos, lang_code in output.span_ranges)
+            if output.tokens:
+                position_offset = position_offset + output.tokens[-1].position + 1
+        # the borrowings are created when accessed, bounded by their sentences
+        concatenated = cls(tokens, None, sentences, sentence_texts)
+        concatenated._views["span_ranges"] = span_ranges
+        return concatenated
+
+    def sentence_outputs(self) -> List["LazaroOutput"]:
+        """Splits the output into one output per sentence (the reverse of `concatenate`),
+        with token positions, character offsets and borrowing spans relative to each sentence
+
+        Returns:
+                `List[LazaroOutput]`: one output per sentence
+        """
+        if self.sentences is None:
+            return [self]
+        outputs = []
+        spans = iter(self.span_ranges)
+        span = next(spans, None)
+        for start, end in self.sentences:
+            position_offset = self.tokens[start].position if end > start else 0
+            char_offset = (self.tokens[start].start_char or 0) if end > start else 0
+            tokens = [Token(token.text, token.label, token.position - position_offset, token.probability,
+                            _shift(token.start_char, -char_offset), _shift(token.end_char, -char_offset))
+                      for token in self.tokens[start:end]]
+            span_ranges = []
+            while span is not None and span[1] <= end:
+                span_ranges.append((span[0] - start, span[1] - start, span[2]))
+                span = next(spans, None)
+            output = LazaroOutput(tokens, context_window=self.context_window)
+            output._views["span_ranges"] = span_ranges
+            outputs.append(output)
+        return outputs
 
     @property
     def borrowings(self) -> List[Borrowing]:
@@ -122,9 +407,10 @@ class LazaroOutput():
                         >>> output.anglicisms
                         [Borrowing(tokens=[Token(text='look', label='B-ENG', position=2)], start_pos=2, end_pos=3, language='en')]
         """
-        return [
+        # a new list on every access: the cached one is not handed out to be modified
+        return list(self._view("anglicisms", lambda: [
             bor for bor in self.spans if bor.is_anglicism()
-        ]
+        ]))
 
     @property
     def other_borrowings(self):
@@ -143,9 +429,10 @@ class LazaroOutput():
                         >>> output.other_borrowings
                         [Borrowing(tokens=[Token(text='anime', label='B-OTHER', position=11)], start_pos=11, end_pos=12, language='other')]
         """
-        return [
+        # a new list on every access: the cached one is not handed out to be modified
+        return list(self._view("other_borrowings", lambda: [
             bor for bor in self.spans if bor.is_other()
-        ]
+        ]))
 
     def borrowings_to_tuple(self) -> List[Tuple[str, str]]:
         """Returns the list of borrowings found in the text
@@ -164,7 +451,11 @@ class LazaroOutput():
                                 [('look', 'en'), ('anime', 'other')]
 
                 """
-        return [bor.to_tuple() for bor in self.borrowings]
+        if self._spans is not None:
+            return [bor.to_tuple() for bor in self._spans]
+        words = self.words
+        return [(" ".join(words[start_pos:end_pos]), LANGUAGES[lang_code])
+                for start_pos, end_pos, lang_code in self.span_ranges]
 
     def anglicisms_to_tuple(self) -> List[Tuple[str, str]]:
         """Returns the list of borrowings from English (aka anglicisms) found in the text
@@ -220,7 +511,12 @@ class LazaroOutput():
                                 [{'borrowing': 'look', 'language': 'en', 'start_pos': 2, 'end_pos': 3}, {'borrowing': 'anime', 'language': 'other', 'start_pos': 11, 'end_pos': 12}]`
 
                 """
-        return [bor.to_dict() for bor in self.borrowings]
+        if self._spans is not None:
+            return [bor.to_dict() for bor in self._spans]
+        words = self.words
+        return [{"borrowing": " ".join(words[start_pos:end_pos]), "language": LANGUAGES[lang_code],
+                 "start_pos": start_pos, "end_pos": end_pos}
+                for start_pos, end_pos, lang_code in self.span_ranges]
 
     def anglicisms_to_dict(self) -> List[Dict]:
         """Returns the list of borrowings from English (aka anglicisms) found in the text
@@ -276,7 +572,7 @@ class LazaroOutput():
                         >>> output.tag_per_token()
                          [('Fue', 'O'), ('un', 'O'), ('look', 'B-ENG'), ('sencillo', 'O'), ('.', 'O'), ('Se', 'O'), ('celebra', 'O'), ('un', 'O'), ('festival', 'O'), ('de', 'O'), ("'", 'O'), ('anime', 'B-OTHER'), ("'", 'O'), ('.', 'O')]
         """
-        return [(token.text, token.label) for token in self.tokens]
+        return list(zip(self.words, self.labels))
 
 
 
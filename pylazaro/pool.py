@@ -0,0 +1,123 @@
+import collections
+import multiprocessing
+import os
+from typing import Iterable, Iterator, List
+
+from pylazaro.classifiers import set_torch_threads
+from pylazaro.lazaro import Lazaro
+from pylazaro.output import LazaroOutput
+from pylazaro.utils import chunked
+from pylazaro.wire import pack_outputs, unpack_output
+
+_tagger = None
+
+
+def _init_worker(model_type: str, model_file: str, tagger: Lazaro, num_threads: int) -> None:
+    global _tagger
+    # keep workers from oversubscribing the cores with torch intra-op threads
+    set_torch_threads(num_threads)
+    _tagger = tagger if tagger is not None else Lazaro(model_type=model_type, model_file=model_file)
+
+
+def _analyze_chunk(texts: List) -> List[bytes]:
+    return pack_outputs(_tagger.analyze_batch(texts))
+
+
+class LazaroPool(object):
+    """A pool of worker processes, each holding one loaded classifier, that
+    analyzes texts in parallel.
+
+    Outputs travel back from the workers in the compact binary form of
+    `pylazaro.wire` instead of as pickled Token/Borrowing objects, and are only
+    turned back into LazaroOutput objects as they are consumed.
+
+    With `preload=True` (on platforms that support forking), the model is loaded
+    once in the parent and the workers inherit it, so its memory pages are
+    shared copy-on-write instead of being loaded once per worker. This is not
+    available for the CRF model, whose embeddings database connection cannot be
+    shared across processes. An already built `tagger` is shared the same way.
+
+    Attributes:
+            model_type (str): type of model (crf/bilstm/transformers)
+            model_file (str, optional): model to be used
+            processes (int, optional): number of worker processes (defaults to the number of cores)
+            batch_size (int): number of texts per call to `Lazaro.analyze_batch` in the workers
+            preload (bool): load the model in the parent and share it with forked workers
+            num_threads (int, optional): torch threads per worker (defaults to cores / processes)
+            tagger (`pylazaro.lazaro.Lazaro`, optional): a tagger for the forked workers to inherit
+                    (instead of loading one from `model_type` and `model_file`)
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro.pool import LazaroPool
+                    >>> with LazaroPool(model_type="transformers", processes=4) as pool:
+                    ...     for output in pool.imap(texts):
+                    ...         print(output.borrowings_to_tuple())
+    """
+
+    def __init__(
+        self,
+        model_type: str = "bilstm",
+        model_file: str = None,
+        processes: int = None,
+        batch_size: int = 32,
+        preload: bool = False,
+        num_threads: int = None,
+        tagger: Lazaro = None,
+    ) -> None:
+        self.processes = processes or os.cpu_count() or 1
+        self.batch_size = batch_size
+        num_threads = num_threads or max(1, (os.cpu_count() or 1) // self.processes)
+        if tagger is not None:
+            if "fork" not in multiprocessing.get_all_start_methods():
+                raise RuntimeError(
+                    "Sharing a tagger needs the 'fork' start method, which is not available on this platform"
+                )
+            context = multiprocessing.get_context("fork")
+        elif preload and model_type != "crf" and "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+            tagger = Lazaro(model_type=model_type, model_file=model_file)
+        else:
+            context = multiprocessing.get_context()
+        self._pool = context.Pool(
+            self.processes,
+            initializer=_init_worker,
+            initargs=(model_type, model_file, tagger, num_threads),
+        )
+
+    def imap_packed(self, texts: Iterable) -> Iterator[bytes]:
+        """Analyzes the texts and yields their outputs in packed form (see `pylazaro.wire`), in input order.
+        At most two batches per worker are in flight at any time."""
+        in_flight = collections.deque()
+        for chunk in chunked(texts, self.batch_size):
+            in_flight.append(self._pool.apply_async(_analyze_chunk, (chunk,)))
+            if len(in_flight) >= 2 * self.processes:
+                yield from in_flight.popleft().get()
+        while in_flight:
+            yield from in_flight.popleft().get()
+
+    def imap(self, texts: Iterable) -> Iterator[LazaroOutput]:
+        """Analyzes the texts and yields one LazaroOutput per text, in input order"""
+        for data in self.imap_packed(texts):
+            yield unpack_output(data)
+
+    def map(self, texts: Iterable) -> List[LazaroOutput]:
+        """Analyzes the texts and returns one LazaroOutput per text, in input order"""
+        return list(self.imap(texts))
+
+    def close(self) -> None:
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self) -> None:
+        self._pool.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
@@ -0,0 +1,156 @@
+import time
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import attr
+
+from pylazaro.utils import WindowedTokenFeatureExtractor
+
+
+@attr.s(slots=True)
+class ExtractorStats(object):
+    """Cost of a feature extractor (at one window offset, or over all of them)
+
+    Attributes:
+            calls (int): number of calls to `extract`
+            seconds (float): time spent in `extract`
+            features (int): number of features added to the feature dicts
+    """
+
+    calls = attr.ib(type=int, default=0)
+    seconds = attr.ib(type=float, default=0.0)
+    features = attr.ib(type=int, default=0)
+
+    def add(self, other: "ExtractorStats") -> None:
+        self.calls = self.calls + other.calls
+        self.seconds = self.seconds + other.seconds
+        self.features = self.features + other.features
+
+
+class ProfilingFeatureExtractor(WindowedTokenFeatureExtractor):
+    """Extracts the same features as a `WindowedTokenFeatureExtractor`, timing
+    every call of every extractor. Costs are kept per extractor and window
+    offset (see `FeatureProfile`).
+
+    Attributes:
+            profile (`FeatureProfile`): the costs measured so far
+    """
+
+    def __init__(self, extractor: WindowedTokenFeatureExtractor) -> None:
+        super().__init__(extractor.extractors, extractor.window_size)
+        self.profile = FeatureProfile()
+
+    def extract(self, tokens: Sequence[str]) -> List[Dict[str, float]]:
+        clock = time.perf_counter
+        stats = self.profile.stats
+        # one stats object per extractor and offset, found once per call
+        offsets = range(-self.window_size, self.window_size + 1)
+        slots = [
+            {offset: stats.setdefault((type(extractor).__name__, offset), ExtractorStats()) for offset in offsets}
+            for extractor in self.extractors
+        ]
+
+        def timed(extractor, slot, token, idx, offset, dict_feat):
+            n_features = len(dict_feat)
+            start = clock()
+            extractor.extract(token, idx, offset, tokens, dict_feat)
+            slot.seconds = slot.seconds + clock() - start
+            slot.calls = slot.calls + 1
+            slot.features = slot.features + len(dict_feat) - n_features
+
+        featurized = []
+        for i in range(0, len(tokens)):
+            dict_feat = dict()
+            token = tokens[i]
+            for extractor, slot in zip(self.extractors, slots):
+                timed(extractor, slot[0], token, i, 0, dict_feat)
+                for j in range(1, self.window_size + 1):
+                    if i - j >= 0:
+                        timed(extractor, slot[-j], tokens[i - j], i - j, -j, dict_feat)
+                    if i + j < len(tokens):
+                        timed(extractor, slot[j], tokens[i + j], i + j, j, dict_feat)
+            featurized.append(dict_feat)
+        self.profile.tokens = self.profile.tokens + len(tokens)
+        return featurized
+
+
+class FeatureProfile(object):
+    """Time, calls and features emitted by each feature extractor, measured by
+    `ProfilingFeatureExtractor` (see `profile_features`)
+
+    Attributes:
+            stats (Dict[Tuple[str, int], ExtractorStats]): costs by (extractor class, window offset)
+            tokens (int): number of tokens whose features were extracted
+    """
+
+    def __init__(self) -> None:
+        self.stats = {}  # type: Dict[Tuple[str, int], ExtractorStats]
+        self.tokens = 0
+
+    def by_extractor(self) -> Dict[str, ExtractorStats]:
+        """Costs by extractor class, over all window offsets"""
+        totals = {}  # type: Dict[str, ExtractorStats]
+        for (name, _), stats in self.stats.items():
+            totals.setdefault(name, ExtractorStats()).add(stats)
+        return totals
+
+    def to_records(self, by_offset: bool = False) -> List[Dict]:
+        """Costs as a list of dicts (one per extractor, or per extractor and offset), most expensive first"""
+        if by_offset:
+            rows = [({"extractor": name, "offset": offset}, stats) for (name, offset), stats in self.stats.items()]
+        else:
+            rows = [({"extractor": name}, stats) for name, stats in self.by_extractor().items()]
+        total = sum(stats.seconds for _, stats in rows) or 1.0
+        records = []
+        for record, stats in sorted(rows, key=lambda row: row[1].seconds, reverse=True):
+            record.update(attr.asdict(stats))
+            record["share"] = stats.seconds / total
+            record["us_per_token"] = 1e6 * stats.seconds / self.tokens if self.tokens else 0.0
+            record["features_per_token"] = stats.features / self.tokens if self.tokens else 0.0
+            records.append(record)
+        return records
+
+    def report(self, by_offset: bool = False) -> str:
+        """Ranked report of the costs, most expensive first"""
+        lines = ["%-32s %10s %7s %10s %12s %12s" % (
+            "extractor", "time (s)", "share", "calls", "us/token", "features/tok")]
+        for record in self.to_records(by_offset):
+            name = record["extractor"]
+            if by_offset:
+                name = "%s[%+d]" % (name, record["offset"])
+            lines.append("%-32s %10.4f %6.1f%% %10d %12.2f %12.2f" % (
+                name, record["seconds"], 100 * record["share"], record["calls"], record["us_per_token"],
+                record["features_per_token"]))
+        lines.append("%d tokens" % self.tokens)
+        return "\n".join(lines)
+
+
+def profile_features(extractor: WindowedTokenFeatureExtractor, docs: Iterable[Sequence]) -> FeatureProfile:
+    """Extracts the features of some documents (or sentences), measuring the cost of each extractor
+
+    Args:
+            extractor (`pylazaro.utils.WindowedTokenFeatureExtractor`): the feature set to profile
+            docs (Iterable[Sequence]): sequences of (spaCy) tokens, such as the sentences of parsed texts
+
+    Returns:
+            `FeatureProfile`: the costs of the extractors
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro import Lazaro
+                    >>> from pylazaro.profiling import profile_features
+                    >>> classifier = Lazaro(model_type="crf").classifier
+                    >>> sentences = [sent for doc in classifier.spacy_model.pipe(texts) for sent in doc.sents]
+                    >>> print(profile_features(classifier.model.feature_extractor, sentences).report())
+    """
+    profiler = ProfilingFeatureExtractor(extractor)
+    for doc in docs:
+        profiler.extract(list(doc))
+    return profiler.profile
+
+
+def profile_classifier(classifier, texts: Iterable[str]) -> FeatureProfile:
+    """Profiles the feature set of a `pylazaro.classifiers.CRFClassifier` over some texts,
+    which are parsed (and split into sentences) the same way as when they are tagged"""
+    sentences = (sent for doc in classifier.spacy_model.pipe(texts) for sent in doc.sents)
+    return profile_features(classifier.model.feature_extractor, sentences)
@@ -0,0 +1,319 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import attr
+
+from pylazaro import metrics
+from pylazaro.batching import BatchQueue
+from pylazaro.lazaro import Lazaro
+from pylazaro.output import LazaroOutput
+
+
+@attr.s
+class ServerConfig(object):
+    """Settings for the pylazaro inference server
+
+    Attributes:
+            model_type (str): type of model (crf/bilstm/transformers)
+            model_file (str, optional): model to be used
+            host (str): interface to listen on
+            port (int): port to listen on
+            workers (int): number of worker processes, each with its own copy of the model
+            num_threads (int, optional): torch threads of each worker (see `pylazaro.tuning.tuned_threads`)
+            max_batch_size (int): number of texts after which a batch is sent to the model
+            max_wait_ms (float): maximum time (in ms) a request waits for a batch to fill up
+            max_queue_size (int): texts waiting per worker before new requests are rejected with HTTP 429
+            request_timeout (float): seconds after which a queued request is abandoned (HTTP 503)
+            max_body_bytes (int): largest accepted request body (HTTP 413 above it)
+    """
+
+    model_type = attr.ib(type=str, default="bilstm")
+    model_file = attr.ib(type=str, default=None)
+    host = attr.ib(type=str, default="127.0.0.1")
+    port = attr.ib(type=int, default=8000)
+    workers = attr.ib(type=int, default=1)
+    num_threads = attr.ib(type=int, default=None)
+    max_batch_size = attr.ib(type=int, default=16)
+    max_wait_ms = attr.ib(type=float, default=5.0)
+    max_queue_size = attr.ib(type=int, default=256)
+    request_timeout = attr.ib(type=float, default=30.0)
+    max_body_bytes = attr.ib(type=int, default=1024 * 1024)
+
+
+def output_to_json(output: LazaroOutput, tokens: bool = False) -> Dict:
+    result = {"borrowings": output.borrowings_to_dict()}
+    if tokens:
+        result["tokens"] = output.tag_per_token()
+    return result
+
+
+class LazaroRequestHandler(BaseHTTPRequestHandler):
+    """Handles the server endpoints:
+
+    * ``GET /health``: liveness, 200 as soon as the process is up
+    * ``GET /ready``: readiness, 200 once the model is loaded and 503 before (or if it failed to load)
+    * ``GET /metrics``: the runtime metrics of all the worker processes, in the Prometheus text format
+    * ``POST /analyze``: ``{"text": "..."}`` or ``{"texts": ["...", ...]}``, with an
+      optional ``"tokens": true`` to also get the tag per token
+    """
+
+    server_version = "pylazaro"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/ready":
+            if self.server.is_ready():
+                self._send_json(200, {"status": "ready", "queued": self.server.batcher.qsize()})
+            elif self.server.load_error is not None:
+                self._send_json(503, {"status": "failed", "error": self.server.load_error})
+            else:
+                self._send_json(503, {"status": "loading"})
+        elif self.path == "/metrics":
+            data = metrics.to_prometheus(self.server.sibling_metrics()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path != "/analyze":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            # the body cannot be told apart from the next request
+            self.close_connection = True
+            self._send_json(400, {"error": "invalid Content-Length"})
+            return
+        if length > self.server.config.max_body_bytes:
+            self.close_connection = True
+            self._send_json(413, {"error": "request body too large"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            texts = self._get_texts(body)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        if not self.server.is_ready():
+            if self.server.load_error is not None:
+                self._send_json(503, {"error": "model failed to load"})
+            else:
+                self._send_json(503, {"error": "model is loading"}, {"Retry-After": "1"})
+            return
+        try:
+            future = self.server.batcher.submit(texts)
+        except queue.Full:
+            self._send_json(429, {"error": "too many requests"}, {"Retry-After": "1"})
+            return
+        try:
+            outputs = future.result(timeout=self.server.config.request_timeout)
+        except TimeoutError:
+            future.cancel()
+            self._send_json(503, {"error": "request timed out"})
+            return
+        except Exception:
+            logging.exception("Error while analyzing request")
+            self._send_json(500, {"error": "internal error"})
+            return
+        with_tokens = bool(body.get("tokens", False))
+        results = [output_to_json(output, with_tokens) for output in outputs]
+        if "texts" in body:
+            self._send_json(200, {"results": results})
+        else:
+            self._send_json(200, results[0])
+
+    @staticmethod
+    def _get_texts(body: Dict) -> List:
+        if not isinstance(body, dict):
+            raise ValueError("request body must be a JSON object")
+        if "texts" in body:
+            texts = body["texts"]
+            if not isinstance(texts, list):
+                raise ValueError("'texts' must be a list")
+        elif "text" in body:
+            texts = [body["text"]]
+        else:
+            raise ValueError("request must contain 'text' or 'texts'")
+        for text in texts:
+            if not isinstance(text, (str, list)):
+                raise ValueError("each text must be a string or a list of words")
+        return texts
+
+    def _send_json(self, status: int, payload: Dict, headers: Dict = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+class LazaroHTTPServer(ThreadingHTTPServer):
+    """HTTP server that answers health checks right away and loads its
+    `Lazaro` tagger in the background, batching requests across clients
+    once the model is ready.
+
+    Pre-forked workers share a `metrics_dir`: each one writes the totals of its
+    metrics there every `METRICS_INTERVAL` seconds, and the worker that answers
+    ``GET /metrics`` adds up its own metrics and those of the others, so that
+    every scrape sees the totals of the whole server.
+
+    An already built `tagger` can be served instead of the one described by the config."""
+
+    daemon_threads = True
+    METRICS_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        config: ServerConfig,
+        server_socket: socket.socket = None,
+        metrics_dir: str = None,
+        tagger: Lazaro = None,
+    ):
+        self.config = config
+        self.tagger = tagger
+        self.metrics_dir = metrics_dir
+        self.batcher = None
+        self.load_error = None
+        self._ready = threading.Event()
+        if server_socket is None:
+            super().__init__((config.host, config.port), LazaroRequestHandler)
+        else:
+            # pre-forked worker: accept connections on the socket inherited from the parent
+            super().__init__(
+                server_socket.getsockname()[:2], LazaroRequestHandler, bind_and_activate=False
+            )
+            self.socket.close()
+            self.socket = server_socket
+        threading.Thread(target=self._load, name="pylazaro-model-loader", daemon=True).start()
+        if metrics_dir is not None:
+            threading.Thread(target=self._write_metrics, name="pylazaro-metrics-writer", daemon=True).start()
+
+    def _load(self) -> None:
+        try:
+            tagger = self.tagger or Lazaro(model_type=self.config.model_type, model_file=self.config.model_file,
+                                           num_threads=self.config.num_threads)
+        except BaseException as e:
+            # /ready reports the failure instead of "loading" forever
+            logging.exception("Could not load the model")
+            self.load_error = "%s: %s" % (type(e).__name__, e)
+            return
+        self.batcher = BatchQueue(
+            tagger.analyze_batch,
+            max_batch_size=self.config.max_batch_size,
+            max_wait_ms=self.config.max_wait_ms,
+            max_queue_size=self.config.max_queue_size,
+        )
+        self._ready.set()
+        logging.info("Model loaded, ready to serve on %s:%d", *self.server_address[:2])
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def _metrics_file(self, pid: int) -> str:
+        return os.path.join(self.metrics_dir, "%d.json" % pid)
+
+    def _write_metrics(self) -> None:
+        path = self._metrics_file(os.getpid())
+        while True:
+            # written aside and moved over the previous one, so readers never see half a file
+            try:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(metrics.export(), f)
+                os.replace(path + ".tmp", path)
+            except OSError:
+                # the directory is removed when the server stops
+                return
+            time.sleep(self.METRICS_INTERVAL)
+
+    def sibling_metrics(self) -> List[List]:
+        """Latest metrics written by the other workers (the files of workers that have
+        ended are kept, so that the totals never go down)"""
+        if self.metrics_dir is None:
+            return []
+        exports = []
+        own = os.path.basename(self._metrics_file(os.getpid()))
+        for name in os.listdir(self.metrics_dir):
+            if name == own or not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.metrics_dir, name), encoding="utf-8") as f:
+                    exports.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return exports
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self.batcher is not None:
+            self.batcher.close()
+
+
+def _run_worker(config: ServerConfig, server_socket: socket.socket = None, metrics_dir: str = None) -> None:
+    server = LazaroHTTPServer(config, server_socket, metrics_dir)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def serve(config: ServerConfig) -> None:
+    """Starts the inference server and blocks until it is interrupted.
+
+    With more than one worker, the listening socket is opened once and
+    shared by forked worker processes, each of which loads its own model.
+
+    Args:
+            config (`ServerConfig`): server settings
+    """
+    logging.info("Starting pylazaro server on %s:%d", config.host, config.port)
+    if config.workers <= 1:
+        _run_worker(config)
+        return
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise RuntimeError("Multiple workers need the 'fork' start method, which is not available on this platform")
+    server_socket = socket.create_server((config.host, config.port), backlog=128)
+    metrics_dir = tempfile.mkdtemp(prefix="pylazaro-metrics-")
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_run_worker, args=(config, server_socket, metrics_dir), daemon=True)
+        for _ in range(config.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+    finally:
+        server_socket.close()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
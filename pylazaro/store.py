@@ -0,0 +1,313 @@
+import functools
+import math
+import mmap
+import os
+import struct
+from array import array
+from typing import Dict, Iterable, Iterator, List
+
+from pylazaro.output import LazaroOutput
+from pylazaro.token import LANGUAGES
+from pylazaro.wire import _array_bytes, _array_from
+
+# Binary store for large collections of LazaroOutput objects, which is read
+# through mmap so that any document can be accessed without loading the rest.
+#
+# Layout (little endian):
+#   header      magic "LZC" + version (B)
+#   documents   one record per document:
+#                 n_tokens (I), n_spans (I), flags (B)
+#                 word ids    n_tokens x I (index into the vocabulary)
+#                 labels      n_tokens x B (index into the label table)
+#                 positions   n_tokens x I, if FLAG_POSITIONS
+#                 probs       n_tokens x d (n_tokens x f before version 3), if FLAG_PROBABILITIES
+#                 offsets     n_tokens x 2 x i (start and end character of each word, -1 if unknown),
+#                             if FLAG_OFFSETS
+#                 span starts n_spans x I, span ends n_spans x I
+#                 span langs  n_spans x B (index into the language table)
+#   vocabulary  n_words (Q), n_words + 1 x Q offsets, concatenated utf-8 bytes
+#   labels      n_labels (H), n_labels x (length (B) + utf-8 bytes)
+#   languages   n_languages (H), n_languages x (length (B) + utf-8 bytes)
+#   index       n_docs (Q), n_docs + 1 x Q offsets of the document records
+#   trailer     offsets of the vocabulary, labels, languages and index (4 x Q), magic "LZC" + version (B)
+#
+# The label and language tables belong to the file: language codes are only
+# meaningful within a process (see `pylazaro.token.language_code`).
+
+MAGIC = b"LZC"
+VERSION = 3
+# version 1 files are version 2 files without offsets, and version 2 files
+# store probabilities as 32-bit floats
+READ_VERSIONS = (1, 2, 3)
+FLAG_PROBABILITIES = 1
+FLAG_POSITIONS = 2
+FLAG_OFFSETS = 4
+# decoded words kept by each CorpusReader
+WORD_CACHE_SIZE = 65536
+
+_MAGIC = struct.Struct("<3sB")
+_RECORD = struct.Struct("<IIB")
+_TRAILER = struct.Struct("<QQQQ3sB")
+
+
+def _pack_strings(strings: List[str]) -> bytes:
+    parts = [struct.pack("<H", len(strings))]
+    for string in strings:
+        encoded = string.encode("utf-8")
+        parts.append(bytes([len(encoded)]) + encoded)
+    return b"".join(parts)
+
+
+def _unpack_strings(data, offset: int) -> List[str]:
+    (n_strings,) = struct.unpack_from("<H", data, offset)
+    offset = offset + 2
+    strings = []
+    for _ in range(n_strings):
+        size = data[offset]
+        strings.append(bytes(data[offset + 1:offset + 1 + size]).decode("utf-8"))
+        offset = offset + 1 + size
+    return strings
+
+
+class CorpusWriter(object):
+    """Writes LazaroOutput objects, one after the other, into a binary corpus
+    file that can be read back with `CorpusReader`. Words are interned (each
+    distinct word is stored once) and labels and borrowings are stored as
+    integer codes.
+
+    Attributes:
+            path (str): the file to write
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro.store import CorpusWriter
+                    >>> with CorpusWriter("corpus.lzc") as writer:
+                    ...     for output in tagger.analyze_batch(texts):
+                    ...         writer.write(output)
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(_MAGIC.pack(MAGIC, VERSION))
+        self._offsets = array("Q", [self._file.tell()])
+        self._vocabulary = {}  # type: Dict[str, int]
+        self._labels = {}  # type: Dict[str, int]
+        self._languages = {}  # type: Dict[str, int]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @staticmethod
+    def _code(table: Dict[str, int], value: str, limit: int) -> int:
+        code = table.get(value)
+        if code is None:
+            code = len(table)
+            if code >= limit:
+                raise ValueError("Too many distinct values to store: %d" % (code + 1))
+            table[value] = code
+        return code
+
+    def write(self, output: LazaroOutput) -> None:
+        """Appends the output of one document"""
+        vocabulary = self._vocabulary
+        words = [vocabulary.setdefault(word, len(vocabulary)) for word in output.words]
+        labels = [self._code(self._labels, label, 256) for label in output.labels]
+        positions = output.positions
+        probabilities = output.probabilities
+        has_positions = any(position != i for i, position in enumerate(positions))
+        has_probabilities = any(prob is not None for prob in probabilities)
+        offsets = output.offsets
+        has_offsets = any(start is not None for start, _ in offsets)
+        flags = (FLAG_PROBABILITIES if has_probabilities else 0) | (FLAG_POSITIONS if has_positions else 0)
+        flags = flags | (FLAG_OFFSETS if has_offsets else 0)
+        spans = output.span_ranges
+
+        parts = [_RECORD.pack(len(words), len(spans), flags), _array_bytes("I", words), bytes(labels)]
+        if has_positions:
+            parts.append(_array_bytes("I", positions))
+        if has_probabilities:
+            parts.append(_array_bytes("d", [math.nan if prob is None else prob for prob in probabilities]))
+        if has_offsets:
+            parts.append(_array_bytes("i", [-1 if char is None else char for pair in offsets for char in pair]))
+        parts.append(_array_bytes("I", [start_pos for start_pos, _, _ in spans]))
+        parts.append(_array_bytes("I", [end_pos for _, end_pos, _ in spans]))
+        parts.append(bytes(self._code(self._languages, LANGUAGES[lang_code], 256) for _, _, lang_code in spans))
+        for part in parts:
+            self._file.write(part)
+        self._offsets.append(self._file.tell())
+
+    def write_all(self, outputs: Iterable[LazaroOutput]) -> None:
+        for output in outputs:
+            self.write(output)
+
+    def close(self) -> None:
+        """Writes the vocabulary, tables and index, and closes the file"""
+        if self._file is None:
+            return
+        f = self._file
+        vocabulary_offset = f.tell()
+        words = [word.encode("utf-8") for word in self._vocabulary]
+        word_offsets = [0]
+        for word in words:
+            word_offsets.append(word_offsets[-1] + len(word))
+        f.write(struct.pack("<Q", len(words)))
+        f.write(_array_bytes("Q", word_offsets))
+        f.write(b"".join(words))
+        labels_offset = f.tell()
+        f.write(_pack_strings(list(self._labels)))
+        languages_offset = f.tell()
+        f.write(_pack_strings(list(self._languages)))
+        index_offset = f.tell()
+        f.write(struct.pack("<Q", len(self)))
+        f.write(_array_bytes("Q", self._offsets))
+        f.write(_TRAILER.pack(vocabulary_offset, labels_offset, languages_offset, index_offset, MAGIC, VERSION))
+        f.close()
+        self._file = None
+
+    def abort(self) -> None:
+        """Closes and removes the file without finalizing it"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a corpus cut short by an error would look complete once finalized
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class CorpusReader(object):
+    """Reads a corpus file written by `CorpusWriter`. The file is memory-mapped:
+    documents are only decoded when they are accessed, and iterating over the
+    borrowings does not decode the tokens of the documents.
+
+    Attributes:
+            path (str): the file to read
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro.store import CorpusReader
+                    >>> with CorpusReader("corpus.lzc") as corpus:
+                    ...     output = corpus[1000]
+                    ...     for borrowing in corpus.iter_borrowings():
+                    ...         print(borrowing["doc"], borrowing["borrowing"], borrowing["language"])
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._mmap
+        magic, version = _MAGIC.unpack_from(data, 0)
+        (vocabulary_offset, labels_offset, languages_offset, index_offset,
+         trailer_magic, trailer_version) = _TRAILER.unpack_from(data, len(data) - _TRAILER.size)
+        if magic != MAGIC or trailer_magic != MAGIC or version not in READ_VERSIONS or trailer_version != version:
+            raise ValueError("Not a complete pylazaro corpus file (or unsupported version): %s" % path)
+        (self._n_words,) = struct.unpack_from("<Q", data, vocabulary_offset)
+        self._word_offsets_start = vocabulary_offset + 8
+        self._words_start = self._word_offsets_start + 8 * (self._n_words + 1)
+        self.labels = _unpack_strings(data, labels_offset)
+        self.languages = _unpack_strings(data, languages_offset)
+        (self._n_docs,) = struct.unpack_from("<Q", data, index_offset)
+        self._index_start = index_offset + 8
+        self._probability_type = "d" if version >= 3 else "f"
+        self._word = functools.lru_cache(maxsize=WORD_CACHE_SIZE)(self._read_word)
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    def _read_word(self, word_id: int) -> str:
+        start, end = struct.unpack_from("<QQ", self._mmap, self._word_offsets_start + 8 * word_id)
+        return self._mmap[self._words_start + start:self._words_start + end].decode("utf-8")
+
+    def _record_offset(self, i: int) -> int:
+        if i < 0:
+            i = i + self._n_docs
+        if not 0 <= i < self._n_docs:
+            raise IndexError("document index out of range")
+        return struct.unpack_from("<Q", self._mmap, self._index_start + 8 * i)[0]
+
+    def _read_record(self, i: int, tokens: bool = True):
+        data = self._mmap
+        offset = self._record_offset(i)
+        n_tokens, n_spans, flags = _RECORD.unpack_from(data, offset)
+        offset = offset + _RECORD.size
+        if not tokens:
+            # skip straight to the spans
+            offset = offset + 5 * n_tokens
+            offset = offset + (4 * n_tokens if flags & FLAG_POSITIONS else 0)
+            if flags & FLAG_PROBABILITIES:
+                offset = offset + struct.calcsize(self._probability_type) * n_tokens
+            offset = offset + (8 * n_tokens if flags & FLAG_OFFSETS else 0)
+            word_ids = labels = positions = probabilities = offsets = None
+        else:
+            word_ids, offset = _array_from("I", data, offset, n_tokens)
+            labels = data[offset:offset + n_tokens]
+            offset = offset + n_tokens
+            positions = probabilities = offsets = None
+            if flags & FLAG_POSITIONS:
+                positions, offset = _array_from("I", data, offset, n_tokens)
+            if flags & FLAG_PROBABILITIES:
+                probabilities, offset = _array_from(self._probability_type, data, offset, n_tokens)
+            if flags & FLAG_OFFSETS:
+                chars, offset = _array_from("i", data, offset, 2 * n_tokens)
+                chars = [None if char < 0 else char for char in chars]
+                offsets = list(zip(chars[::2], chars[1::2]))
+        starts, offset = _array_from("I", data, offset, n_spans)
+        ends, offset = _array_from("I", data, offset, n_spans)
+        languages = data[offset:offset + n_spans]
+        return word_ids, labels, positions, probabilities, offsets, starts, ends, languages
+
+    def __getitem__(self, i: int) -> LazaroOutput:
+        word_ids, labels, positions, probabilities, offsets, _, _, _ = self._read_record(i)
+        return LazaroOutput.from_arrays(
+            [self._word(word_id) for word_id in word_ids],
+            [self.labels[code] for code in labels],
+            positions.tolist() if positions is not None else None,
+            [None if math.isnan(prob) else prob for prob in probabilities] if probabilities is not None else None,
+            offsets=offsets,
+        )
+
+    def __iter__(self) -> Iterator[LazaroOutput]:
+        for i in range(self._n_docs):
+            yield self[i]
+
+    def iter_borrowings(self) -> Iterator[Dict]:
+        """Yields every borrowing in the corpus as a dict with the fields of
+        `Borrowing.to_dict` plus "doc" (the index of its document)"""
+        data = self._mmap
+        for i in range(self._n_docs):
+            offset = self._record_offset(i)
+            n_tokens, n_spans, flags = _RECORD.unpack_from(data, offset)
+            if not n_spans:
+                continue
+            _, _, _, _, _, starts, ends, languages = self._read_record(i, tokens=False)
+            word_ids_start = offset + _RECORD.size
+            for start_pos, end_pos, language in zip(starts, ends, languages):
+                word_ids = struct.unpack_from("<%dI" % (end_pos - start_pos), data, word_ids_start + 4 * start_pos)
+                yield {
+                    "doc": i,
+                    "borrowing": " ".join(self._word(word_id) for word_id in word_ids),
+                    "language": self.languages[language],
+                    "start_pos": start_pos,
+                    "end_pos": end_pos,
+                }
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,163 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+import attr
+
+# Per-stage timing of the analyze path. The classifiers wrap each stage of
+# their work (spaCy parsing, feature extraction, tokenization, forward pass,
+# output construction...) in `stage(name)`. While no `Timings` is being
+# recorded, `stage` only reads a context variable and returns a shared no-op,
+# so instrumentation costs close to nothing when it is disabled.
+#
+# CPU time is the CPU time of the calling thread: work done by other threads
+# (such as the intra-op threads of torch) is not included.
+
+_recording = contextvars.ContextVar("pylazaro_timings", default=None)
+
+
+@attr.s(slots=True)
+class StageTiming(object):
+    """Time spent in one stage
+
+    Attributes:
+            calls (int): number of times the stage was run
+            wall (float): wall-clock seconds
+            cpu (float): CPU seconds of the thread that ran the stage
+            counts (Dict[str, int]): counts reported by the stage (tokens, subwords, batch size...)
+    """
+
+    calls = attr.ib(type=int, default=0)
+    wall = attr.ib(type=float, default=0.0)
+    cpu = attr.ib(type=float, default=0.0)
+    counts = attr.ib(type=Dict[str, int], factory=dict)
+
+    def to_dict(self) -> Dict:
+        return attr.asdict(self)
+
+
+class Timings(object):
+    """Timings of the stages run while it is being recorded (see `record`)
+
+    Attributes:
+            stages (Dict[str, StageTiming]): timing of each stage, by name
+            callback (Callable, optional): called as `callback(name, wall, cpu, counts)`
+                        every time a stage ends
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro import timing
+                    >>> with timing.record() as timings:
+                    ...     tagger.analyze_batch(texts)
+                    >>> timings.to_dict()
+                    {'transformers.tokenize': {'calls': 1, 'wall': 0.003, 'cpu': 0.003, 'counts': {'batch_size': 8, 'subwords': 412}}, ...}
+    """
+
+    def __init__(self, callback: Optional[Callable] = None, parent: Optional["Timings"] = None) -> None:
+        self.stages = {}  # type: Dict[str, StageTiming]
+        self.callback = callback
+        self._parent = parent
+
+    def add(self, name: str, wall: float, cpu: float, counts: Dict[str, int]) -> None:
+        timing = self.stages.get(name)
+        if timing is None:
+            timing = self.stages[name] = StageTiming()
+        timing.calls = timing.calls + 1
+        timing.wall = timing.wall + wall
+        timing.cpu = timing.cpu + cpu
+        for key, value in counts.items():
+            timing.counts[key] = timing.counts.get(key, 0) + value
+        if self.callback is not None:
+            self.callback(name, wall, cpu, counts)
+        if self._parent is not None:
+            self._parent.add(name, wall, cpu, counts)
+
+    def __getitem__(self, name: str) -> StageTiming:
+        return self.stages[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.stages
+
+    def to_dict(self) -> Dict[str, Dict]:
+        return {name: timing.to_dict() for name, timing in self.stages.items()}
+
+    def __repr__(self) -> str:
+        return "Timings(%s)" % ", ".join("%s=%.4fs" % (name, timing.wall) for name, timing in self.stages.items())
+
+
+class _Stage(object):
+    __slots__ = ("_timings", "_name", "_counts", "_wall", "_cpu")
+
+    def __init__(self, timings: Timings, name: str, counts: Dict[str, int]) -> None:
+        self._timings = timings
+        self._name = name
+        self._counts = counts
+
+    def count(self, **counts) -> None:
+        """Adds counts (tokens, subwords...) to the stage"""
+        self._counts.update(counts)
+
+    def __enter__(self) -> "_Stage":
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._timings.add(self._name, time.perf_counter() - self._wall, time.thread_time() - self._cpu,
+                          self._counts)
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def count(self, **counts) -> None:
+        pass
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def enabled() -> bool:
+    """Whether timings are being recorded (to skip computing counts that would not be used)"""
+    return _recording.get() is not None
+
+
+def stage(name: str, **counts):
+    """Context manager that times a stage, if timings are being recorded
+
+    Example:
+            .. code-block:: python
+
+                    >>> with stage("transformers.forward", batch_size=len(texts)) as timed:
+                    ...     logits = model(**inputs).logits
+                    ...     timed.count(subwords=int(inputs["attention_mask"].sum()))
+    """
+    timings = _recording.get()
+    if timings is None:
+        return _NULL_STAGE
+    return _Stage(timings, name, counts)
+
+
+@contextmanager
+def record(callback: Optional[Callable] = None) -> Iterator[Timings]:
+    """Records the timings of every stage run within the block (in this thread or
+    asyncio task). Nested recordings also pass their timings to the outer ones.
+
+    Args:
+            callback (Callable, optional): called as `callback(name, wall, cpu, counts)`
+                        every time a stage ends
+    """
+    timings = Timings(callback, _recording.get())
+    token = _recording.set(timings)
+    try:
+        yield timings
+    finally:
+        _recording.reset(token)
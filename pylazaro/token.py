@@ -1,5 +1,6 @@
 import os
 import pathlib
+import threading
 from typing import List, Tuple, Dict
 from collections import defaultdict
 
@@ -19,38 +20,92 @@ QUOTATIONS = ["’",
               "»",
               ]
 
-@attr.s
+# Labels are decoded once into small integer codes: a BIO code and a language
+# code (an index into LANGUAGES, which grows as new languages show up).
+BIO_OUTSIDE = 0
+BIO_BEGIN = 1
+BIO_INSIDE = 2
+BIO_UNKNOWN = 3
+BIO_LABELS = ["O", "B", "I", None]
+BIO_CODES = {"O": BIO_OUTSIDE, "B": BIO_BEGIN, "I": BIO_INSIDE}
+
+NO_LANGUAGE = 0
+LANGUAGES = [None, "ENG", "OTHER"]
+LANGUAGE_CODES = {"ENG": 1, "OTHER": 2}
+
+_languages_lock = threading.Lock()
+_decoded_labels = {}  # type: Dict[str, Tuple[str, int, int]]
+
+
+def language_code(language: str) -> int:
+    """Returns the integer code of a language label (such as "ENG"), registering it if it is new"""
+    code = LANGUAGE_CODES.get(language)
+    if code is None:
+        with _languages_lock:
+            code = LANGUAGE_CODES.get(language)
+            if code is None:
+                code = len(LANGUAGES)
+                LANGUAGES.append(language)
+                LANGUAGE_CODES[language] = code
+    return code
+
+
+def decode_label(label: str) -> Tuple[str, int, int]:
+    """Decodes a label (such as "B-ENG") into (interned label, BIO code, language code)"""
+    decoded = _decoded_labels.get(label)
+    if decoded is None:
+        bio, _, lang = label.partition("-")
+        decoded = (label, BIO_CODES.get(bio, BIO_UNKNOWN), language_code(lang) if lang else NO_LANGUAGE)
+        decoded = _decoded_labels.setdefault(label, decoded)
+    return decoded
+
+
+@attr.s(slots=True)
 class Token(object):
     """
     The object that models a token (a string of chars between two spaces/punct).
+    The label is decoded into integer codes when the token is created, so it
+    should not be reassigned afterwards.
 
     Attributes:
             text (str): string representation of the Token
             label (str): labeled assigned (BIO)
             position (int): position of the token within the sentence/context
             probability (float): score/prob assigned by the tagger to the label
+            start_char (int): offset of the first character of the token in the source text, if known
+            end_char (int): offset after the last character of the token in the source text, if known
+            bio_code (int): the BIO part of the label as an integer (BIO_OUTSIDE, BIO_BEGIN or BIO_INSIDE)
+            lang_code (int): the language part of the label as an index into LANGUAGES
     """
     text = attr.ib(type=str)
     label = attr.ib(type=str)
     position = attr.ib(type=int)
     probability = attr.ib(type=float, default=None, eq=False, repr=False)
+    start_char = attr.ib(type=int, default=None, eq=False, repr=False)
+    end_char = attr.ib(type=int, default=None, eq=False, repr=False)
+    bio_code = attr.ib(type=int, init=False, eq=False, repr=False)
+    lang_code = attr.ib(type=int, init=False, eq=False, repr=False)
+
+    def __attrs_post_init__(self):
+        # labels are decoded (and interned) once, when the token is created
+        self.label, self.bio_code, self.lang_code = decode_label(self.label)
 
     @property
     def lang_label(self):
-        return self.label.split("-")[1]
+        return LANGUAGES[self.lang_code]
 
     @property
     def bio_label(self):
-        return self.label.split("-")[0]
+        return BIO_LABELS[self.bio_code]
 
     def is_outside_label(self) -> bool:
-        return self.bio_label == "O"
+        return self.bio_code == BIO_OUTSIDE
 
     def is_begin_label(self) -> bool:
-        return self.bio_label == "B"
+        return self.bio_code == BIO_BEGIN
 
     def is_inside_label(self) -> bool:
-        return self.bio_label == "I"
+        return self.bio_code == BIO_INSIDE
 
     def is_quotation(self) -> bool:
         return self.text in QUOTATIONS
@@ -0,0 +1,307 @@
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from pylazaro.constants import PATH_TO_TUNED_CONFIG
+
+# Autotuning of the settings that depend on the host: the number of torch
+# threads, the batch size and the number of worker processes. `tune` measures
+# throughput and tail latency over a sample of texts and `save_tuned_settings`
+# writes the best settings to a JSON file (PYLAZARO_CONFIG, or
+# ~/.pylazaro/tuned.json), together with a description of the host. `Lazaro`
+# (and the `tag` and `serve` commands) then use them for every setting that
+# is not given explicitly, as long as the file was written on a host with the
+# same CPU count and architecture.
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64]
+
+_loaded = {}  # type: Dict[str, tuple]
+
+
+def host_info() -> Dict:
+    """CPU count, architecture and (on Linux) CPU cache sizes of this host"""
+    info = {"cpu_count": os.cpu_count(), "machine": platform.machine(), "processor": platform.processor()}
+    caches = {}
+    cache_dir = Path("/sys/devices/system/cpu/cpu0/cache")
+    for index in sorted(cache_dir.glob("index*")) if cache_dir.exists() else []:
+        try:
+            level = (index / "level").read_text().strip()
+            kind = (index / "type").read_text().strip()
+            size = (index / "size").read_text().strip()
+        except OSError:
+            continue
+        name = "L%s%s" % (level, {"Data": "d", "Instruction": "i"}.get(kind, ""))
+        caches[name] = size
+    if caches:
+        info["caches"] = caches
+    return info
+
+
+def config_path() -> Optional[Path]:
+    """Path of the tuned settings: PYLAZARO_CONFIG if it is set (an empty value turns tuned
+    settings off), ~/.pylazaro/tuned.json otherwise"""
+    path = os.environ.get("PYLAZARO_CONFIG")
+    if path is None:
+        return PATH_TO_TUNED_CONFIG
+    return Path(path) if path else None
+
+
+def _config_key(model_type: str, model_file: str = None) -> str:
+    return model_type if not model_file else "%s:%s" % (model_type, model_file)
+
+
+def load_tuned_config(path: Path = None) -> Dict:
+    """Contents of the tuned settings file (empty if there is none). The file is only read
+    again when it changes."""
+    path = path or config_path()
+    if path is None:
+        return {}
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    cached = _loaded.get(str(path))
+    if cached is None or cached[0] != mtime:
+        try:
+            with open(path, encoding="utf-8") as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring the tuned settings in %s: %s", path, e)
+            return {}
+        if not isinstance(config, dict):
+            logging.warning("Ignoring the tuned settings in %s: not a JSON object", path)
+            return {}
+        cached = _loaded[str(path)] = (mtime, config)
+    return cached[1]
+
+
+def tuned_settings(model_type: str, model_file: str = None, path: Path = None) -> Dict:
+    """Tuned settings of a model on this host (`num_threads`, `batch_size`, `workers` and `worker_threads`), or
+    an empty dict if it was not tuned, or was tuned on a host with a different CPU count or architecture"""
+    config = load_tuned_config(path)
+    host = config.get("host", {})
+    if host.get("cpu_count") != os.cpu_count() or host.get("machine") != platform.machine():
+        return {}
+    return config.get("models", {}).get(_config_key(model_type, model_file), {})
+
+
+def tuned_setting(model_type: str, model_file: str, name: str, default=None):
+    settings = tuned_settings(model_type, model_file)
+    value = settings.get(name)
+    return default if value is None else value
+
+
+def tuned_threads(model_type: str, model_file: str = None, workers: int = 1) -> Optional[int]:
+    """Tuned number of torch threads for each of `workers` processes: the best thread count of a
+    single process, or, with several workers, the per-worker count measured for that many workers
+    (None if it was not measured, so that torch picks its own)"""
+    settings = tuned_settings(model_type, model_file)
+    if workers <= 1:
+        return settings.get("num_threads")
+    if settings.get("workers") == workers:
+        return settings.get("worker_threads")
+    return None
+
+
+def save_tuned_settings(model_type: str, settings: Dict, model_file: str = None, path: Path = None) -> Path:
+    """Writes the settings of a model to the tuned settings file, next to those of the other models
+    (the settings of every model are dropped if the file was written on another host)"""
+    path = Path(path or config_path() or PATH_TO_TUNED_CONFIG)
+    config = load_tuned_config(path)
+    host = host_info()
+    models = dict(config.get("models", {}))
+    if {key: config.get("host", {}).get(key) for key in ("cpu_count", "machine")} != \
+            {key: host[key] for key in ("cpu_count", "machine")}:
+        models = {}
+    models[_config_key(model_type, model_file)] = settings
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # written next to the file and then moved over it, so that a tagger starting
+    # meanwhile reads either the old settings or the new ones, never half a file
+    descriptor, temp_path = tempfile.mkstemp(prefix=path.name, suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+            json.dump({"host": host, "models": models}, f, indent=2)
+        os.replace(temp_path, str(path))
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return path
+
+
+def _run_stats(n_docs: int, wall: float, latencies: List[float]) -> Dict:
+    return {
+        "docs_per_sec": n_docs / wall if wall else 0.0,
+        "latency_p50_ms": 1000 * float(np.percentile(latencies, 50)),
+        "latency_p95_ms": 1000 * float(np.percentile(latencies, 95)),
+        "latency_p99_ms": 1000 * float(np.percentile(latencies, 99)),
+    }
+
+
+def measure(tagger, texts: Sequence, batch_size: int) -> Dict:
+    """Throughput and latency per call of `analyze_batch` over the texts (after one warmup batch)"""
+    batches = [list(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    tagger.analyze_batch(batches[0])
+    latencies = []
+    for batch in batches:
+        start = time.perf_counter()
+        tagger.analyze_batch(batch)
+        latencies.append(time.perf_counter() - start)
+    return _run_stats(len(texts), sum(latencies), latencies)
+
+
+_worker_tagger = None
+
+
+def _init_worker(model_type: str, model_file: str, num_threads: int, barrier) -> None:
+    global _worker_tagger
+    from pylazaro.lazaro import Lazaro
+
+    try:
+        _worker_tagger = Lazaro(model_type=model_type, model_file=model_file, num_threads=num_threads)
+        _worker_tagger.analyze_batch(["Hola."])
+    except BaseException:
+        # do not leave the other processes waiting for a worker that will never be ready
+        barrier.abort()
+        raise
+    # the clock starts once every worker has loaded its model
+    barrier.wait()
+
+
+def _tag_batch(batch: List) -> float:
+    start = time.perf_counter()
+    _worker_tagger.analyze_batch(batch)
+    return time.perf_counter() - start
+
+
+def measure_workers(model_type: str, model_file: str, texts: Sequence, batch_size: int, workers: int,
+                    num_threads: int = None, timeout: float = 600.0) -> Dict:
+    """Throughput of `workers` processes (each with its own model and `num_threads` torch threads)
+    tagging the texts in batches, and latency per batch"""
+    batches = [list(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    # spawn: forking a process in which torch already started its thread pool can deadlock
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers + 1)
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(model_type, model_file, num_threads, barrier)) as pool:
+        barrier.wait(timeout)
+        start = time.perf_counter()
+        latencies = pool.map(_tag_batch, batches, chunksize=1)
+        wall = time.perf_counter() - start
+    return _run_stats(len(texts), wall, latencies)
+
+
+def best_run(runs: List[Dict], max_latency_ms: float = None) -> Dict:
+    """The run with the highest throughput whose p95 latency is within `max_latency_ms`
+    (the one with the lowest p95 latency if none is)"""
+    if max_latency_ms is not None:
+        within = [run for run in runs if run["latency_p95_ms"] <= max_latency_ms]
+        if not within:
+            return min(runs, key=lambda run: run["latency_p95_ms"])
+        runs = within
+    return max(runs, key=lambda run: run["docs_per_sec"])
+
+
+def _powers_of_two(limit: int) -> List[int]:
+    values = [1]
+    while values[-1] * 2 <= limit:
+        values.append(values[-1] * 2)
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+def tune(model_type: str, texts: Sequence, model_file: str = None, max_latency_ms: float = None,
+         batch_sizes: Sequence[int] = BATCH_SIZES, max_workers: int = None, min_gain: float = 0.05,
+         log: Callable[[str], None] = logging.info) -> Dict:
+    """Searches the number of torch threads, the batch size and the number of worker processes
+    that give the highest throughput on this host (within a p95 latency bound, if given)
+
+    The search goes one setting at a time: torch threads (bilstm and transformers models) with a
+    batch size of 16, then the batch size with the best thread count, then the number of worker
+    processes, sharing the cores among them (`worker_threads`). More workers (each with a copy of the model) are only
+    chosen if they raise throughput by more than `min_gain`.
+
+    Args:
+            model_type (str): type of model (crf/bilstm/transformers)
+            texts (Sequence): sample texts, similar to the ones the model will tag
+            model_file (str, optional): model to be used
+            max_latency_ms (float, optional): bound on the p95 latency of a batch
+            batch_sizes (Sequence[int]): batch sizes to try
+            max_workers (int, optional): maximum number of worker processes (the CPU count by default)
+            min_gain (float): relative throughput gain needed to add workers
+            log (Callable): called with a line for every measurement
+
+    Returns:
+            Dict: the settings (`num_threads` of a single process, `batch_size`, `workers` and the
+                    `worker_threads` of each of them) and their measurements
+
+    Example:
+            .. code-block:: python
+
+                    >>> from pylazaro.tuning import save_tuned_settings, tune
+                    >>> settings = tune("transformers", texts, max_latency_ms=200)
+                    >>> save_tuned_settings("transformers", settings)
+    """
+    from pylazaro.classifiers import set_torch_threads
+    from pylazaro.lazaro import Lazaro
+
+    cpus = os.cpu_count() or 1
+    uses_torch = model_type != "crf"
+    tagger = Lazaro(model_type=model_type, model_file=model_file, collect_metrics=False)
+
+    num_threads = None
+    if uses_torch:
+        runs = []
+        for threads in _powers_of_two(cpus):
+            set_torch_threads(threads)
+            run = dict(measure(tagger, texts, 16), num_threads=threads)
+            log("threads %3d  batch  16  %8.1f docs/s  p95 %8.2f ms" % (threads, run["docs_per_sec"],
+                                                                         run["latency_p95_ms"]))
+            runs.append(run)
+        num_threads = best_run(runs)["num_threads"]
+        set_torch_threads(num_threads)
+
+    runs = []
+    for batch_size in batch_sizes:
+        run = dict(measure(tagger, texts, batch_size), batch_size=batch_size)
+        log("threads %3s  batch %3d  %8.1f docs/s  p95 %8.2f ms" % (num_threads or "-", batch_size,
+                                                                     run["docs_per_sec"], run["latency_p95_ms"]))
+        runs.append(run)
+    best = dict(best_run(runs, max_latency_ms), worker_threads=None, workers=1)
+
+    for workers in _powers_of_two(min(max_workers or cpus, cpus))[1:]:
+        threads = max(1, cpus // workers) if uses_torch else None
+        try:
+            run = measure_workers(model_type, model_file, texts, best["batch_size"], workers, threads)
+        except Exception as e:
+            log("workers %3d  failed: %s" % (workers, e))
+            break
+        log("workers %3d  threads %3s  batch %3d  %8.1f docs/s  p95 %8.2f ms" % (
+            workers, threads or "-", best["batch_size"], run["docs_per_sec"], run["latency_p95_ms"]))
+        within_bound = max_latency_ms is None or run["latency_p95_ms"] <= max_latency_ms
+        if within_bound and run["docs_per_sec"] > (1 + min_gain) * best["docs_per_sec"]:
+            best = dict(run, batch_size=best["batch_size"], worker_threads=threads, workers=workers)
+
+    settings = {
+        # the best thread count of a single process, which is what a Lazaro on its own uses
+        "num_threads": num_threads,
+        "batch_size": best["batch_size"],
+        "workers": best["workers"],
+        "worker_threads": best["worker_threads"],
+        "docs_per_sec": best["docs_per_sec"],
+        "latency_p95_ms": best["latency_p95_ms"],
+        "latency_p99_ms": best["latency_p99_ms"],
+        "max_latency_ms": max_latency_ms,
+        "n_texts": len(texts),
+        "tuned_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    return settings
@@ -3,8 +3,10 @@ import logging
 import os
 import re
 import string
+import threading
 from abc import ABC, abstractmethod
 from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
@@ -19,7 +21,8 @@ from collections import OrderedDict
 
 from .constants import *
 from .borrowing import Borrowing
-from .token import Token
+from .timing import stage
+from .token import BIO_BEGIN, BIO_INSIDE, LANGUAGES, NO_LANGUAGE, Token, decode_label
 
 UPPERCASE_RE = regex.compile(r"[\p{Lu}\p{Lt}]")
 LOWERCASE_RE = regex.compile(r"\p{Ll}")
@@ -27,6 +30,14 @@ DIGIT_RE = re.compile(r"\d")
 
 PUNC_REPEAT_RE = regex.compile(r"\p{P}+")
 
+# A sentence ends with . ! ? or … (optionally followed by closing quotes or
+# brackets) when the next word starts with an uppercase letter, a digit or an
+# opening quote/question/exclamation mark
+SENTENCE_BOUNDARY_RE = regex.compile(
+    r"(?<=[.!?…][\"'”’»)\]]*)\s+(?=[\"'“‘«(¿¡\p{Lu}\p{Lt}\d])"
+)
+SENTENCE_FINAL_TOKENS = {".", "!", "?", "…", "...", "?!", "!?"}
+
 PATH_TO_DICT_ES = "lexicon/es.txt"
 PATH_TO_DICT_EN = "lexicon/en.txt"
 PATH_TO_LEXICON_ES = "lexicon/spanish_lexicon.csv"
@@ -87,8 +98,28 @@ class WindowedTokenFeatureExtractor:
 class CRFsuiteEntityRecognizer_CoNLL:
     def __init__(self, feature_extractor: WindowedTokenFeatureExtractor) -> None:
         self.feature_extractor = feature_extractor
+        self.model_path = None
+        # pycrfsuite taggers are not thread-safe: each thread opens its own
+        self._local = threading.local()
         # self._encoder = encoder
 
+    def open(self, path: str) -> None:
+        """Opens the model file (and checks it can be read by the current thread)"""
+        tagger = pycrfsuite.Tagger()
+        tagger.open(path)
+        self.model_path = path
+        self._local = threading.local()
+        self._local.tagger = tagger
+
+    @property
+    def tagger(self) -> pycrfsuite.Tagger:
+        tagger = getattr(self._local, "tagger", None)
+        if tagger is None:
+            tagger = pycrfsuite.Tagger()
+            tagger.open(self.model_path)
+            self._local.tagger = tagger
+        return tagger
+
     """
     @property
     def encoder(self) -> EntityEncoder:
@@ -120,12 +151,11 @@ class CRFsuiteEntityRecognizer_CoNLL:
                 print(len(tokens))
                 print(len(labels))
         trainer.train(path)
-        self.tagger = pycrfsuite.Tagger()
-        self.tagger.open(path)
+        self.open(path)
 
     def __call__(self, doc):
         tokens = list(doc)
-        if not self.tagger:
+        if not self.model_path:
             raise ValueError("train() method should be called first!")
         # tokens = doc[0]
         tags = self.predict_labels(tokens)
@@ -133,9 +163,11 @@ class CRFsuiteEntityRecognizer_CoNLL:
 
     def predict_labels(self, doc) -> List[str]:
         tokens = list(doc)
-        features = self.feature_extractor.extract(tokens)
+        with stage("crf.features", tokens=len(tokens)):
+            features = self.feature_extractor.extract(tokens)
         # features = self.feature_extractor.extract([str(token) for token in tokens])
-        tags = self.tagger.tag(features)
+        with stage("crf.tagging", tokens=len(tokens)):
+            tags = self.tagger.tag(features)
         return tags
 
 
@@ -841,14 +873,16 @@ class WordProbability(FeatureExtractor):
                     else:
                         self.trigram_counts[("START", lemma[0])]["END"] += 1
                         self.bigram_counts[("START", lemma[0])] += 1
+        # plain dicts from now on: looking up unseen character pairs must not insert them,
+        # or the counts grow with every new word that is tagged
+        self.trigram_counts = {pair: dict(counts) for pair, counts in self.trigram_counts.items()}
+        self.bigram_counts = dict(self.bigram_counts)
 
     def get_trigram_prob(self, char0, char1, char2):
-        if self.bigram_counts[(char0, char1)] == 0:
+        bigram_count = self.bigram_counts.get((char0, char1), 0)
+        if bigram_count == 0:
             return 1e-10
-        return np.log2(
-            self.trigram_counts[(char0, char1)][char2]
-            / self.bigram_counts[(char0, char1)]
-        )
+        return np.log2(self.trigram_counts[(char0, char1)].get(char2, 0) / bigram_count)
 
     def get_word_probability(self, word):
         if len(word) > 1:
@@ -904,14 +938,24 @@ class WordVectorFeatureNerpy(FeatureExtractor):
     ) -> None:
         self.vectors_id = vectors
         self.scale = scaling
-        path_to_vectors_db = PATH_TO_EMBEDDINGS_DB
+        self.path_to_vectors_db = PATH_TO_EMBEDDINGS_DB
+        # sqlite connections cannot be shared between threads: each thread opens its own
+        self._local = threading.local()
         try:
-            self.word_vectors = SqliteWordEmbedding.open(path_to_vectors_db)
+            self._local.word_vectors = SqliteWordEmbedding.open(self.path_to_vectors_db)
         except:
             print(
                 "Embeddings file does not exist. Extended installation needed! Please install the extended version of pylazaro (See https://pylazaro.readthedocs.io/en/latest/install.html)"
             )
 
+    @property
+    def word_vectors(self) -> SqliteWordEmbedding:
+        word_vectors = getattr(self._local, "word_vectors", None)
+        if word_vectors is None:
+            word_vectors = SqliteWordEmbedding.open(self.path_to_vectors_db)
+            self._local.word_vectors = word_vectors
+        return word_vectors
+
     def extract(
         self,
         token: str,
@@ -926,7 +970,8 @@ class WordVectorFeatureNerpy(FeatureExtractor):
             else:
                 try:
                     # word_vector = self._embedding_cache(token.text.lower())
-                    word_vector = self.word_vectors[token.text.lower()]
+                    with stage("crf.embeddings", lookups=1):
+                        word_vector = self.word_vectors[token.text.lower()]
                 except KeyError:
                     word_vector = np.zeros(self.word_vectors.dim)
             keys = self.get_keys(word_vector)
@@ -986,35 +1031,195 @@ def set_embeddings_with_quickvec(path_to_embeddings, path_to_embeddings_db):
     )
 
 
-def fuse_spans(output_tokens: List[Token]) -> List[Borrowing]:
-    new_output = []
-    half_boiled_label = None
-    half_boiled_token = []
+def split_sentences(text) -> List:
+    """Splits a text into sentences (pieces of the original string). Pre-tokenized
+    texts (lists of words) are split after sentence-final punctuation tokens.
+
+    Args:
+            text: a string or a list of words
+
+    Returns:
+            List: sentences (strings, or lists of words for pre-tokenized texts)
+    """
+    if isinstance(text, list):
+        sentences = []
+        current = []
+        for word in text:
+            current.append(word)
+            if word in SENTENCE_FINAL_TOKENS:
+                sentences.append(current)
+                current = []
+        if current:
+            sentences.append(current)
+        return sentences
+    return [sentence for sentence in SENTENCE_BOUNDARY_RE.split(text.strip()) if sentence]
+
+
+def sentence_ranges(words: Sequence[str]) -> List[Tuple[int, int]]:
+    """Splits a list of words into sentences after sentence-final punctuation tokens
+
+    Returns:
+            List[Tuple[int, int]]: (start, end) word index range of each sentence
+    """
+    ranges = []
+    start = 0
+    for i, word in enumerate(words):
+        if word in SENTENCE_FINAL_TOKENS:
+            ranges.append((start, i + 1))
+            start = i + 1
+    if start < len(words):
+        ranges.append((start, len(words)))
+    return ranges
+
+
+def chunked(items: Iterable, size: int) -> Iterable[List]:
+    """Splits an iterable into lists of (at most) `size` items, without reading it all at once"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class SharedMemoryZone(object):
+    """Runs calls to a spaCy pipeline inside memory zones (spaCy 3.8+), so that the
+    strings and lexemes of the words seen while tagging are freed afterwards instead
+    of piling up in the vocab of a long-running process.
+
+    spaCy memory zones cannot be nested, so concurrent calls share one zone: it is
+    opened by the first call and closed when the last one leaves. Once `max_docs`
+    documents went through a zone, new calls wait for it to close, so that it also
+    gets closed under constant load. Docs (and their tokens) created inside a zone
+    must not be used after the call that created them returns.
+
+    Attributes:
+            nlp (`spacy.language.Language`): the pipeline
+            max_docs (int): documents after which the current zone is drained and closed
+
+    Example:
+            .. code-block:: python
+
+                    >>> zone = SharedMemoryZone(nlp)
+                    >>> with zone(n_docs=1):
+                    ...     words = [token.text for token in nlp(text)]
+    """
+
+    def __init__(self, nlp, max_docs: int = 10000) -> None:
+        self.nlp = nlp
+        self.max_docs = max_docs
+        self._condition = threading.Condition()
+        self._zone = None
+        self._users = 0
+        self._docs = 0
+        self._draining = False
+
+    @contextmanager
+    def __call__(self, n_docs: int = 1):
+        if not hasattr(self.nlp, "memory_zone"):  # spaCy < 3.8
+            yield
+            return
+        with self._condition:
+            while self._draining:
+                self._condition.wait()
+            if self._zone is None:
+                self._zone = self.nlp.memory_zone()
+                self._zone.__enter__()
+            self._users = self._users + 1
+            self._docs = self._docs + n_docs
+            if self._docs >= self.max_docs:
+                self._draining = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._users = self._users - 1
+                if self._users == 0:
+                    zone, self._zone = self._zone, None
+                    self._docs = 0
+                    self._draining = False
+                    zone.__exit__(None, None, None)
+                    self._condition.notify_all()
+
+
+def fuse_span_ranges(bio_codes: Sequence[int], lang_codes: Sequence[int]) -> List[Tuple[int, int, int]]:
+    """Finds the borrowings in a sequence of BIO and language codes (see `pylazaro.token.decode_label`).
+    An I token starts a new borrowing unless it continues one of the same language
+    (see `pylazaro.decoding` for the rules).
+
+    Returns:
+            List[Tuple[int, int, int]]: (start, end, language code) of each borrowing
+    """
+    ranges = []
+    current = NO_LANGUAGE
     start_pos = 0
 
-    for i, token in enumerate(output_tokens):
-        if token.is_outside_label():
-            if half_boiled_label:
-                bor = Borrowing.from_span(half_boiled_token, half_boiled_label, start_pos, i,
-                                   output_tokens)
-                new_output.append(bor)
-                half_boiled_label = None
-                half_boiled_token = []
-            start_pos = i
-            #new_output.append((token, label))
-        if token.is_begin_label():
-            if half_boiled_label:
-                bor = Borrowing.from_span(half_boiled_token, half_boiled_label, start_pos, i, output_tokens)
-                new_output.append(bor)
-            half_boiled_label = token.lang_label
-            half_boiled_token = [token]
-            start_pos = i
-        if token.is_inside_label():
-            half_boiled_label = token.lang_label
-            if not half_boiled_token:
-                start_pos = i
-            half_boiled_token.append(token)
-    if half_boiled_label:
-        bor = Borrowing.from_span(half_boiled_token, half_boiled_label, start_pos, len(output_tokens), output_tokens)
-        new_output.append(bor)
-    return new_output
+    for i, bio_code in enumerate(bio_codes):
+        lang_code = lang_codes[i] if bio_code == BIO_BEGIN or bio_code == BIO_INSIDE else NO_LANGUAGE
+        if lang_code and bio_code == BIO_INSIDE and lang_code == current:
+            continue
+        if current:
+            ranges.append((start_pos, i, current))
+        current = lang_code
+        start_pos = i
+    if current:
+        ranges.append((start_pos, len(bio_codes), current))
+    return ranges
+
+
+def label_span_ranges(labels: Iterable[str]) -> List[Tuple[int, int, int]]:
+    """Same as `fuse_span_ranges`, but from string labels (such as "B-ENG")"""
+    bio_codes = []
+    lang_codes = []
+    for label in labels:
+        _, bio_code, lang_code = decode_label(label)
+        bio_codes.append(bio_code)
+        lang_codes.append(lang_code)
+    return fuse_span_ranges(bio_codes, lang_codes)
+
+
+def context_ranges(span_ranges: Sequence[Tuple[int, int, int]], sentences: Sequence[Tuple[int, int]],
+                   n_tokens: int, window: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Finds the context of each borrowing: the sentence that contains it, narrowed
+    to `window` tokens at each side of the borrowing (if given)
+
+    Args:
+            span_ranges (Sequence[Tuple[int, int, int]]): (start, end, language code) of each borrowing
+            sentences (Sequence[Tuple[int, int]]): (start, end) of each sentence
+            n_tokens (int): number of tokens of the text
+            window (int, optional): maximum number of tokens at each side of a borrowing
+
+    Returns:
+            List[Tuple[int, int]]: (start, end) token range of the context of each borrowing
+    """
+    # spans and sentences are both sorted, so they are matched in one pass
+    contexts = []
+    i = 0
+    for start_pos, end_pos, _ in span_ranges:
+        while i < len(sentences) - 1 and sentences[i][1] <= start_pos:
+            i = i + 1
+        if sentences:
+            context_start = min(sentences[i][0], start_pos)
+            context_end = max(sentences[i][1], end_pos)
+        else:
+            context_start, context_end = 0, n_tokens
+        if window is not None:
+            context_start = max(context_start, start_pos - window)
+            context_end = min(context_end, end_pos + window)
+        contexts.append((context_start, context_end))
+    return contexts
+
+
+def fuse_spans(output_tokens: List[Token], context_window: Optional[int] = None) -> List[Borrowing]:
+    """Groups tokens into borrowings following their BIO labels (see `fuse_span_ranges`).
+    Borrowings are built as index ranges into `output_tokens`, and their context is
+    bounded by their sentence (see `context_ranges`)."""
+    ranges = fuse_span_ranges([token.bio_code for token in output_tokens],
+                              [token.lang_code for token in output_tokens])
+    contexts = context_ranges(ranges, sentence_ranges([token.text for token in output_tokens]),
+                              len(output_tokens), context_window)
+    return [Borrowing.from_span(None, LANGUAGES[lang_code], start_pos, end_pos, output_tokens,
+                                context_start, context_end)
+            for (start_pos, end_pos, lang_code), (context_start, context_end) in zip(ranges, contexts)]
@@ -0,0 +1,134 @@
+import math
+import struct
+import sys
+from array import array
+from typing import List
+
+from pylazaro.output import LazaroOutput
+
+# Compact binary encoding of a LazaroOutput, used to move outputs between
+# processes (and to store them) without pickling Token/Borrowing objects.
+#
+# Layout (little endian):
+#   header      magic "LZ", version (B), flags (B), n_tokens (I), n_labels (H)
+#   label table n_labels x (length (B) + utf-8 bytes)
+#   label codes n_tokens x B
+#   word sizes  n_tokens x I (utf-8 length of each word)
+#   words       concatenated utf-8 bytes
+#   probs       n_tokens x d (NaN for tokens without probability), if FLAG_PROBABILITIES
+#   positions   n_tokens x I, if FLAG_POSITIONS (only when positions are not 0..n-1)
+#   offsets     n_tokens x 2 x i (start and end character of each word, -1 if unknown), if FLAG_OFFSETS
+#
+# Borrowings are not stored: they are rebuilt from the labels when needed.
+
+MAGIC = b"LZ"
+VERSION = 2
+FLAG_PROBABILITIES = 1
+FLAG_POSITIONS = 2
+FLAG_OFFSETS = 4
+
+_HEADER = struct.Struct("<2sBBIH")
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+def _array_bytes(typecode: str, values) -> bytes:
+    arr = array(typecode, values)
+    if _BIG_ENDIAN:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _array_from(typecode: str, data: bytes, offset: int, n: int):
+    arr = array(typecode)
+    end = offset + n * arr.itemsize
+    arr.frombytes(data[offset:end])
+    if _BIG_ENDIAN:
+        arr.byteswap()
+    return arr, end
+
+
+def pack_output(output: LazaroOutput) -> bytes:
+    """Encodes a LazaroOutput as compact bytes
+
+    Args:
+            output (`pylazaro.output.LazaroOutput`): the output to encode
+
+    Returns:
+            bytes: the encoded output (see `unpack_output`)
+    """
+    label_ids = {}
+    codes = [label_ids.setdefault(label, len(label_ids)) for label in output.labels]
+    if len(label_ids) > 255:
+        raise ValueError("Too many distinct labels to encode: %d" % len(label_ids))
+    words = [word.encode("utf-8") for word in output.words]
+    probabilities = output.probabilities
+    has_probabilities = any(prob is not None for prob in probabilities)
+    # from_Flair drops empty tokens, which leaves gaps in the positions
+    positions = output.positions
+    has_positions = any(position != i for i, position in enumerate(positions))
+    offsets = output.offsets
+    has_offsets = any(start is not None for start, _ in offsets)
+    flags = (FLAG_PROBABILITIES if has_probabilities else 0) | (FLAG_POSITIONS if has_positions else 0)
+    flags = flags | (FLAG_OFFSETS if has_offsets else 0)
+
+    parts = [_HEADER.pack(MAGIC, VERSION, flags, len(words), len(label_ids))]
+    for label in label_ids:
+        encoded = label.encode("utf-8")
+        parts.append(bytes([len(encoded)]) + encoded)
+    parts.append(bytes(codes))
+    parts.append(_array_bytes("I", [len(word) for word in words]))
+    parts.append(b"".join(words))
+    if has_probabilities:
+        # doubles, so that outputs read back are the same as the ones that were tagged
+        parts.append(_array_bytes("d", [math.nan if prob is None else prob for prob in probabilities]))
+    if has_positions:
+        parts.append(_array_bytes("I", positions))
+    if has_offsets:
+        parts.append(_array_bytes("i", [-1 if char is None else char for pair in offsets for char in pair]))
+    return b"".join(parts)
+
+
+def unpack_output(data: bytes) -> LazaroOutput:
+    """Decodes bytes produced by `pack_output` back into a LazaroOutput
+
+    Args:
+            data (bytes): encoded output
+
+    Returns:
+            `pylazaro.output.LazaroOutput`: the decoded output
+    """
+    magic, version, flags, n_tokens, n_labels = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a pylazaro encoded output (or unsupported version)")
+    offset = _HEADER.size
+    labels = []
+    for _ in range(n_labels):
+        size = data[offset]
+        labels.append(data[offset + 1:offset + 1 + size].decode("utf-8"))
+        offset = offset + 1 + size
+    codes = data[offset:offset + n_tokens]
+    offset = offset + n_tokens
+    sizes, offset = _array_from("I", data, offset, n_tokens)
+    words = []
+    for size in sizes:
+        words.append(data[offset:offset + size].decode("utf-8"))
+        offset = offset + size
+    probabilities = None
+    if flags & FLAG_PROBABILITIES:
+        probabilities, offset = _array_from("d", data, offset, n_tokens)
+        probabilities = [None if math.isnan(prob) else prob for prob in probabilities]
+    positions = None
+    if flags & FLAG_POSITIONS:
+        positions, offset = _array_from("I", data, offset, n_tokens)
+        positions = positions.tolist()
+    offsets = None
+    if flags & FLAG_OFFSETS:
+        chars, offset = _array_from("i", data, offset, 2 * n_tokens)
+        chars = [None if char < 0 else char for char in chars]
+        offsets = list(zip(chars[::2], chars[1::2]))
+    return LazaroOutput.from_arrays(words, [labels[code] for code in codes], positions, probabilities,
+                                    offsets=offsets)
+
+
+def pack_outputs(outputs: List[LazaroOutput]) -> List[bytes]:
+    return [pack_output(output) for output in outputs]
@@ -42,4 +42,7 @@ setup(
         "python-crfsuite",
         "quickvec",
     ],
+    extras_require={
+        "arrow": ["pyarrow"],
+    },
 )
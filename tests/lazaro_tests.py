@@ -1,6 +1,22 @@
+import asyncio
+import http.client
+import importlib.util
+import io
+import json
+import multiprocessing
 import os
+import pickle
+import re
+import socket
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
 
 sys.path.insert(0, os.path.abspath(".."))
 sys.path.insert(0, os.path.abspath("."))
@@ -11,6 +27,20 @@ from pylazaro.output import *
 from pylazaro.utils import *
 from pylazaro.token import Token
 from pylazaro.borrowing import Borrowing
+from pylazaro.aggregate import BorrowingAggregator
+from pylazaro.cache import ResultCache, cache_key
+from pylazaro.columnar import BatchResult
+from pylazaro.coalesce import SingleFlight
+from pylazaro.decoding import TagDecoder, merge_wordpieces
+from pylazaro.evaluation import SpanColumns, evaluate, format_table, match_spans, project_spans, read_conll_gold
+from pylazaro.pool import LazaroPool
+from pylazaro.profiling import profile_features
+from pylazaro.server import LazaroHTTPServer, ServerConfig
+from pylazaro.store import CorpusReader, CorpusWriter
+from pylazaro import __main__ as cli, bulk, metrics, timing
+from pylazaro.metrics import MetricsRegistry
+from pylazaro.tuning import best_run, host_info, save_tuned_settings, tuned_settings, tuned_threads
+from pylazaro.wire import pack_output, unpack_output
 
 EXAMPLE = "La 'app' de 'machine learning' fue un éxito en el festival de 'anime'"
 TOKENIZED_SENTENCE = [
@@ -82,6 +112,72 @@ OTHER = [
     Borrowing(tokens=[Token('anime', "B-OTHER", 17)], language='OTHER', start_pos=17, end_pos=18,
               context_tokens=TOKENIZED_SENTENCE)]
 
+CONCURRENT_TEXTS = [
+    EXAMPLE,
+    "Fue un look sencillo. Se celebra un festival de 'anime'.",
+    "Las fake news sobre la celebrity se reprodujeron por los mass media en prime time.",
+    "Buscamos data scientist para proyecto de machine learning.",
+] * 8
+
+
+def analyze_concurrently(lazaro, texts, n_threads=8):
+    with ThreadPoolExecutor(n_threads) as executor:
+        return list(executor.map(lazaro.analyze, texts))
+
+
+class StubClassifier(LazaroClassifier):
+    """Splits texts on whitespace and tags a few known borrowings, without loading any model.
+    Every call is recorded in `batches`; with `release`, calls wait for the event to be set,
+    and with `error`, they raise it."""
+
+    model_file = "stub"
+    LABELS = {"look": "B-ENG", "app": "B-ENG", "anime": "B-OTHER"}
+
+    def __init__(self, release=None, error=None):
+        self.release = release
+        self.error = error
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def predict(self, text):
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+        if self.release is not None:
+            self.release.wait(10)
+        if self.error is not None:
+            raise self.error
+        return [self.tag(text) for text in texts]
+
+    @classmethod
+    def tag(cls, text):
+        if isinstance(text, str):
+            matches = list(re.finditer(r"\S+", text))
+            words = [match.group() for match in matches]
+            offsets = [match.span() for match in matches]
+        else:
+            words, offsets = list(text), None
+        return LazaroOutput.from_arrays(words, [cls.LABELS.get(word, "O") for word in words],
+                                        probabilities=[0.123456789] * len(words), offsets=offsets)
+
+    def load_model(self):
+        pass
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def stub_lazaro(classifier=None, **kwargs):
+    return Lazaro(model_type="crf", classifier=classifier or StubClassifier(), collect_metrics=False, **kwargs)
+
 
 class LazaroCRFTestCase(unittest.TestCase):
     def setUp(self):
@@ -114,6 +210,10 @@ class LazaroCRFTestCase(unittest.TestCase):
     def test_tag_per_token(self):
         self.assertEqual(self.prediction.tag_per_token(), TAG_PER_TOKEN)
 
+    def test_concurrent_analyze_matches_sequential(self):
+        sequential = [self.lazaro.analyze(text) for text in CONCURRENT_TEXTS]
+        self.assertEqual(analyze_concurrently(self.lazaro, CONCURRENT_TEXTS), sequential)
+
 class LazaroFlairTestCase(unittest.TestCase):
     def setUp(self):
         self.lazaro = Lazaro(model_type="bilstm")
@@ -137,6 +237,10 @@ class LazaroFlairTestCase(unittest.TestCase):
     def test_tag_per_token(self):
         self.assertEqual(self.prediction.tag_per_token(), TAG_PER_TOKEN)
 
+    def test_concurrent_analyze_matches_sequential(self):
+        sequential = [self.lazaro.analyze(text) for text in CONCURRENT_TEXTS]
+        self.assertEqual(analyze_concurrently(self.lazaro, CONCURRENT_TEXTS), sequential)
+
 
 
 
@@ -165,6 +269,920 @@ class LazaroTransformersTestCase(unittest.TestCase):
     def test_tag_per_token(self):
         self.assertEqual(self.prediction.tag_per_token(), TAG_PER_TOKEN)
 
+    def test_concurrent_analyze_matches_sequential(self):
+        sequential = [self.lazaro.analyze(text) for text in CONCURRENT_TEXTS]
+        self.assertEqual(analyze_concurrently(self.lazaro, CONCURRENT_TEXTS), sequential)
+
+
+class LazaroOutputTestCase(unittest.TestCase):
+    def test_concatenate(self):
+        pieces = []
+        for start, end in [(0, 9), (9, 19)]:
+            tokens = [Token(token.text, token.label, token.position - start)
+                      for token in TOKENIZED_SENTENCE[start:end]]
+            pieces.append(LazaroOutput(tokens, fuse_spans(tokens)))
+        output = LazaroOutput.concatenate(pieces)
+        self.assertEqual(output.tokens, TOKENIZED_SENTENCE)
+        self.assertEqual(output.borrowings, BORROWINGS)
+
+    def test_sentence_outputs(self):
+        pieces = []
+        for start, end in [(0, 9), (9, 19)]:
+            tokens = [Token(token.text, token.label, token.position - start)
+                      for token in TOKENIZED_SENTENCE[start:end]]
+            pieces.append(LazaroOutput(tokens, fuse_spans(tokens)))
+        output = LazaroOutput.concatenate(pieces)
+        self.assertEqual(output.sentence_outputs(), pieces)
+
+    def test_from_arrays(self):
+        words, labels = zip(*TAG_PER_TOKEN)
+        output = LazaroOutput.from_arrays(list(words), list(labels))
+        self.assertEqual(output.borrowings_to_dict(), [bor.to_dict() for bor in BORROWINGS])
+        self.assertEqual(output, LazaroOutput(TOKENIZED_SENTENCE, BORROWINGS))
+        self.assertEqual(output.borrowings, BORROWINGS)
+
+    def test_views_are_copies(self):
+        words, labels = zip(*TAG_PER_TOKEN)
+        output = LazaroOutput.from_arrays(list(words), list(labels))
+        anglicisms, other_borrowings = list(output.anglicisms), list(output.other_borrowings)
+        output.anglicisms.extend(BORROWINGS)
+        output.other_borrowings.extend(BORROWINGS)
+        self.assertEqual(output.anglicisms, anglicisms)
+        self.assertEqual(output.other_borrowings, other_borrowings)
+
+    def test_context(self):
+        pieces = []
+        for start, end in [(0, 9), (9, 19)]:
+            tokens = [Token(token.text, token.label, token.position - start)
+                      for token in TOKENIZED_SENTENCE[start:end]]
+            pieces.append(LazaroOutput(tokens, fuse_spans(tokens)))
+        output = LazaroOutput.concatenate(pieces)
+        self.assertEqual(output.borrowings[0].context_text, "La ' app ' de ' machine learning '")
+        self.assertEqual(output.borrowings[2].kwic(), ("fue un éxito en el festival de '", "anime", "'"))
+        words, labels = zip(*TAG_PER_TOKEN)
+        output = LazaroOutput.from_arrays(list(words), list(labels))
+        output.context_window = 2
+        self.assertEqual([bor.kwic() for bor in output.borrowings],
+                         [("La '", "app", "' de"), ("de '", "machine learning", "' fue"), ("de '", "anime", "'")])
+
+
+    def test_anchor(self):
+        output = LazaroOutput.from_arrays(["un", "look", "."], ["O", "B-ENG", "O"], offsets=[(0, 2), (3, 7), (7, 8)])
+        self.assertIs(output.anchor("un look."), output)
+        anchored = output.anchor("un   look.")
+        self.assertEqual(anchored.offsets, [(0, 2), (5, 9), (9, 10)])
+        self.assertEqual(anchored, output)
+
+
+class TokenTestCase(unittest.TestCase):
+    def test_label_codes(self):
+        token = Token("machine", "B-ENG", 6)
+        self.assertTrue(token.is_begin_label())
+        self.assertEqual(token.bio_label, "B")
+        self.assertEqual(token.lang_label, "ENG")
+        self.assertTrue(Token("de", "O", 4).is_outside_label())
+
+    def test_fuse_spans(self):
+        self.assertEqual(fuse_spans(TOKENIZED_SENTENCE), BORROWINGS)
+        self.assertEqual([bor.tokens for bor in fuse_spans(TOKENIZED_SENTENCE)],
+                         [bor.tokens for bor in BORROWINGS])
+
+
+class TagDecoderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.decoder = TagDecoder(["O", "B-ENG", "I-ENG", "B-OTHER", "I-OTHER"])
+
+    def test_decode(self):
+        labels = [label for _, label in TAG_PER_TOKEN]
+        decoded, ranges = self.decoder.decode(self.decoder.encode(labels))
+        self.assertEqual(decoded, labels)
+        self.assertEqual(ranges, [(bor.start_pos, bor.end_pos, Token("", "B-" + bor.language, 0).lang_code)
+                                  for bor in BORROWINGS])
+
+    def test_inside_after_outside(self):
+        # I after O, or after a borrowing of another language, starts a new borrowing
+        ids = self.decoder.encode(["O", "I-ENG", "I-ENG", "I-OTHER", "O"])
+        _, ranges = self.decoder.decode(ids)
+        self.assertEqual([(start, end) for start, end, _ in ranges], [(1, 3), (3, 4)])
+
+    def test_decode_batch(self):
+        batch = [[0, 1, 2, 0], [], [2, 4, 3, 3, 2], [1]]
+        self.assertEqual(self.decoder.decode_batch(batch), [self.decoder.decode(ids) for ids in batch])
+
+    def test_decode_batch_empty_texts(self):
+        self.assertEqual(TagDecoder().decode_batch([[]]), [([], [])])
+        self.assertEqual(TagDecoder().decode_batch([[], []]), [([], []), ([], [])])
+        decoder = TagDecoder()
+        batch = [[], decoder.encode(["O", "B-ENG", "I-ENG"]), []]
+        self.assertEqual(decoder.decode_batch(batch), [([], []), (["O", "B-ENG", "I-ENG"], [(1, 3, 1)]), ([], [])])
+
+    def test_merge_wordpieces_offsets(self):
+        pieces = ["[CLS]", "un", "lo", "##ok", ".", "[SEP]"]
+        offsets = [(0, 0), (0, 2), (3, 5), (5, 7), (7, 8), (0, 0)]
+        words, labels, word_offsets = merge_wordpieces(pieces, ["O", "O", "B-ENG", "I-ENG", "O", "O"], offsets)
+        self.assertEqual(words, ["un", "look", "."])
+        self.assertEqual(labels, ["O", "B-ENG", "O"])
+        self.assertEqual(word_offsets, [(0, 2), (3, 7), (7, 8)])
+
+
+class WireFormatTestCase(unittest.TestCase):
+    def setUp(self):
+        self.output = LazaroOutput(TOKENIZED_SENTENCE, fuse_spans(TOKENIZED_SENTENCE))
+
+    def test_roundtrip(self):
+        self.assertEqual(unpack_output(pack_output(self.output)), self.output)
+
+    def test_roundtrip_borrowings(self):
+        self.assertEqual(unpack_output(pack_output(self.output)).borrowings, BORROWINGS)
+
+    def test_roundtrip_probabilities(self):
+        tokens = [Token("look", "B-ENG", 0, 0.123456789), Token(".", "O", 2, None)]
+        unpacked = unpack_output(pack_output(LazaroOutput(tokens, fuse_spans(tokens))))
+        self.assertEqual([token.probability for token in unpacked.tokens], [0.123456789, None])
+        self.assertEqual([token.position for token in unpacked.tokens], [0, 2])
+
+    def test_roundtrip_offsets(self):
+        output = LazaroOutput.from_arrays(["un", "look", "."], ["O", "B-ENG", "O"], offsets=[(0, 2), (3, 7), (7, 8)])
+        unpacked = unpack_output(pack_output(output))
+        self.assertEqual(unpacked.offsets, [(0, 2), (3, 7), (7, 8)])
+        self.assertEqual((unpacked.borrowings[0].start_char, unpacked.borrowings[0].end_char), (3, 7))
+
+
+class LazaroPoolTestCase(unittest.TestCase):
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "needs the fork start method")
+    def test_same_outputs_as_in_process(self):
+        tagger = stub_lazaro()
+        texts = ["Fue un look sencillo", "Un festival de anime", "Otro look"] * 3
+        with LazaroPool(processes=2, batch_size=2, tagger=tagger) as pool:
+            outputs = pool.map(texts)
+        self.assertEqual(outputs, tagger.analyze_batch(texts))
+        self.assertEqual(outputs[0].tokens[2].probability, 0.123456789)
+        self.assertEqual(outputs[0].borrowings_to_tuple(), [("look", "ENG")])
+
+
+class BulkTaggingTestCase(unittest.TestCase):
+    def test_guess_format(self):
+        self.assertEqual(bulk.guess_format("corpus.jsonl"), "jsonl")
+        self.assertEqual(bulk.guess_format("corpus.json"), "jsonl")
+        self.assertEqual(bulk.guess_format("corpus.conllu"), "conll")
+        self.assertEqual(bulk.guess_format("corpus.txt"), "text")
+        self.assertEqual(bulk.guess_format("-"), "text")
+
+    def test_readers(self):
+        self.assertEqual(list(bulk.read_text(["Un look\n", "\n", "  Otro  \n"])), [(0, "Un look"), (1, "Otro")])
+        lines = ['{"id": "a", "body": "Un look"}\n', "\n", '{"body": ["Una", "app"]}\n']
+        self.assertEqual(list(bulk.read_jsonl(lines, "body")), [("a", "Un look"), (1, ["Una", "app"])])
+        lines = ["-DOCSTART- O\n", "Un O\n", "look B-ENG\n", "\n", "\n", "Otro O\n"]
+        self.assertEqual(list(bulk.read_conll(lines)), [(0, ["Un", "look"]), (1, ["Otro"])])
+
+    def test_tag_file(self):
+        tagger = stub_lazaro()
+        outfile = io.StringIO()
+        n_docs = bulk.tag_file(io.StringIO("Un look\n\nUn anime\n"), outfile, tagger=tagger)
+        self.assertEqual(n_docs, 2)
+        records = [json.loads(line) for line in outfile.getvalue().splitlines()]
+        self.assertEqual(records[0], {"id": 0, "borrowings": [
+            {"borrowing": "look", "language": "ENG", "start_pos": 1, "end_pos": 2}]})
+        self.assertEqual(records[1]["borrowings"][0]["language"], "OTHER")
+
+    def test_tag_file_jsonl_output_formats(self):
+        tagger = stub_lazaro()
+        infile = '{"id": "a", "body": "Una app"}\n'
+        for output_format, keys in [("borrowings", ["borrowings", "id"]), ("tokens", ["id", "tokens"]),
+                                    ("both", ["borrowings", "id", "tokens"])]:
+            outfile = io.StringIO()
+            bulk.tag_file(io.StringIO(infile), outfile, input_format="jsonl", text_field="body",
+                          output_format=output_format, tagger=tagger)
+            record = json.loads(outfile.getvalue())
+            self.assertEqual(sorted(record), keys)
+            self.assertEqual(record["id"], "a")
+            if "tokens" in record:
+                self.assertEqual(record["tokens"], [["Una", "O"], ["app", "B-ENG"]])
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "needs the fork start method")
+    def test_order_kept_with_workers(self):
+        tagger = stub_lazaro()
+        docs = [(i, "texto {} {}".format(i, "look" if i % 3 else "anime")) for i in range(25)]
+        records = list(bulk.tag_documents(docs, workers=3, batch_size=2, tagger=tagger))
+        self.assertEqual([record["id"] for record in records], list(range(25)))
+        self.assertEqual(records, list(bulk.tag_documents(docs, batch_size=2, tagger=tagger)))
+
+    def test_tag_subcommand(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            infile = os.path.join(tmp, "corpus.jsonl")
+            outfile = os.path.join(tmp, "tagged.jsonl")
+            with open(infile, "w", encoding="utf-8") as f:
+                f.write('{"id": 7, "body": "Fue un look"}\n{"id": 8, "body": "Sin nada"}\n')
+            argv = ["pylazaro", "tag", "--model", "crf", "--input", infile, "--output", outfile,
+                    "--text-field", "body", "--output-format", "both", "--workers", "1"]
+            with mock.patch.object(sys, "argv", argv), \
+                    mock.patch.dict(os.environ, {"PYLAZARO_CONFIG": os.path.join(tmp, "tuned.json")}), \
+                    mock.patch.object(bulk, "Lazaro", lambda **kwargs: stub_lazaro()):
+                cli.main()
+            with open(outfile, encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual([record["id"] for record in records], [7, 8])
+        self.assertEqual(records[0]["borrowings"][0]["borrowing"], "look")
+        self.assertEqual(records[1]["tokens"], [["Sin", "O"], ["nada", "O"]])
+
+
+class SentenceAnalysisTestCase(unittest.TestCase):
+    TEXT = "Fue un look sencillo. Hay una app nueva. Es anime puro."
+
+    def test_sentence_cache_hits(self):
+        classifier = StubClassifier()
+        lazaro = stub_lazaro(classifier)
+        first = lazaro.analyze_sentences(self.TEXT)
+        self.assertEqual(len(classifier.batches[0]), 3)
+        second = lazaro.analyze_sentences("Otra frase. " + self.TEXT)
+        self.assertEqual(classifier.batches[1:], [["Otra frase."]])
+        self.assertEqual(lazaro.sentence_cache.stats.hits, 3)
+        self.assertEqual(first.borrowings_to_tuple(), second.borrowings_to_tuple())
+        text = "Otra frase. " + self.TEXT
+        self.assertEqual([text[b.start_char:b.end_char] for b in second.borrowings], ["look", "app", "anime"])
+
+    def test_reanalyze_only_tags_edited_sentence(self):
+        classifier = StubClassifier()
+        lazaro = stub_lazaro(classifier)
+        previous = lazaro.analyze_sentences(self.TEXT)
+        edited = self.TEXT.replace("un look", "un look muy")
+        output = lazaro.reanalyze(previous, edited)
+        self.assertEqual(classifier.batches[1:], [["Fue un look muy sencillo."]])
+        self.assertEqual(output.borrowings_to_tuple(), [("look", "ENG"), ("app", "ENG"), ("anime", "OTHER")])
+        # offsets of the sentences after the edit point into the new text
+        self.assertEqual([b.start_char for b in output.borrowings], [7, 34, 48])
+        self.assertEqual([edited[b.start_char:b.end_char] for b in output.borrowings], ["look", "app", "anime"])
+
+
+class BatchResultTestCase(unittest.TestCase):
+    def setUp(self):
+        self.outputs = [LazaroOutput(TOKENIZED_SENTENCE, BORROWINGS), LazaroOutput.from_arrays([], [])]
+        self.batch = BatchResult(self.outputs)
+
+    def test_roundtrip(self):
+        self.assertEqual(list(self.batch), self.outputs)
+
+    def test_to_numpy(self):
+        columns = self.batch.to_numpy()
+        self.assertEqual(columns["doc_offsets"].tolist(), [0, 19, 19])
+        self.assertEqual(columns["span_starts"].tolist(), [2, 6, 17])
+
+    def test_offsets(self):
+        output = LazaroOutput.from_arrays(["un", "look", "."], ["O", "B-ENG", "O"], offsets=[(0, 2), (3, 7), (7, 8)])
+        batch = BatchResult([self.outputs[1], output])
+        self.assertEqual(batch.output(1).offsets, [(0, 2), (3, 7), (7, 8)])
+        self.assertEqual(batch.output(1).borrowings[0].start_char, 3)
+        self.assertEqual(batch.output(0).offsets, [])
+
+    def test_probabilities_are_exact(self):
+        output = StubClassifier.tag("Un look")
+        batch = BatchResult([output])
+        self.assertEqual(batch.output(0).probabilities, output.probabilities)
+        self.assertEqual(batch.to_numpy()["probabilities"].dtype, np.float64)
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_borrowings_table(self):
+        self.assertEqual(self.batch.borrowings_table().to_pylist(),
+                         [dict(doc=0, **bor.to_dict()) for bor in BORROWINGS])
+
+
+class CorpusStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.outputs = [LazaroOutput(TOKENIZED_SENTENCE, BORROWINGS), LazaroOutput.from_arrays(["Hola"], ["O"])]
+        self.path = os.path.join(tempfile.mkdtemp(), "corpus.lzc")
+        with CorpusWriter(self.path) as writer:
+            writer.write_all(self.outputs)
+
+    def test_random_access(self):
+        with CorpusReader(self.path) as corpus:
+            self.assertEqual(len(corpus), 2)
+            self.assertEqual(corpus[1], self.outputs[1])
+            self.assertEqual(corpus[0], self.outputs[0])
+
+    def test_offsets(self):
+        output = LazaroOutput.from_arrays(["un", "look", "."], ["O", "B-ENG", "O"], offsets=[(0, 2), (3, 7), (7, 8)])
+        path = os.path.join(tempfile.mkdtemp(), "offsets.lzc")
+        with CorpusWriter(path) as writer:
+            writer.write_all([output, self.outputs[1]])
+        with CorpusReader(path) as corpus:
+            self.assertEqual(corpus[0].offsets, [(0, 2), (3, 7), (7, 8)])
+            self.assertEqual(corpus[0].borrowings[0].end_char, 7)
+            self.assertEqual(corpus[1].offsets, [(None, None)])
+            self.assertEqual(list(corpus.iter_borrowings()), [dict(doc=0, **output.borrowings[0].to_dict())])
+
+    def test_probabilities(self):
+        output = StubClassifier.tag("Fue un look de anime")
+        path = os.path.join(tempfile.mkdtemp(), "probabilities.lzc")
+        with CorpusWriter(path) as writer:
+            writer.write(output)
+        with CorpusReader(path) as corpus:
+            self.assertEqual(corpus[0].probabilities, output.probabilities)
+            self.assertEqual([bor["borrowing"] for bor in corpus.iter_borrowings()], ["look", "anime"])
+
+    def test_not_finalized_after_error(self):
+        path = os.path.join(tempfile.mkdtemp(), "partial.lzc")
+        with self.assertRaises(RuntimeError):
+            with CorpusWriter(path) as writer:
+                writer.write_all(self.outputs)
+                raise RuntimeError("interrupted")
+        self.assertFalse(os.path.exists(path))
+
+    def test_iter_borrowings(self):
+        with CorpusReader(self.path) as corpus:
+            self.assertEqual(list(corpus.iter_borrowings()),
+                             [dict(doc=0, **bor.to_dict()) for bor in BORROWINGS])
+
+
+class BorrowingAggregatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.output = LazaroOutput(TOKENIZED_SENTENCE, BORROWINGS)
+
+    def aggregate(self, **kwargs):
+        partials = []
+        for source in ["a", "b", "a"]:
+            aggregator = BorrowingAggregator(facets=["source"], **kwargs)
+            aggregator.add(self.output, source=source)
+            partials.append(aggregator)
+        return partials[0].merge(partials[1]).merge(partials[2])
+
+    def test_exact(self):
+        aggregator = self.aggregate()
+        self.assertEqual(aggregator.count("app", "ENG", source="a"), 2)
+        self.assertEqual(aggregator.most_common(1), [(("app", "ENG", "a"), 2)])
+        self.assertEqual(aggregator.total, 9)
+
+    def test_approximate(self):
+        aggregator = self.aggregate(approximate=True, top_k=2)
+        self.assertEqual(aggregator.count("anime", "OTHER", source="a"), 2)
+        self.assertEqual(len(aggregator.most_common()), 2)
+
+    def test_heavy_hitters(self):
+        aggregator = BorrowingAggregator(approximate=True, top_k=5, width=2 ** 12)
+        # five frequent borrowings among many that appear once or twice
+        stream = [("frequent%d" % (i % 5) if i % 2 else "rare%d" % (i % 400), "ENG") for i in range(2000)]
+        for pair in stream:
+            aggregator.add_borrowings([pair])
+        self.assertEqual({key[0] for key, _ in aggregator.most_common()}, {"frequent%d" % i for i in range(5)})
+        self.assertLessEqual(len(aggregator._heap), 2 * aggregator.top_k + 64)
+
+    def test_pickle(self):
+        aggregator = self.aggregate(approximate=True, top_k=2)
+        restored = pickle.loads(pickle.dumps(aggregator))
+        self.assertEqual(restored.most_common(), aggregator.most_common())
+        restored.add(self.output, source="b")
+        self.assertEqual(restored.count("anime", "OTHER", source="b"), 2)
+
+    def test_merge_needs_same_settings(self):
+        for settings in [dict(facets=["date"]), dict(approximate=True), dict(normalize=None)]:
+            with self.assertRaises(ValueError):
+                BorrowingAggregator().merge(BorrowingAggregator(**settings))
+        for settings in [dict(top_k=10), dict(width=2 ** 10), dict(depth=2)]:
+            with self.assertRaises(ValueError):
+                BorrowingAggregator(approximate=True).merge(BorrowingAggregator(approximate=True, **settings))
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResultCache(maxsize=1)
+        self.output = LazaroOutput(TOKENIZED_SENTENCE, fuse_spans(TOKENIZED_SENTENCE))
+
+    def test_key(self):
+        self.assertNotEqual(cache_key("un  look\n", "crf"), cache_key("un look", "crf"))
+        self.assertNotEqual(cache_key("un look", "crf"), cache_key("un look", "bilstm"))
+        self.assertNotEqual(cache_key(["un", "look"], "crf"), cache_key("un look", "crf"))
+
+    def test_hits_match_the_text(self):
+        classifier = StubClassifier()
+        lazaro = stub_lazaro(classifier, cache=ResultCache())
+        composed, decomposed = "Un look de caf\u00e9", "Un look de cafe\u0301"
+        lazaro.analyze(composed)
+        for text in [decomposed, "Un  look de caf\u00e9", composed]:
+            output = lazaro.analyze(text)
+            self.assertEqual(output.text.split(), text.split())
+            self.assertEqual([text[start:end] for start, end in output.offsets], text.split())
+        self.assertEqual(len(classifier.batches), 3)
+        self.assertEqual(lazaro.cache.stats.hits, 1)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", self.output)
+        self.assertEqual(self.cache.get("a"), self.output)
+        self.assertEqual((self.cache.stats.hits, self.cache.stats.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        self.cache.put("a", self.output)
+        self.cache.put("b", self.output)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats.evictions, 1)
+
+
+class TimingTestCase(unittest.TestCase):
+    def test_disabled(self):
+        self.assertFalse(timing.enabled())
+        with timing.stage("output", tokens=3) as timed:
+            timed.count(subwords=5)
+
+    def test_record(self):
+        stages = []
+        with timing.record(lambda name, wall, cpu, counts: stages.append(name)) as outer:
+            with timing.stage("crf.spacy", batch_size=2) as timed:
+                timed.count(tokens=10)
+            with timing.record() as inner:
+                with timing.stage("output", tokens=10):
+                    pass
+                with timing.stage("output", tokens=4):
+                    pass
+        self.assertEqual(stages, ["crf.spacy", "output", "output"])
+        self.assertEqual(outer["crf.spacy"].counts, {"batch_size": 2, "tokens": 10})
+        self.assertEqual(inner["output"].calls, 2)
+        self.assertEqual(outer["output"].counts, {"tokens": 14})
+        self.assertNotIn("crf.spacy", inner)
+        self.assertFalse(timing.enabled())
+
+    def test_coalesced_outputs(self):
+        classifier = StubClassifier(release=threading.Event())
+        lazaro = stub_lazaro(classifier, coalesce=True, record_timings=True)
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(lazaro.analyze, "Fue un look sencillo") for _ in range(2)]
+            while lazaro.coalescing_stats.calls < 2:
+                time.sleep(0.01)
+            classifier.release.set()
+            first, second = [future.result() for future in futures]
+        # both calls shared one computation, but each got its own timings
+        self.assertEqual(lazaro.coalescing_stats.coalesced, 1)
+        self.assertEqual(first, second)
+        self.assertIsNot(first.timings, second.timings)
+
+
+class FeatureProfilerTestCase(unittest.TestCase):
+    def test_profile_features(self):
+        import spacy
+
+        nlp = spacy.blank("es")
+        extractor = WindowedTokenFeatureExtractor([BiasFeature(), TokenFeature(), UppercaseFeature()], 1)
+        docs = [nlp("Me encanta el BRUNCH de los domingos"), nlp("Un selfie")]
+        profile = profile_features(extractor, docs)
+        self.assertEqual(profile.tokens, 9)
+        self.assertEqual(profile.stats[("TokenFeature", 0)].calls, 9)
+        self.assertEqual(profile.stats[("TokenFeature", -1)].calls, 7)
+        by_extractor = profile.by_extractor()
+        self.assertEqual(by_extractor["TokenFeature"].features, 9 + 7 + 7)
+        self.assertEqual(by_extractor["BiasFeature"].features, 9)
+        self.assertEqual(by_extractor["UppercaseFeature"].features, 3)
+        records = profile.to_records(by_offset=True)
+        self.assertEqual(len(records), 9)
+        self.assertAlmostEqual(sum(record["share"] for record in records), 1.0)
+        self.assertIn("TokenFeature", profile.report())
+
+
+class MemoryGrowthTestCase(unittest.TestCase):
+    def test_word_probability_lookups_do_not_grow(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "words.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("look\nbrunch\nselfie\n")
+            word_probability = WordProbability(path)
+        n_bigrams, n_trigrams = len(word_probability.bigram_counts), len(word_probability.trigram_counts)
+        self.assertEqual(word_probability.get_trigram_prob("q", "x", "z"), 1e-10)
+        word_probability.get_word_probability("zyxwvq")
+        self.assertEqual(len(word_probability.bigram_counts), n_bigrams)
+        self.assertEqual(len(word_probability.trigram_counts), n_trigrams)
+
+    def test_shared_memory_zone(self):
+        import spacy
+
+        nlp = spacy.blank("es")
+        zone = SharedMemoryZone(nlp, max_docs=3)
+        n_strings = len(nlp.vocab.strings)
+
+        def tag(i):
+            with zone(1):
+                return [token.text for token in nlp("palabranueva%d otraquenoexiste%d" % (i, i))]
+
+        with ThreadPoolExecutor(4) as executor:
+            words = list(executor.map(tag, range(20)))
+        self.assertEqual(words[7], ["palabranueva7", "otraquenoexiste7"])
+        if hasattr(nlp, "memory_zone"):
+            self.assertEqual(len(nlp.vocab.strings), n_strings)
+
+
+class EvaluationTestCase(unittest.TestCase):
+    GOLD = [
+        "-DOCSTART- O", "",
+        "Fue O", "un O", "look B-ENG", "sencillo O", ". O", "",
+        "Un O", "festival O", "de O", "anime B-OTHER", "y O", "street B-ENG", "food I-ENG", "",
+    ]
+
+    class Tagger(object):
+        model_type = "fixed"
+
+        def __init__(self, labels, merge=False):
+            self.labels = labels
+            self.merge = merge
+
+        def analyze_batch(self, texts):
+            outputs = []
+            for text in texts:
+                if isinstance(text, list):
+                    outputs.append(LazaroOutput.from_arrays(text, self.labels[" ".join(text)]))
+                    continue
+                # with merge, "street food" is a single token
+                words = (text.replace("street food", "street_food") if self.merge else text).split()
+                starts = [sum(len(word) + 1 for word in words[:i]) for i in range(len(words))]
+                outputs.append(LazaroOutput.from_arrays(
+                    [word.replace("_", " ") for word in words], self.labels[text][:len(words)],
+                    offsets=[(start, start + len(word)) for start, word in zip(starts, words)]))
+            return outputs
+
+    def test_read_conll_gold(self):
+        sentences = list(read_conll_gold(self.GOLD))
+        self.assertEqual(len(sentences), 2)
+        self.assertEqual(sentences[0], (["Fue", "un", "look", "sencillo", "."], ["O", "O", "B-ENG", "O", "O"]))
+
+    def test_evaluate(self):
+        tagger = self.Tagger({
+            "Fue un look sencillo .": ["O", "O", "B-ENG", "O", "O"],
+            "Un festival de anime y street food": ["O", "O", "O", "B-ENG", "O", "B-ENG", "O"],
+        })
+        result = evaluate(tagger, read_conll_gold(self.GOLD), batch_size=1)
+        self.assertEqual((result.scores["ENG"].gold, result.scores["ENG"].predicted, result.scores["ENG"].correct),
+                         (2, 3, 1))
+        self.assertEqual(result.scores["OTHER"].recall, 0.0)
+        self.assertAlmostEqual(result.scores["ALL"].f1, 2 * (1 / 3) * (1 / 3) / (2 / 3))
+        self.assertEqual((result.n_docs, result.n_tokens, len(result.latencies)), (2, 12, 2))
+        self.assertIn("fixed", format_table([result]))
+
+    def test_evaluate_pretokenized(self):
+        tagger = self.Tagger({
+            "Fue un look sencillo .": ["O", "O", "B-ENG", "O", "O"],
+            "Un festival de anime y street food": ["O", "O", "O", "B-OTHER", "O", "B-ENG", "I-ENG"],
+        })
+        result = evaluate(tagger, read_conll_gold(self.GOLD), pretokenized=True)
+        self.assertEqual(result.scores["ALL"].f1, 1.0)
+        self.assertEqual(result.name, "fixed (pretokenized)")
+
+    def test_evaluate_merged_tokens(self):
+        # the tagger sees "street food" as one token, which is moved back to the two gold tokens
+        tagger = self.Tagger({
+            "Fue un look sencillo .": ["O", "O", "B-ENG", "O", "O"],
+            "Un festival de anime y street food": ["O", "O", "O", "B-OTHER", "O", "B-ENG"],
+        }, merge=True)
+        result = evaluate(tagger, read_conll_gold(self.GOLD))
+        self.assertEqual(result.scores["ALL"].f1, 1.0)
+
+    def test_project_spans(self):
+        # the tagger split "l'anime" in two tokens
+        spans = project_spans([(1, 3, 2)], ["un", "l'", "anime"], ["un", "l'anime"])
+        self.assertEqual(spans, [(1, 2, 2)])
+
+    def test_spans_projected_onto_one_gold_span(self):
+        # "l'" and "anime" are tagged as two borrowings that both land on the gold token "l'anime"
+        spans = project_spans([(1, 2, 2), (2, 3, 2)], ["un", "l'", "anime"], ["un", "l'anime"])
+        self.assertEqual(spans, [(1, 2, 2)])
+        gold = SpanColumns()
+        predicted = SpanColumns()
+        predicted.extend([(1, 2, 2), (1, 2, 2)], 0)
+        scores = match_spans(gold, predicted)
+        self.assertEqual((scores["ALL"].gold, scores["ALL"].predicted, scores["ALL"].correct), (0, 1, 0))
+        gold.extend([(1, 2, 2)], 0)
+        scores = match_spans(gold, predicted)
+        self.assertEqual((scores["ALL"].gold, scores["ALL"].predicted, scores["ALL"].correct), (1, 1, 1))
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.requests = self.registry.counter("requests_total", "Requests", ["backend"])
+        self.latency = self.registry.histogram("latency_seconds", "Latency", ["backend"], [0.1, 1.0])
+
+    def test_snapshot(self):
+        self.requests.inc("crf")
+        self.requests.inc("crf", amount=2)
+        self.latency.observe(0.05, "crf")
+        self.latency.observe(0.5, "crf")
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot["requests_total"], [{"labels": {"backend": "crf"}, "value": 3}])
+        latency = snapshot["latency_seconds"][0]
+        self.assertEqual(latency["count"], 2)
+        self.assertAlmostEqual(latency["sum"], 0.55)
+        self.assertEqual(list(latency["buckets"].values()), [1, 2, 2])
+        with self.assertRaises(ValueError):
+            self.requests.inc("crf", "analyze")
+
+    def test_threads(self):
+        threads = [threading.Thread(target=lambda: [self.requests.inc("bilstm") for _ in range(1000)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.requests.inc("bilstm")
+        self.assertEqual(self.registry.snapshot()["requests_total"][0]["value"], 8001)
+        self.registry.reset()
+        self.assertEqual(self.registry.snapshot()["requests_total"], [])
+
+    def test_prometheus(self):
+        self.requests.inc("crf")
+        self.latency.observe(2.0, "crf")
+        text = self.registry.to_prometheus()
+        self.assertIn("# TYPE requests_total counter\nrequests_total{backend=\"crf\"} 1\n", text)
+        self.assertIn('latency_seconds_bucket{backend="crf",le="1.0"} 0', text)
+        self.assertIn('latency_seconds_bucket{backend="crf",le="+Inf"} 1', text)
+        self.assertIn('latency_seconds_count{backend="crf"} 1', text)
+
+    def test_other_processes(self):
+        other = MetricsRegistry()
+        other.counter("requests_total", "Requests", ["backend"]).inc("crf", amount=2)
+        other.histogram("latency_seconds", "Latency", ["backend"], [0.1, 1.0]).observe(0.5, "crf")
+        exported = json.loads(json.dumps(other.export()))
+        self.requests.inc("crf")
+        self.latency.observe(0.05, "crf")
+        snapshot = self.registry.snapshot([exported])
+        self.assertEqual(snapshot["requests_total"], [{"labels": {"backend": "crf"}, "value": 3}])
+        self.assertEqual(list(snapshot["latency_seconds"][0]["buckets"].values()), [1, 2, 2])
+        self.assertIn('requests_total{backend="crf"} 3', self.registry.to_prometheus([exported]))
+        # the metrics of this process are unchanged
+        self.assertEqual(self.registry.snapshot()["requests_total"][0]["value"], 1)
+
+
+class TuningTestCase(unittest.TestCase):
+    RUNS = [
+        {"batch_size": 1, "docs_per_sec": 100.0, "latency_p95_ms": 10.0},
+        {"batch_size": 8, "docs_per_sec": 300.0, "latency_p95_ms": 50.0},
+        {"batch_size": 32, "docs_per_sec": 400.0, "latency_p95_ms": 200.0},
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "tuned.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_best_run(self):
+        self.assertEqual(best_run(self.RUNS)["batch_size"], 32)
+        self.assertEqual(best_run(self.RUNS, max_latency_ms=100)["batch_size"], 8)
+        # no run is within the bound: the one with the lowest latency
+        self.assertEqual(best_run(self.RUNS, max_latency_ms=5)["batch_size"], 1)
+
+    def test_save_and_load(self):
+        save_tuned_settings("crf", {"batch_size": 8, "workers": 2}, path=self.path)
+        save_tuned_settings("crf", {"batch_size": 4}, model_file="other.crf", path=self.path)
+        self.assertEqual(tuned_settings("crf", path=self.path), {"batch_size": 8, "workers": 2})
+        self.assertEqual(tuned_settings("crf", "other.crf", path=self.path), {"batch_size": 4})
+        self.assertEqual(tuned_settings("bilstm", path=self.path), {})
+
+    def test_other_host(self):
+        host = dict(host_info(), cpu_count=(os.cpu_count() or 1) + 1)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"host": host, "models": {"crf": {"batch_size": 8}}}, f)
+        self.assertEqual(tuned_settings("crf", path=self.path), {})
+
+    def test_worker_threads(self):
+        settings = {"num_threads": 8, "batch_size": 16, "workers": 4, "worker_threads": 2}
+        save_tuned_settings("transformers", settings, path=self.path)
+        with mock.patch.dict(os.environ, {"PYLAZARO_CONFIG": self.path}):
+            # a single process keeps all of its threads; only the tuned number of workers shares them
+            self.assertEqual(tuned_threads("transformers"), 8)
+            self.assertEqual(tuned_threads("transformers", workers=4), 2)
+            self.assertIsNone(tuned_threads("transformers", workers=2))
+            self.assertEqual(Lazaro(model_type="transformers", lazy=True).num_threads, 8)
+
+    def test_broken_file(self):
+        save_tuned_settings("crf", {"batch_size": 8}, path=self.path)
+        with open(self.path, "r+", encoding="utf-8") as f:
+            f.truncate(20)
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(tuned_settings("crf", path=self.path), {})
+        self.assertEqual(os.listdir(self.directory.name), ["tuned.json"])
+
+    def test_lazaro_defaults(self):
+        save_tuned_settings("crf", {"num_threads": None, "batch_size": 8}, path=self.path)
+        with mock.patch.dict(os.environ, {"PYLAZARO_CONFIG": self.path}):
+            self.assertEqual(Lazaro(model_type="crf", lazy=True).max_batch_size, 8)
+            self.assertEqual(Lazaro(model_type="crf", lazy=True, max_batch_size=2).max_batch_size, 2)
+            self.assertEqual(Lazaro(model_type="bilstm", lazy=True).max_batch_size, 16)
+
+
+class AnalyzeAsyncTestCase(unittest.TestCase):
+    def test_concurrent_awaits_share_batches(self):
+        classifier = StubClassifier()
+        lazaro = stub_lazaro(classifier, max_batch_size=4, max_wait_ms=50)
+        texts = ["texto {} con look".format(i) for i in range(10)]
+
+        async def main():
+            return await asyncio.gather(*[lazaro.analyze_async(text) for text in texts])
+
+        outputs = asyncio.run(main())
+        self.assertEqual([len(batch) for batch in classifier.batches], [4, 4, 2])
+        self.assertEqual(sum(classifier.batches, []), texts)
+        self.assertEqual([output.text for output in outputs], texts)
+        self.assertTrue(all(output.borrowings_to_tuple() == [("look", "ENG")] for output in outputs))
+
+    def test_batch_closed_after_max_wait_ms(self):
+        classifier = StubClassifier()
+        lazaro = stub_lazaro(classifier, max_batch_size=16, max_wait_ms=100)
+
+        async def main():
+            start = time.monotonic()
+            first = asyncio.ensure_future(lazaro.analyze_async("uno"))
+            await asyncio.sleep(0.4)
+            self.assertTrue(first.done())
+            await lazaro.analyze_async("dos")
+            return time.monotonic() - start
+
+        elapsed = asyncio.run(main())
+        self.assertEqual(classifier.batches, [["uno"], ["dos"]])
+        self.assertGreaterEqual(elapsed, 0.5)
+
+    def test_timeout(self):
+        release = threading.Event()
+        classifier = StubClassifier(release=release)
+        lazaro = stub_lazaro(classifier, max_wait_ms=1)
+
+        async def main():
+            running = asyncio.ensure_future(lazaro.analyze_async("uno"))
+            await asyncio.sleep(0.1)
+            with self.assertRaises(asyncio.TimeoutError):
+                await lazaro.analyze_async("dos", timeout=0.1)
+            release.set()
+            await running
+            await lazaro.analyze_async("tres")
+
+        asyncio.run(main())
+        # the request that timed out while queued never reaches the classifier
+        self.assertEqual(classifier.batches, [["uno"], ["tres"]])
+
+    def test_cancelled_request_is_dropped(self):
+        release = threading.Event()
+        classifier = StubClassifier(release=release)
+        lazaro = stub_lazaro(classifier, max_wait_ms=1)
+
+        async def main():
+            running = asyncio.ensure_future(lazaro.analyze_async("uno"))
+            await asyncio.sleep(0.1)
+            queued = asyncio.ensure_future(lazaro.analyze_async("dos"))
+            await asyncio.sleep(0.05)
+            queued.cancel()
+            release.set()
+            await running
+            await lazaro.analyze_async("tres")
+            return queued
+
+        queued = asyncio.run(main())
+        self.assertTrue(queued.cancelled())
+        self.assertEqual(classifier.batches, [["uno"], ["tres"]])
+
+    def test_reuse_across_event_loops(self):
+        classifier = StubClassifier()
+        lazaro = stub_lazaro(classifier)
+        for text in ["un look", "una app"]:
+            output = asyncio.run(lazaro.analyze_async(text))
+            self.assertEqual(output.text, text)
+        self.assertEqual(classifier.batches, [["un look"], ["una app"]])
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def test_concurrent_calls_share_one_computation(self):
+        single_flight = SingleFlight()
+        computations = []
+
+        def compute():
+            computations.append(1)
+            time.sleep(0.2)
+            return object()
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: single_flight.do("key", compute), range(8)))
+        self.assertEqual(len(computations), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(single_flight.stats.coalesced, 7)
+
+    def test_concurrent_awaits_share_one_computation(self):
+        release = threading.Event()
+        classifier = StubClassifier(release=release)
+        lazaro = stub_lazaro(classifier, coalesce=True)
+
+        async def main():
+            waiters = [asyncio.ensure_future(lazaro.analyze_async("Un look")) for _ in range(5)]
+            await asyncio.sleep(0.1)
+            release.set()
+            return await asyncio.gather(*waiters)
+
+        outputs = asyncio.run(main())
+        self.assertEqual(classifier.batches, [["Un look"]])
+        self.assertEqual(lazaro.coalescing_stats.coalesced, 4)
+        self.assertTrue(all(output.borrowings_to_tuple() == [("look", "ENG")] for output in outputs))
+
+    def test_exception_reaches_every_waiter(self):
+        release = threading.Event()
+        classifier = StubClassifier(release=release, error=ValueError("boom"))
+        lazaro = stub_lazaro(classifier, coalesce=True)
+
+        async def main():
+            waiters = [asyncio.ensure_future(lazaro.analyze_async("Un look")) for _ in range(5)]
+            await asyncio.sleep(0.1)
+            release.set()
+            return await asyncio.gather(*waiters, return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertEqual(len(classifier.batches), 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = LazaroHTTPServer(ServerConfig(model_type="crf", model_file="/nonexistent/model.crf", port=0))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, path):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_model_that_fails_to_load(self):
+        for _ in range(100):
+            status, body = self._get("/ready")
+            if body["status"] != "loading":
+                break
+            time.sleep(0.1)
+        self.assertEqual((status, body["status"]), (503, "failed"))
+
+    def test_metrics_of_other_workers(self):
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            other = MetricsRegistry()
+            other.counter("pylazaro_requests_total", "Requests", ["backend", "method"]).inc("other", "analyze",
+                                                                                            amount=5)
+            with open(os.path.join(metrics_dir, "1.json"), "w", encoding="utf-8") as f:
+                json.dump(other.export(), f)
+            server = LazaroHTTPServer(ServerConfig(model_type="crf", model_file="/nonexistent/model.crf", port=0),
+                                      metrics_dir=metrics_dir)
+            try:
+                self.assertIn('pylazaro_requests_total{backend="other",method="analyze"} 5',
+                              metrics.to_prometheus(server.sibling_metrics()))
+                self.assertEqual(len(server.sibling_metrics()), 1)
+            finally:
+                server.server_close()
+
+    def test_invalid_content_length(self):
+        for length in ("abc", "-1"):
+            with socket.create_connection(("127.0.0.1", self.port), timeout=10) as client:
+                client.sendall(("POST /analyze HTTP/1.1\r\nHost: localhost\r\nContent-Length: %s\r\n\r\n{}"
+                                % length).encode("ascii"))
+                self.assertTrue(client.recv(1024).startswith(b"HTTP/1.1 400"))
+
+    def _post(self, port, body):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        connection.request("POST", "/analyze", json.dumps(body), {"Content-Type": "application/json"})
+        try:
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_too_many_queued_texts(self):
+        release = threading.Event()
+        classifier = StubClassifier(release=release)
+        server = LazaroHTTPServer(ServerConfig(port=0, max_batch_size=2, max_wait_ms=1, max_queue_size=3),
+                                  tagger=stub_lazaro(classifier))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+        try:
+            with ThreadPoolExecutor(2) as executor:
+                self.assertTrue(wait_until(server.is_ready))
+                running = executor.submit(self._post, port, {"texts": ["un look", "otro"]})
+                self.assertTrue(wait_until(lambda: classifier.batches))
+                queued = executor.submit(self._post, port, {"texts": ["una app", "dos", "tres"]})
+                self.assertTrue(wait_until(lambda: server.batcher.qsize() == 3))
+                self.assertEqual(self._post(port, {"text": "uno más"})[0], 429)
+                release.set()
+                self.assertEqual(running.result()[0], 200)
+                status, body = queued.result()
+        finally:
+            release.set()
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(status, 200)
+        self.assertEqual([result["borrowings"] for result in body["results"]],
+                         [[{"borrowing": "app", "language": "ENG", "start_pos": 1, "end_pos": 2}], [], []])
+        # the request with three texts was split into batches of at most max_batch_size texts
+        self.assertEqual(classifier.batches, [["un look", "otro"], ["una app", "dos"], ["tres"]])
+
+
+class LazaroPickleTestCase(unittest.TestCase):
+    def test_pickles_settings_only(self):
+        lazaro = Lazaro(model_type="transformers", lazy=True, max_batch_size=8)
+        unpickled = pickle.loads(pickle.dumps(lazaro))
+        self.assertIsNone(unpickled._classifier)
+        self.assertEqual(unpickled.model_type, "transformers")
+        self.assertEqual(unpickled.max_batch_size, 8)
+
 
 if __name__ == "__main__":
     unittest.main()